@@ -8,17 +8,20 @@ from pydantic import BaseModel, HttpUrl
 from typing import Optional
 from datetime import datetime
 import uuid
-import io
 
-from app.database import get_db
-from app.models import User, Source, Chunk
+from app.config import settings
+from app.database import get_db, mark_write
+from app.models import Source, Chunk
 from app.processors.audio_processor import AudioProcessor
 from app.processors.document_processor import DocumentProcessor
 from app.processors.web_processor import WebProcessor
 from app.processors.text_processor import TextProcessor
-from app.services.storage import storage_service
+from app.services.blobs import blob_store
 from app.services.embeddings import embedding_service
 from app.services.vector_db import vector_db
+from app.services.cache import corpus_versions
+from app.services.temporal import to_epoch
+from app.services.users import user_service, to_user_uuid
 
 router = APIRouter()
 
@@ -28,6 +31,24 @@ document_processor = DocumentProcessor()
 web_processor = WebProcessor()
 text_processor = TextProcessor()
 
+MAX_FILE_SIZE = 500 * 1024 * 1024  # 500MB
+
+
+def check_upload_size(file: UploadFile) -> int:
+    """Return the upload size, rejecting oversized files before any of it is read."""
+    file_size = file.size
+    if file_size is None:
+        file.file.seek(0, 2)
+        file_size = file.file.tell()
+        file.file.seek(0)
+    
+    if file_size > MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large. Maximum size is {MAX_FILE_SIZE / (1024 * 1024):.0f}MB, got {file_size / (1024 * 1024):.2f}MB"
+        )
+    return file_size
+
 
 class TextIngestRequest(BaseModel):
     text: str
@@ -40,30 +61,6 @@ class WebIngestRequest(BaseModel):
     user_id: str
 
 
-async def get_or_create_user(db: AsyncSession, user_id: str) -> User:
-    """Get or create a user."""
-    # Convert user_id to UUID - if not valid UUID, generate one deterministically
-    try:
-        user_uuid = uuid.UUID(user_id)
-    except ValueError:
-        # If not a valid UUID, generate a deterministic UUID from the string
-        import hashlib
-        namespace = uuid.UUID('6ba7b810-9dad-11d1-80b4-00c04fd430c8')  # DNS namespace
-        user_uuid = uuid.uuid5(namespace, user_id)
-    
-    result = await db.execute(
-        select(User).where(User.id == user_uuid)
-    )
-    user = result.scalar_one_or_none()
-    
-    if not user:
-        user = User(id=user_uuid, email=f"{user_id}@twinmind.local")
-        db.add(user)
-        await db.flush()
-    
-    return user
-
-
 async def store_chunks(
     db: AsyncSession,
     source: Source,
@@ -82,30 +79,47 @@ async def store_chunks(
         # Store in PostgreSQL
         db_chunk = Chunk(
             id=chunk_id,
+            user_id=source.user_id,
             source_id=source.id,
             chunk_index=chunk.chunk_index,
             text=chunk.text,
             token_count=chunk.token_count,
             start_char_offset=chunk.start_char_offset,
             end_char_offset=chunk.end_char_offset,
-            metadata=chunk.metadata
+            meta=chunk.metadata
         )
         db.add(db_chunk)
         
         # Store in vector DB
+        payload = {
+            "user_id": str(to_user_uuid(user_id)),
+            "source_id": str(source.id),
+            "chunk_text": chunk.text[:500],  # First 500 chars for preview
+            "timestamp": source.ingestion_timestamp.isoformat(),
+            "effective_ts": to_epoch(source.source_timestamp or source.ingestion_timestamp),
+            "source_type": source.source_type
+        }
+        if settings.QDRANT_FULL_PAYLOAD:
+            # Lets retrieval hydrate vector hits without a PostgreSQL round trip
+            payload.update({
+                "text": chunk.text,
+                "chunk_index": chunk.chunk_index,
+                "chunk_metadata": chunk.metadata,
+                "source_name": source.source_name,
+                "source_url": source.source_url,
+                "source_metadata": source.meta
+            })
         await vector_db.upsert_chunk(
             chunk_id=str(chunk_id),
             vector=embedding,
-            payload={
-                "user_id": user_id,
-                "source_id": str(source.id),
-                "chunk_text": chunk.text[:500],  # First 500 chars for preview
-                "timestamp": source.ingestion_timestamp.isoformat(),
-                "source_type": source.source_type
-            }
+            payload=payload
         )
     
+    mark_write(db, user_id)
     await db.commit()
+    
+    # New chunks are visible; drop cached retrieval results for this user
+    await corpus_versions.bump(str(source.user_id))
 
 
 @router.post("/audio")
@@ -124,31 +138,27 @@ async def ingest_audio(
             detail=f"Unsupported audio/video format. Supported formats: {', '.join(supported_extensions)}"
         )
     
-    # Get or create user
-    user = await get_or_create_user(db, user_id)
-    
-    # Read file (size check will happen after reading)
-    # Note: For very large files, we read in chunks, but FastAPI UploadFile handles this
-    file_data = await file.read()
-    
-    # Check file size after reading (max 500MB)
-    MAX_FILE_SIZE = 500 * 1024 * 1024  # 500MB
-    file_size = len(file_data)
+    # Check file size before reading anything (max 500MB)
+    check_upload_size(file)
     
-    if file_size > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=413,
-            detail=f"File too large. Maximum size is {MAX_FILE_SIZE / (1024 * 1024):.0f}MB, got {file_size / (1024 * 1024):.2f}MB"
-        )
+    # Get or create user
+    user_uuid = await user_service.ensure_user(db, user_id)
+    mark_write(db, user_id)
     
     # Save to object storage
-    storage_key = f"audio/{user_id}/{uuid.uuid4()}{file.filename}"
-    file_obj = io.BytesIO(file_data)
-    await storage_service.save_file(file_obj, storage_key, content_type=file.content_type)
+    # Streamed from the spooled upload rather than an in-memory copy
+    await file.seek(0)
+    storage_key = await blob_store.save_upload(
+        file.file, f"audio/{user_id}", file.filename, content_type=file.content_type
+    )
+    
+    # Transcription needs the bytes after the request has closed the upload
+    await file.seek(0)
+    file_data = await file.read()
     
     # Create source record immediately (before processing)
     source = Source(
-        user_id=user.id,
+        user_id=user_uuid,
         source_type="audio",
         source_name=file.filename,
         object_storage_key=storage_key,
@@ -231,18 +241,23 @@ async def ingest_document(
             detail=f"Unsupported document format. Supported formats: {', '.join(supported_extensions)}"
         )
     
-    # Get or create user
-    user = await get_or_create_user(db, user_id)
+    # Check file size before reading anything
+    check_upload_size(file)
     
-    # Read file
-    file_data = await file.read()
+    # Get or create user
+    user_uuid = await user_service.ensure_user(db, user_id)
+    mark_write(db, user_id)
     
     # Save to object storage
-    storage_key = f"documents/{user_id}/{uuid.uuid4()}{file.filename}"
-    file_obj = io.BytesIO(file_data)
-    await storage_service.save_file(file_obj, storage_key, content_type=file.content_type)
+    # Streamed from the spooled upload rather than an in-memory copy
+    await file.seek(0)
+    storage_key = await blob_store.save_upload(
+        file.file, f"documents/{user_id}", file.filename, content_type=file.content_type
+    )
     
-    # Process document
+    # Process document (parsers need the bytes)
+    await file.seek(0)
+    file_data = await file.read()
     full_text, chunks, metadata = await document_processor.process(
         file_data=file_data,
         filename=file.filename,
@@ -251,12 +266,12 @@ async def ingest_document(
     
     # Create source
     source = Source(
-        user_id=user.id,
+        user_id=user_uuid,
         source_type="document",
         source_name=file.filename,
         object_storage_key=storage_key,
         ingestion_timestamp=datetime.utcnow(),
-        metadata=metadata
+        meta=metadata
     )
     db.add(source)
     await db.flush()
@@ -279,7 +294,8 @@ async def ingest_web(
 ):
     """Ingest web content from URL."""
     # Get or create user
-    user = await get_or_create_user(db, request.user_id)
+    user_uuid = await user_service.ensure_user(db, request.user_id)
+    mark_write(db, request.user_id)
     
     # Process web content
     full_text, chunks, metadata = await web_processor.process(
@@ -289,13 +305,13 @@ async def ingest_web(
     
     # Create source
     source = Source(
-        user_id=user.id,
+        user_id=user_uuid,
         source_type="web",
         source_name=metadata.get("title", str(request.url)),
         source_url=str(request.url),
         ingestion_timestamp=datetime.utcnow(),
         source_timestamp=datetime.fromisoformat(metadata["publish_date"]) if metadata.get("publish_date") else None,
-        metadata=metadata
+        meta=metadata
     )
     db.add(source)
     await db.flush()
@@ -318,7 +334,8 @@ async def ingest_text(
 ):
     """Ingest plain text."""
     # Get or create user
-    user = await get_or_create_user(db, request.user_id)
+    user_uuid = await user_service.ensure_user(db, request.user_id)
+    mark_write(db, request.user_id)
     
     # Process text
     full_text, chunks, metadata = await text_processor.process(
@@ -329,11 +346,11 @@ async def ingest_text(
     
     # Create source
     source = Source(
-        user_id=user.id,
+        user_id=user_uuid,
         source_type="text",
         source_name=metadata.get("title", "Text Note"),
         ingestion_timestamp=datetime.utcnow(),
-        metadata=metadata
+        meta=metadata
     )
     db.add(source)
     await db.flush()
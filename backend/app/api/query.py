@@ -1,25 +1,70 @@
 """
 Query API endpoints.
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from pydantic import BaseModel
-from typing import Optional
-import json
+from pydantic import BaseModel, Field, field_validator
+from typing import Optional, Literal, List
+from zoneinfo import ZoneInfo
+import asyncio
+import logging
+import orjson
+import re
 
-from app.database import get_db
+from app.config import settings
+from app.database import get_read_db
 from app.services.retrieval import retrieval_service
 from app.services.llm import llm_service
+from app.services.context_packer import context_packer
+from app.services.embeddings import embedding_service
+from app.services.cache import answer_cache, corpus_versions
+from app.services.temporal import temporal_parser
+from app.services.admission import AdmissionRejected, Priority
+from app.services.sessions import session_store
+from app.services.users import to_user_uuid
+from app.api.streaming import ORJSON_OPTIONS, sse_response
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
-class QueryRequest(BaseModel):
+class RetrievalOptions(BaseModel):
+    keyword_mode: Optional[Literal["substring", "fuzzy", "auto"]] = None
+    fusion_strategy: Optional[Literal["rrf", "zscore", "maxnorm"]] = None
+    diversify: Optional[bool] = None
+    mmr_lambda: Optional[float] = Field(default=None, ge=0.0, le=1.0)
+    per_source_cap: Optional[int] = Field(default=None, ge=0)
+    timezone: Optional[str] = None
+    context_neighbors: Optional[int] = Field(default=None, ge=0, le=10)
+    
+    @field_validator("timezone")
+    @classmethod
+    def validate_timezone(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None:
+            try:
+                ZoneInfo(value)
+            except (ValueError, KeyError):
+                raise ValueError(f"Unknown timezone: {value}")
+        return value
+
+
+class QueryRequest(RetrievalOptions):
     query: str
     user_id: str
     max_results: int = 10
     stream: bool = False
+    context_token_budget: Optional[int] = Field(default=None, ge=100)
+    use_answer_cache: bool = True
+    session_id: Optional[str] = Field(default=None, max_length=100)
+
+
+class BatchQueryRequest(RetrievalOptions):
+    queries: List[str] = Field(..., min_length=1, max_length=settings.BATCH_QUERY_MAX_QUERIES)
+    user_id: str
+    max_results: int = 10
+    generate_answers: bool = True
 
 
 class QueryResponse(BaseModel):
@@ -31,146 +76,365 @@ class QueryResponse(BaseModel):
 @router.post("", response_model=QueryResponse)
 async def query_knowledge_base(
     request: QueryRequest,
-    db: AsyncSession = Depends(get_db)
+    http_request: Request,
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Query the knowledge base."""
+    # Near-identical questions are answered from the semantic answer cache
+    query_embedding, cache_options, cached = await _answer_cache_lookup(request)
+    if cached:
+        if request.stream:
+            return sse_response(http_request, _replay_answer(cached))
+        return QueryResponse(
+            answer=cached["answer"],
+            sources=cached["sources"],
+            query_metadata={
+                "retrieval_strategy": "hybrid",
+                "answer_cache": "hit",
+                "similarity": cached["similarity"]
+            }
+        )
+    
     # Retrieve relevant chunks
-    chunks = await retrieval_service.retrieve(
-        query=request.query,
-        user_id=request.user_id,
-        db=db,
-        top_k=request.max_results
-    )
+    retrieval_stats = {}
+    chunks = await _retrieve(request, db, query_embedding, retrieval_stats)
     
     if not chunks:
         return QueryResponse(
             answer="I couldn't find any relevant information in your knowledge base to answer this question.",
             sources=[],
-            query_metadata={"retrieval_strategy": "hybrid"}
+            query_metadata={"retrieval_strategy": "hybrid", **retrieval_stats}
         )
     
     # Format chunks for LLM
-    context_chunks = [
-        {
-            "text": chunk["text"],
-            "source_name": chunk["source"]["name"],
-            "source_type": chunk["source"]["type"]
-        }
-        for chunk in chunks
-    ]
+    context_chunks, context_stats = context_packer.pack(chunks, request.context_token_budget)
     
     # Generate answer
     if request.stream:
         # Streaming response
-        return StreamingResponse(
-            _stream_answer(request.query, context_chunks),
-            media_type="text/event-stream"
-        )
+        llm_service.check_admission()
+        return sse_response(http_request, _answer_events(
+            request, chunks, context_chunks, context_stats, retrieval_stats, query_embedding, cache_options
+        ))
     else:
         # Non-streaming response
+        llm_usage = {}
         answer = await llm_service.generate_answer(
             query=request.query,
             context_chunks=context_chunks,
-            stream=False
+            stream=False,
+            usage=llm_usage
         )
+        sources = _format_sources(chunks)
+        if _cacheable(cache_options, retrieval_stats, llm_usage):
+            await answer_cache.store(
+                _cache_user(request), query_embedding, cache_options, answer, sources
+            )
         
         return QueryResponse(
             answer=answer,
-            sources=[
-                {
-                    "source_id": chunk["source"]["id"],
-                    "source_name": chunk["source"]["name"],
-                    "source_type": chunk["source"]["type"],
-                    "chunks": [{"chunk_id": chunk["id"], "text": chunk["text"][:200]}],
-                    "relevance_score": chunk.get("relevance_score", 0.0)
-                }
-                for chunk in chunks
-            ],
+            sources=sources,
             query_metadata={
                 "retrieval_strategy": "hybrid",
-                "chunk_count": len(chunks)
+                "chunk_count": len(chunks),
+                "context": context_stats,
+                "llm_usage": llm_usage,
+                **retrieval_stats
             }
         )
 
 
+@router.post("/batch")
+async def query_batch(
+    request: BatchQueryRequest,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Answer many queries at once.
+    Retrieval runs as one batch; answers stream back as newline-delimited
+    JSON, one line per query in completion order.
+    """
+    retrieval_stats = {}
+    results = await retrieval_service.retrieve_batch(
+        queries=request.queries,
+        user_id=request.user_id,
+        db=db,
+        top_k=request.max_results,
+        stats=retrieval_stats,
+        **_retrieval_options(request)
+    )
+    
+    semaphore = asyncio.Semaphore(settings.BATCH_ANSWER_CONCURRENCY)
+    
+    async def answer_query(index: int, query: str, chunks: list) -> dict:
+        line = {
+            "index": index,
+            "query": query,
+            "sources": _format_sources(chunks),
+            "query_metadata": {"retrieval_strategy": "hybrid", "chunk_count": len(chunks)}
+        }
+        if not chunks:
+            line["answer"] = "I couldn't find any relevant information in your knowledge base to answer this question."
+        elif request.generate_answers:
+            context_chunks, line["query_metadata"]["context"] = context_packer.pack(chunks)
+            try:
+                async with semaphore:
+                    line["answer"] = await llm_service.generate_answer(
+                        query=query,
+                        context_chunks=context_chunks,
+                        stream=False,
+                        priority=Priority.BATCH,
+                        usage=line["query_metadata"].setdefault("llm_usage", {})
+                    )
+            except Exception as e:
+                logger.exception(f"Batch answer error for query {index}")
+                line["error"] = f"Error generating answer: {str(e)}"
+        return line
+    
+    async def line_generator():
+        yield orjson.dumps({"batch_metadata": {"query_count": len(request.queries), **retrieval_stats}}, option=ORJSON_OPTIONS) + b"\n"
+        tasks = [
+            asyncio.create_task(answer_query(index, query, chunks))
+            for index, (query, chunks) in enumerate(zip(request.queries, results))
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield orjson.dumps(await next_done, option=ORJSON_OPTIONS) + b"\n"
+        finally:
+            # Client went away; don't keep generating answers nobody reads
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(line_generator(), media_type="application/x-ndjson")
+
+
 @router.post("/stream")
 async def query_stream(
     request: QueryRequest,
-    db: AsyncSession = Depends(get_db)
+    http_request: Request,
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """Stream query response."""
+    """
+    Stream query response as server-sent events: the sources as soon as
+    retrieval finishes, then answer deltas, then a done event.
+    """
+    # Shed load before doing any retrieval work if generation is saturated
+    llm_service.check_admission()
+    
     # Stream answer with error handling
     async def stream_generator():
         try:
+            query_embedding, cache_options, cached = await _answer_cache_lookup(request)
+            if cached:
+                async for event in _replay_answer(cached):
+                    yield event
+                return
+            
             # Retrieve relevant chunks (with error handling)
+            retrieval_stats = {}
             try:
-                chunks = await retrieval_service.retrieve(
-                    query=request.query,
-                    user_id=request.user_id,
-                    db=db,
-                    top_k=request.max_results
-                )
+                chunks = await _retrieve(request, db, query_embedding, retrieval_stats)
             except Exception as retrieve_error:
                 import traceback
                 error_msg = f"Error retrieving information: {str(retrieve_error)}"
                 print(f"Retrieval error: {error_msg}")
                 print(traceback.format_exc())
-                yield f"data: {json.dumps({'error': error_msg})}\n\n"
+                yield {'error': error_msg}
                 return
             
             if not chunks:
-                message = json.dumps({'content': "I couldn't find any relevant information in your knowledge base to answer this question."})
-                yield f"data: {message}\n\n"
-                yield f"data: {json.dumps({'done': True, 'sources': []})}\n\n"
+                yield {'content': "I couldn't find any relevant information in your knowledge base to answer this question."}
+                yield {'done': True, 'sources': []}
                 return
             
             # Format chunks for LLM
-            context_chunks = [
-                {
-                    "text": chunk["text"],
-                    "source_name": chunk["source"]["name"],
-                    "source_type": chunk["source"]["type"]
-                }
-                for chunk in chunks
-            ]
+            context_chunks, context_stats = context_packer.pack(chunks, request.context_token_budget)
             
-            # Generate answer with streaming
-            try:
-                # generate_answer with stream=True returns an async generator function
-                # Call it to get the async generator
-                stream_gen_func = llm_service.generate_answer(
-                    query=request.query,
-                    context_chunks=context_chunks,
-                    stream=True
-                )
-                # This is a coroutine that returns an async generator, so await it
-                stream_gen = await stream_gen_func
-                # Now iterate over the async generator
-                async for token in stream_gen:
-                    yield f"data: {json.dumps({'content': token})}\n\n"
-                yield f"data: {json.dumps({'done': True, 'sources': [{'name': c['source']['name']} for c in chunks]})}\n\n"
-            except Exception as llm_error:
-                import traceback
-                error_msg = f"Error generating answer: {str(llm_error)}"
-                print(f"LLM error: {error_msg}")
-                print(traceback.format_exc())
-                yield f"data: {json.dumps({'error': error_msg})}\n\n"
+            async for event in _answer_events(
+                request, chunks, context_chunks, context_stats, retrieval_stats, query_embedding, cache_options
+            ):
+                yield event
         except Exception as e:
             import traceback
             error_msg = f"Unexpected error: {str(e)}"
             print(f"Unexpected error: {error_msg}")
             print(traceback.format_exc())
-            yield f"data: {json.dumps({'error': error_msg})}\n\n"
+            yield {'error': error_msg}
+    
+    return sse_response(http_request, stream_generator())
+
+
+async def _answer_events(
+    request: QueryRequest,
+    chunks: list,
+    context_chunks: list,
+    context_stats: dict,
+    retrieval_stats: dict,
+    query_embedding: Optional[list],
+    cache_options: Optional[dict]
+):
+    """
+    Events of a streamed answer: sources first, so clients can show them
+    before the first token, then content deltas and a done event.
+    """
+    sources = _format_sources(chunks)
+    yield {'sources': sources}
     
-    return StreamingResponse(stream_generator(), media_type="text/event-stream")
+    # Generate answer with streaming
+    try:
+        llm_usage = {}
+        # generate_answer with stream=True is a coroutine returning an async generator
+        stream_gen = await llm_service.generate_answer(
+            query=request.query,
+            context_chunks=context_chunks,
+            stream=True,
+            usage=llm_usage
+        )
+        tokens = []
+        async for token in stream_gen:
+            tokens.append(token)
+            yield {'content': token}
+        if _cacheable(cache_options, retrieval_stats, llm_usage):
+            await answer_cache.store(
+                _cache_user(request), query_embedding, cache_options, "".join(tokens), sources
+            )
+        yield {
+            'done': True,
+            'sources': [{'name': c['source']['name']} for c in chunks],
+            'context': context_stats,
+            'llm_usage': llm_usage,
+            'session_id': retrieval_stats.get('session_id')
+        }
+    except AdmissionRejected as rejected:
+        yield {'error': rejected.reason, 'retry_after': rejected.retry_after}
+    except Exception as llm_error:
+        import traceback
+        error_msg = f"Error generating answer: {str(llm_error)}"
+        print(f"LLM error: {error_msg}")
+        print(traceback.format_exc())
+        yield {'error': error_msg}
 
 
-async def _stream_answer(query: str, context_chunks: list):
-    """Helper to stream answer."""
-    async for token in llm_service.generate_answer(
-        query=query,
-        context_chunks=context_chunks,
-        stream=True
-    ):
-        yield f"data: {json.dumps({'content': token})}\n\n"
+async def _retrieve(
+    request: QueryRequest,
+    db: AsyncSession,
+    query_embedding: Optional[list],
+    stats: dict
+) -> list:
+    """Retrieve for a request, within its conversation session if it has one."""
+    if request.session_id:
+        session = await session_store.get_or_create(request.session_id, _cache_user(request))
+        stats["session_id"] = session.id
+        chunks = await retrieval_service.retrieve_in_session(
+            session=session,
+            query=request.query,
+            user_id=request.user_id,
+            db=db,
+            top_k=request.max_results,
+            query_embedding=query_embedding,
+            stats=stats,
+            **_retrieval_options(request)
+        )
+        # "new" when the id was unknown here, e.g. expired or served by another worker
+        stats.setdefault("session", {})["new"] = session.is_new
+        await session_store.save(session)
+        return chunks
+    return await retrieval_service.retrieve(
+        query=request.query,
+        user_id=request.user_id,
+        db=db,
+        top_k=request.max_results,
+        query_embedding=query_embedding,
+        stats=stats,
+        **_retrieval_options(request)
+    )
 
+
+def _cache_user(request: QueryRequest) -> str:
+    """The user id corpus versions are tracked under."""
+    return str(to_user_uuid(request.user_id))
+
+
+async def _answer_cache_lookup(request: QueryRequest):
+    """
+    Embed the query and look it up in the semantic answer cache.
+    Returns (query embedding, cache options, cached answer); the embedding
+    is handed on to retrieval so a miss costs no extra embedding call.
+    Cache options are None when the answer must not be cached.
+    """
+    if not settings.ANSWER_CACHE_ENABLED or not request.use_answer_cache:
+        return None, None, None
+    if request.session_id:
+        # A follow-up's meaning depends on the conversation, not just its words
+        return None, None, None
+    if temporal_parser.parse(request.query, request.timezone) is not None:
+        # "What did I do this week?" means something else next week
+        return None, None, None
+    
+    try:
+        query_embedding = await asyncio.wait_for(
+            embedding_service.embed_text(request.query),
+            settings.RETRIEVAL_EMBED_TIMEOUT
+        )
+    except Exception as e:
+        logger.warning(f"Answer cache embedding error: {e}")
+        return None, None, None
+    
+    cache_user = _cache_user(request)
+    cache_options = {
+        # Read before retrieval, so answers to a corpus that changed meanwhile go stale
+        "corpus_version": await corpus_versions.get(cache_user),
+        **_retrieval_options(request),
+        "max_results": request.max_results,
+        "context_token_budget": request.context_token_budget,
+        "model": f"{llm_service.provider}:{llm_service.model}"
+    }
+    cached = await answer_cache.lookup(cache_user, query_embedding, cache_options)
+    return query_embedding, cache_options, cached
+
+
+def _cacheable(cache_options: Optional[dict], retrieval_stats: dict, llm_usage: dict) -> bool:
+    """
+    Whether an answer may be stored. Entries are keyed by the primary
+    provider's model, so answers from a fallback provider (or whose
+    provider didn't report) are not.
+    """
+    if cache_options is None or retrieval_stats.get("degraded_stages"):
+        return False
+    return f"{llm_usage.get('provider')}:{llm_usage.get('model')}" == cache_options["model"]
+
+
+async def _replay_answer(cached: dict):
+    """Replay a cached answer as the events a live answer produces."""
+    yield {'sources': cached["sources"]}
+    for piece in re.findall(r"\S+\s*", cached["answer"]):
+        yield {'content': piece}
+    sources = [{'name': source['source_name']} for source in cached["sources"]]
+    yield {'done': True, 'sources': sources, 'answer_cache': 'hit'}
+
+
+def _retrieval_options(request: RetrievalOptions) -> dict:
+    """Retrieval keyword arguments from a request."""
+    return {
+        "keyword_mode": request.keyword_mode,
+        "fusion_strategy": request.fusion_strategy,
+        "diversify": request.diversify,
+        "mmr_lambda": request.mmr_lambda,
+        "per_source_cap": request.per_source_cap,
+        "timezone": request.timezone,
+        "context_neighbors": request.context_neighbors
+    }
+
+
+def _format_sources(chunks: list) -> list:
+    """Format retrieved chunks as response sources."""
+    return [
+        {
+            "source_id": chunk["source"]["id"],
+            "source_name": chunk["source"]["name"],
+            "source_type": chunk["source"]["type"],
+            "chunks": [{"chunk_id": chunk["id"], "text": chunk["text"][:200]}],
+            "relevance_score": chunk.get("relevance_score", 0.0)
+        }
+        for chunk in chunks
+    ]
@@ -1,124 +1,233 @@
 """
 Sources API endpoints.
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from typing import List
+from sqlalchemy import select, func, case, tuple_
+from typing import List, Optional
+from datetime import datetime
+import base64
+import json
 import uuid
 
-from app.database import get_db
+from app.config import settings
+from app.database import get_db, get_read_db
 from app.models import Source, Chunk
-from app.services.storage import storage_service
+from app.services.deletion import deletion_service
+from app.services.users import to_user_uuid
 
 router = APIRouter()
 
+SOURCE_FIELDS = (
+    "id", "source_type", "source_name", "source_url", "ingestion_timestamp",
+    "source_timestamp", "metadata", "status", "chunk_count"
+)
+SOURCE_STATUSES = ("processing", "completed", "failed")
+
+
+class BulkDeleteRequest(BaseModel):
+    user_id: str
+    source_ids: List[str] = Field(default_factory=list, max_length=settings.BULK_DELETE_MAX_SOURCES)
+    all_sources: bool = False
+
+
+def _chunk_count():
+    """
+    Chunk count of the outer query's source; an index-only count per
+    returned row, in the source user's chunk partition.
+    """
+    return (
+        select(func.count(Chunk.id))
+        .where(Chunk.user_id == Source.user_id, Chunk.source_id == Source.id)
+        .correlate(Source)
+        .scalar_subquery()
+    )
+
+
+def _status():
+    """Status recorded at ingestion, else whether the source has chunks yet."""
+    has_chunks = (
+        select(Chunk.id)
+        .where(Chunk.user_id == Source.user_id, Chunk.source_id == Source.id)
+        .correlate(Source)
+        .exists()
+    )
+    return func.coalesce(
+        Source.meta["status"].astext,
+        case((has_chunks, "completed"), else_="processing")
+    )
+
+
+def _parse_fields(fields: Optional[str]) -> List[str]:
+    """Requested response fields; all of them by default. The id is always returned."""
+    if not fields:
+        return list(SOURCE_FIELDS)
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in SOURCE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return ["id"] + [field for field in requested if field != "id"]
+
+
+def _encode_cursor(ingestion_timestamp: datetime, source_id: uuid.UUID) -> str:
+    raw = json.dumps([ingestion_timestamp.isoformat(), str(source_id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str):
+    try:
+        timestamp, source_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(timestamp), uuid.UUID(source_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def _query_sources(
+    db: AsyncSession,
+    user_id: str,
+    fields: List[str],
+    source_id: Optional[str] = None,
+    source_types: Optional[List[str]] = None,
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None
+) -> List[dict]:
+    """
+    Sources of a user as response dicts, newest first, in one query.
+    Only the requested fields are selected, and chunk counts are
+    computed only for the rows returned and only when asked for. Pages are keyset-paginated on (ingestion_timestamp, id).
+    """
+    expressions = {
+        "source_type": Source.source_type,
+        "source_name": Source.source_name,
+        "source_url": Source.source_url,
+        "source_timestamp": Source.source_timestamp,
+        "metadata": Source.meta,
+        "status": _status(),
+        "chunk_count": _chunk_count()
+    }
+    columns = [Source.id, Source.ingestion_timestamp] + [
+        expressions[field].label(field) for field in fields if field in expressions
+    ]
+    
+    stmt = select(*columns).where(Source.user_id == to_user_uuid(user_id), Source.deleted_at.is_(None))
+    if source_id is not None:
+        stmt = stmt.where(Source.id == uuid.UUID(source_id))
+    if source_types:
+        stmt = stmt.where(Source.source_type.in_(source_types))
+    if status is not None:
+        stmt = stmt.where(_status() == status)
+    if cursor is not None:
+        timestamp, after_id = _decode_cursor(cursor)
+        stmt = stmt.where(tuple_(Source.ingestion_timestamp, Source.id) < tuple_(timestamp, after_id))
+    stmt = stmt.order_by(Source.ingestion_timestamp.desc(), Source.id.desc())
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    
+    result = await db.execute(stmt)
+    rows = []
+    for row in result.mappings():
+        # UUIDs and datetimes are left for orjson, which encodes them natively
+        item = {field: row[field] for field in fields}
+        if "metadata" in item and item["metadata"] is None:
+            item["metadata"] = {}
+        # Kept for building the next cursor
+        item["_cursor"] = (row["ingestion_timestamp"], row["id"])
+        rows.append(item)
+    return rows
+
 
 @router.get("")
 async def list_sources(
     user_id: str = Query(..., description="User ID to list sources for"),
-    db: AsyncSession = Depends(get_db)
+    limit: int = Query(100, ge=1, le=1000, description="Page size"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    source_type: Optional[List[str]] = Query(None, description="Only sources of these types"),
+    status: Optional[str] = Query(None, description="Only sources with this status"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """List all sources for a user."""
-    result = await db.execute(
-        select(Source).where(Source.user_id == uuid.UUID(user_id))
-        .order_by(Source.ingestion_timestamp.desc())
-    )
-    sources = result.scalars().all()
+    """
+    List sources for a user, newest first.
     
-    # Build response with chunk counts
-    response = []
-    for source in sources:
-        # Get chunk count for each source
-        chunk_count_result = await db.execute(
-            select(func.count(Chunk.id)).where(Chunk.source_id == source.id)
-        )
-        chunk_count = chunk_count_result.scalar() or 0
-        
-        # Determine status
-        meta = source.meta or {}
-        if "status" in meta:
-            status = meta["status"]
-        else:
-            status = "completed" if chunk_count > 0 else "processing"
-        
-        response.append({
-            "id": str(source.id),
-            "source_type": source.source_type,
-            "source_name": source.source_name,
-            "source_url": source.source_url,
-            "ingestion_timestamp": source.ingestion_timestamp.isoformat(),
-            "source_timestamp": source.source_timestamp.isoformat() if source.source_timestamp else None,
-            "metadata": meta,
-            "status": status,
-            "chunk_count": chunk_count
-        })
+    Returns one page; if there are more, the X-Next-Cursor response
+    header holds the cursor for the next one.
+    """
+    if status is not None and status not in SOURCE_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Unknown status: {status}")
+    
+    # One extra row tells whether there is a next page
+    rows = await _query_sources(
+        db, user_id, _parse_fields(fields),
+        source_types=source_type, status=status, cursor=cursor, limit=limit + 1
+    )
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = _encode_cursor(*rows[-1]["_cursor"])
     
-    return response
+    for row in rows:
+        del row["_cursor"]
+    # Returned directly, skipping FastAPI's jsonable_encoder pass over every row
+    return ORJSONResponse(rows, headers=headers)
 
 
 @router.get("/{source_id}")
 async def get_source(
     source_id: str,
     user_id: str,
-    db: AsyncSession = Depends(get_db)
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Get source details."""
-    result = await db.execute(
-        select(Source).where(
-            Source.id == uuid.UUID(source_id),
-            Source.user_id == uuid.UUID(user_id)
-        )
-    )
-    source = result.scalar_one_or_none()
-    
-    if not source:
+    rows = await _query_sources(db, user_id, _parse_fields(fields), source_id=source_id)
+    if not rows:
         raise HTTPException(status_code=404, detail="Source not found")
     
-    # Get chunk count
-    chunk_count_result = await db.execute(
-        select(func.count(Chunk.id)).where(Chunk.source_id == source.id)
-    )
-    chunk_count = chunk_count_result.scalar()
+    source = rows[0]
+    del source["_cursor"]
+    return ORJSONResponse(source)
+
+
+@router.post("/bulk-delete")
+async def bulk_delete_sources(
+    request: BulkDeleteRequest,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Delete many sources, or all of a user's sources with all_sources.
+    Sources are hidden at once; their data is purged in the background.
+    """
+    if request.all_sources == bool(request.source_ids):
+        raise HTTPException(status_code=400, detail="Give either source_ids or all_sources")
+    try:
+        source_ids = None if request.all_sources else [str(uuid.UUID(source_id)) for source_id in request.source_ids]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid source id")
     
-    return {
-        "id": str(source.id),
-        "source_type": source.source_type,
-        "source_name": source.source_name,
-        "source_url": source.source_url,
-        "ingestion_timestamp": source.ingestion_timestamp.isoformat(),
-        "source_timestamp": source.source_timestamp.isoformat() if source.source_timestamp else None,
-        "metadata": source.meta or {},
-        "chunk_count": chunk_count,
-        "status": (source.meta or {}).get("status", "completed" if chunk_count > 0 else "processing")
-    }
+    deleted = await deletion_service.mark_deleted(db, request.user_id, source_ids)
+    background_tasks.add_task(deletion_service.purge, deleted)
+    
+    return {"status": "deleted", "source_ids": deleted, "deleted_count": len(deleted)}
 
 
 @router.delete("/{source_id}")
 async def delete_source(
     source_id: str,
     user_id: str,
+    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db)
 ):
-    """Delete a source and all its chunks."""
-    result = await db.execute(
-        select(Source).where(
-            Source.id == uuid.UUID(source_id),
-            Source.user_id == uuid.UUID(user_id)
-        )
-    )
-    source = result.scalar_one_or_none()
-    
-    if not source:
+    """
+    Delete a source and all its chunks. The source is hidden at once;
+    its chunks, vectors and stored file are purged in the background.
+    """
+    deleted = await deletion_service.mark_deleted(db, user_id, [source_id])
+    if not deleted:
         raise HTTPException(status_code=404, detail="Source not found")
-    
-    # Delete from object storage if exists
-    if source.object_storage_key:
-        await storage_service.delete_file(source.object_storage_key)
-    
-    # Delete from database (cascade will delete chunks)
-    await db.delete(source)
-    await db.commit()
+    background_tasks.add_task(deletion_service.purge, deleted)
     
     return {"status": "deleted", "source_id": source_id}
-
@@ -0,0 +1,119 @@
+"""
+Server-sent events response layer.
+"""
+from typing import AsyncIterator, Dict, Any
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+import asyncio
+import orjson
+import time
+
+from app.config import settings
+
+# SSE comment line; keeps proxies and load balancers from idling the connection out
+HEARTBEAT = b": heartbeat\n\n"
+
+# Frames are written as bytes; content deltas, the bulk of a stream, only
+# have their text encoded between these
+_CONTENT_PREFIX = b'data: {"content":'
+_CONTENT_SUFFIX = b"}\n\n"
+
+# As ORJSONResponse: scores may be numpy scalars
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+_END = object()
+
+
+def sse_event(payload: Dict[str, Any]) -> bytes:
+    """One SSE data frame."""
+    return b"data: " + orjson.dumps(payload, option=ORJSON_OPTIONS) + b"\n\n"
+
+
+def sse_content(text: str) -> bytes:
+    """A {"content": text} frame."""
+    return _CONTENT_PREFIX + orjson.dumps(text) + _CONTENT_SUFFIX
+
+
+async def event_stream(request: Request, events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """
+    Serialize an event iterator as SSE frames.
+    
+    Events are produced in a separate task into a small bounded queue, so
+    a slow client holds up generation instead of buffering it. Runs of
+    {"content": ...} deltas are coalesced into one frame for up to
+    SSE_COALESCE_SECONDS or SSE_COALESCE_MAX_CHARS. A heartbeat is sent
+    after SSE_HEARTBEAT_SECONDS without frames. When the client goes
+    away the producer is cancelled, which stops the LLM stream.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=settings.SSE_QUEUE_MAX_EVENTS)
+    
+    async def produce():
+        try:
+            async for event in events:
+                await queue.put(event)
+        except Exception as e:
+            # Handed over so the consumer re-raises it
+            await queue.put(e)
+            return
+        await queue.put(_END)
+    
+    producer = asyncio.create_task(produce())
+    pending_content = []
+    pending_since = 0.0
+    last_frame = time.monotonic()
+    
+    def flush() -> bytes:
+        frame = sse_content("".join(pending_content))
+        pending_content.clear()
+        return frame
+    
+    try:
+        while True:
+            deadline = last_frame + settings.SSE_HEARTBEAT_SECONDS
+            if pending_content:
+                deadline = min(deadline, pending_since + settings.SSE_COALESCE_SECONDS)
+            try:
+                event = await asyncio.wait_for(queue.get(), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield flush() if pending_content else HEARTBEAT
+                last_frame = time.monotonic()
+                continue
+            
+            if event is _END or isinstance(event, Exception):
+                if pending_content:
+                    yield flush()
+                if event is _END:
+                    break
+                raise event
+            
+            if set(event) == {"content"}:
+                if not pending_content:
+                    pending_since = time.monotonic()
+                pending_content.append(event["content"])
+                if sum(len(piece) for piece in pending_content) < settings.SSE_COALESCE_MAX_CHARS:
+                    continue
+                yield flush()
+            else:
+                if pending_content:
+                    yield flush()
+                yield sse_event(event)
+            last_frame = time.monotonic()
+    finally:
+        if not producer.done():
+            producer.cancel()
+            try:
+                await producer
+            except (asyncio.CancelledError, Exception):
+                pass
+
+
+def sse_response(request: Request, events: AsyncIterator[Dict[str, Any]]) -> StreamingResponse:
+    """A streaming response for an event iterator."""
+    return StreamingResponse(
+        event_stream(request, events),
+        media_type="text/event-stream",
+        # Stop proxies (e.g. nginx) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,15 +1,180 @@
 """
 Database connection and session management.
 """
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy.orm import declarative_base
+from fastapi import Request
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession, async_sessionmaker
+from sqlalchemy.orm import declarative_base, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy import event, exc, inspect, text
+from pathlib import Path
+from typing import List, Optional
+import asyncio
+import logging
+import time
 from app.config import settings
+from app.services.cache import LRUCache, corpus_versions
+from app.services.metrics import metrics
 
-engine = create_async_engine(
-    settings.DATABASE_URL,
-    echo=settings.ENVIRONMENT == "development",
-    future=True
-)
+logger = logging.getLogger(__name__)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that reports how long checkouts wait for a connection."""
+    
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            metrics.increment("db.pool.timeouts")
+            raise
+        finally:
+            metrics.observe("db.pool.wait_seconds", time.monotonic() - start)
+
+
+def create_engine(url: str):
+    """Create an async engine with the configured pool and statement cache."""
+    new_engine = create_async_engine(
+        url,
+        echo=settings.DB_ECHO,
+        future=True,
+        poolclass=InstrumentedPool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args={
+            # asyncpg's own cache and SQLAlchemy's adapter cache
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE
+        }
+    )
+    pool = new_engine.sync_engine.pool
+    
+    def export_pool_usage(*args):
+        metrics.set_gauge("db.pool.checked_out", pool.checkedout())
+        metrics.set_gauge("db.pool.overflow", max(pool.overflow(), 0))
+    
+    event.listen(pool, "checkout", export_pool_usage)
+    event.listen(pool, "checkin", export_pool_usage)
+    return new_engine
+
+
+engine = create_engine(settings.DATABASE_URL)
+
+
+class Replica:
+    """A read replica engine and its last measured replication lag."""
+    
+    # Zero when the replica has replayed everything it received; an idle
+    # primary makes the last replay timestamp old without any real lag
+    LAG_QUERY = text(
+        "SELECT CASE "
+        "WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+    )
+    
+    def __init__(self, index: int, url: str):
+        self.index = index
+        self.engine = create_engine(url)
+        self.lag: Optional[float] = None  # None until measured, or after a failed check
+        self.measured_at = 0.0
+    
+    def lag_bound(self, now: float) -> float:
+        """
+        Upper bound on the lag now: lag grows at most as fast as time
+        passes since it was measured.
+        """
+        if self.lag is None:
+            return float("inf")
+        return self.lag + (now - self.measured_at)
+    
+    async def measure_lag(self):
+        try:
+            async with self.engine.connect() as conn:
+                lag = (await asyncio.wait_for(conn.execute(self.LAG_QUERY), settings.REPLICA_LAG_CHECK_SECONDS)).scalar()
+            self.lag = float(lag) if lag is not None else None
+        except Exception as e:
+            logger.warning(f"Replica {self.index} lag check failed: {e}")
+            self.lag = None
+        self.measured_at = time.monotonic()
+        if self.lag is not None:
+            metrics.set_gauge(f"db.replica.{self.index}.lag_seconds", self.lag)
+
+
+class ReplicaRouter:
+    """Picks the engine for read-only sessions.
+    
+    Reads go round-robin to replicas whose lag is within
+    REPLICA_MAX_LAG_SECONDS. A user who wrote recently is only sent to a
+    replica that is known to have caught up with that write, so they
+    read their own writes; otherwise the primary serves them. Writes are
+    tracked from commits of sessions marked with mark_write and, for
+    writes handled by other workers, from the write times shared with
+    corpus versions (see get_read_db).
+    """
+    
+    def __init__(self, urls: List[str]):
+        self.replicas = [Replica(index, url) for index, url in enumerate(urls)]
+        # Beyond the lag limit plus a check interval every usable replica has the write
+        self.recent_writes = LRUCache(100_000, settings.replica_write_window_seconds)
+        self._next = 0
+        self._checked_at = 0.0
+        self._check_task: Optional[asyncio.Task] = None
+    
+    def record_write(self, user_id: str, age: float = 0.0):
+        """Record that the user wrote age seconds ago."""
+        written_at = time.monotonic() - max(age, 0.0)
+        if written_at > self.recent_writes.get(user_id, float("-inf")):
+            self.recent_writes.set(user_id, written_at)
+    
+    def engine_for(self, user_id: Optional[str]) -> AsyncEngine:
+        """The engine a read-only session for this user should use."""
+        if not self.replicas:
+            return engine
+        self._schedule_lag_check()
+        
+        now = time.monotonic()
+        max_lag = settings.REPLICA_MAX_LAG_SECONDS
+        written_at = self.recent_writes.get(user_id) if user_id else None
+        if written_at is not None:
+            max_lag = min(max_lag, now - written_at)
+        
+        candidates = [replica for replica in self.replicas if replica.lag_bound(now) <= max_lag]
+        if not candidates:
+            metrics.increment("db.replica.primary_fallbacks")
+            return engine
+        replica = candidates[self._next % len(candidates)]
+        self._next += 1
+        metrics.increment("db.replica.reads")
+        return replica.engine
+    
+    def _schedule_lag_check(self):
+        """Re-measure lag in the background once the last check is stale."""
+        if self._check_task is not None and not self._check_task.done():
+            return
+        if time.monotonic() - self._checked_at < settings.REPLICA_LAG_CHECK_SECONDS:
+            return
+        self._checked_at = time.monotonic()
+        self._check_task = asyncio.create_task(self._check_lag())
+    
+    async def _check_lag(self):
+        await asyncio.gather(*(replica.measure_lag() for replica in self.replicas))
+
+
+replica_router = ReplicaRouter(settings.database_replica_urls_list)
+
+
+def mark_write(session: AsyncSession, user_id: str):
+    """Record the user as having written once this session commits."""
+    session.info.setdefault("written_users", set()).add(user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _record_committed_writes(session: Session):
+    for user_id in session.info.pop("written_users", ()):
+        replica_router.record_write(user_id)
 
 AsyncSessionLocal = async_sessionmaker(
     engine,
@@ -23,7 +188,7 @@ Base = declarative_base()
 
 
 async def get_db() -> AsyncSession:
-    """Dependency to get database session."""
+    """Dependency to get database session; commits when the request succeeds."""
     async with AsyncSessionLocal() as session:
         try:
             yield session
@@ -35,9 +200,80 @@ async def get_db() -> AsyncSession:
             await session.close()
 
 
-async def init_db():
-    """Initialize database (create tables)."""
-    from app.models import User, Source, Chunk  # Import models to register them
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+async def get_read_db(request: Request) -> AsyncSession:
+    """
+    Dependency to get a session for read-only endpoints. Nothing is
+    committed; closing the session ends its transaction. The session is
+    bound to a read replica when one is configured and fresh enough for
+    the requesting user (see ReplicaRouter).
+    """
+    user_id = await _request_user_id(request)
+    if user_id is not None and replica_router.replicas:
+        # Writes handled by other workers, recorded with the corpus version
+        from app.services.users import to_user_uuid
+        written_at = await corpus_versions.written_at(str(to_user_uuid(user_id)))
+        if written_at is not None and time.time() - written_at < settings.replica_write_window_seconds:
+            replica_router.record_write(user_id, time.time() - written_at)
+    bind = replica_router.engine_for(user_id)
+    async with AsyncSessionLocal(bind=bind) as session:
+        yield session
+
+
+async def _request_user_id(request: Request) -> Optional[str]:
+    """The user_id of a request, from its query string or JSON body."""
+    user_id = request.query_params.get("user_id")
+    if user_id is None and request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            # Already parsed (and cached on the request) for the endpoint's body
+            body = await request.json()
+        except ValueError:
+            return None
+        if isinstance(body, dict):
+            user_id = body.get("user_id")
+    return str(user_id) if user_id is not None else None
 
+
+# Serializes startup migrations across workers
+MIGRATION_LOCK_ID = 7358201
+
+
+def alembic_config():
+    """Alembic config for the migrations bundled with the app."""
+    from alembic.config import Config
+    config = Config()
+    config.set_main_option("script_location", str(Path(__file__).parent / "migrations"))
+    return config
+
+
+def _migrate(connection):
+    """Upgrade the schema to head; databases built by create_all are stamped first."""
+    from alembic import command
+    
+    config = alembic_config()
+    config.attributes["connection"] = connection
+    connection.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+    try:
+        tables = inspect(connection).get_table_names()
+        connection.commit()
+        if "alembic_version" not in tables and "sources" in tables:
+            command.stamp(config, "0001")
+        command.upgrade(config, "head")
+    finally:
+        connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+        connection.commit()
+
+
+async def init_db():
+    """Initialize database (run migrations)."""
+    if settings.DB_AUTO_MIGRATE:
+        async with engine.connect() as conn:
+            await conn.run_sync(_migrate)
+    
+    if settings.TRIGRAM_INDEX_ENABLED:
+        async with engine.begin() as conn:
+            # Trigram GIN index serves fuzzy matching and ILIKE '%term%' scans
+            await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            await conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS idx_chunks_text_trgm "
+                "ON chunks USING gin (text gin_trgm_ops)"
+            ))
@@ -1,15 +1,20 @@
 """
 FastAPI main application entry point.
 """
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
+import asyncio
 import os
 
 from app.config import settings
 from app.database import engine, init_db
 from app.api import ingest, query, sources
+from app.middleware import CompressionMiddleware
+from app.services.metrics import metrics
+from app.services.admission import AdmissionRejected
+from app.services.deletion import deletion_service
 
 
 @asynccontextmanager
@@ -17,16 +22,19 @@ async def lifespan(app: FastAPI):
     """Application lifespan events."""
     # Startup
     await init_db()
+    # Finish deletions a restart interrupted, without holding up startup
+    purge_task = asyncio.create_task(deletion_service.purge_pending())
     yield
     # Shutdown
-    pass
+    purge_task.cancel()
 
 
 app = FastAPI(
     title="TwinMind API",
     description="Second Brain AI Companion API",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -36,9 +44,23 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # Source listing pagination
     max_age=3600,  # Cache preflight requests for 1 hour
 )
 
+if settings.COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    """Answer saturated generation with 429/503 and a Retry-After hint."""
+    return ORJSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
 # Include routers
 app.include_router(ingest.router, prefix="/api/v1/ingest", tags=["ingestion"])
 app.include_router(query.router, prefix="/api/v1/query", tags=["query"])
@@ -53,12 +75,18 @@ async def root():
 @app.get("/api/v1/health")
 async def health_check():
     """Health check endpoint."""
-    return JSONResponse({
+    return ORJSONResponse({
         "status": "healthy",
         "service": "twinmind-api"
     })
 
 
+@app.get("/api/v1/metrics")
+async def get_metrics():
+    """In-process metrics for this worker."""
+    return metrics.snapshot()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
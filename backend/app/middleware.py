@@ -0,0 +1,137 @@
+"""
+ASGI middleware.
+"""
+from typing import Optional
+import zlib
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.config import settings
+
+# Streams whose frames must reach the client as they are produced
+UNCOMPRESSED_TYPES = ("text/event-stream", "application/x-ndjson")
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick br or gzip from an Accept-Encoding header, preferring br."""
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    for encoding in ("br", "gzip"):
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+class _Compressor:
+    """Incremental brotli or gzip compressor."""
+    
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+    
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.process(data)
+        return self._zlib.compress(data)
+    
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+class CompressionMiddleware:
+    """Compress responses with brotli or gzip, as the client accepts.
+    
+    Bodies under COMPRESSION_MIN_BYTES are sent as they are, and so are
+    SSE and NDJSON streams, whose frames compression would hold back.
+    Other streamed bodies are compressed as they are sent.
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressingResponder(self.app, encoding)(scope, receive, send)
+
+
+class _CompressingResponder:
+    def __init__(self, app: ASGIApp, encoding: str):
+        self.app = app
+        self.encoding = encoding
+        self.send: Send = None
+        self.start_message: Optional[Message] = None
+        self.compressor: Optional[_Compressor] = None
+        self.passthrough = False
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.send = send
+        await self.app(scope, receive, self.send_with_compression)
+    
+    async def send_with_compression(self, message: Message):
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "")
+            self.passthrough = (
+                "content-encoding" in headers
+                or content_type.startswith(UNCOMPRESSED_TYPES)
+            )
+            if self.passthrough:
+                await self.send(message)
+            else:
+                # Held until the first body chunk shows whether to compress
+                self.start_message = message
+            return
+        
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+        
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        
+        if self.start_message is not None:
+            start, self.start_message = self.start_message, None
+            headers = MutableHeaders(raw=start["headers"])
+            if not more_body and len(body) < settings.COMPRESSION_MIN_BYTES:
+                self.passthrough = True
+                await self.send(start)
+                await self.send(message)
+                return
+            
+            self.compressor = _Compressor(self.encoding)
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["Content-Length"]
+                await self.send(start)
+            else:
+                body = self.compressor.compress(body) + self.compressor.finish()
+                headers["Content-Length"] = str(len(body))
+                await self.send(start)
+                await self.send({"type": "http.response.body", "body": body})
+                return
+        
+        data = self.compressor.compress(body)
+        if not more_body:
+            data += self.compressor.finish()
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
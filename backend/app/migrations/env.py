@@ -0,0 +1,53 @@
+"""
+Alembic environment.
+
+Runs on the connection handed over by app.database.init_db at startup, or
+on its own async engine from DATABASE_URL when run from the alembic CLI.
+"""
+from logging.config import fileConfig
+from alembic import context
+from sqlalchemy.ext.asyncio import create_async_engine
+import asyncio
+
+from app.config import settings
+from app.database import Base
+from app import models  # noqa: F401  Registers the models on Base.metadata
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+
+def run_migrations(connection):
+    context.configure(connection=connection, target_metadata=target_metadata)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_offline():
+    """Emit the migration SQL instead of running it."""
+    context.configure(
+        url=settings.DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"}
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_migrations_online():
+    engine = create_async_engine(settings.DATABASE_URL)
+    async with engine.connect() as connection:
+        await connection.run_sync(run_migrations)
+    await engine.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+elif config.attributes.get("connection") is not None:
+    run_migrations(config.attributes["connection"])
+else:
+    asyncio.run(run_migrations_online())
@@ -0,0 +1,60 @@
+"""Baseline schema, as create_all built it before migrations.
+
+Databases created by create_all are stamped at this revision by init_db.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("email", sa.String(255), nullable=False, unique=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now())
+    )
+    op.create_table(
+        "sources",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("source_type", sa.String(50), nullable=False),
+        sa.Column("source_name", sa.String(500)),
+        sa.Column("source_url", sa.Text),
+        sa.Column("ingestion_timestamp", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("source_timestamp", sa.DateTime(timezone=True)),
+        sa.Column("meta", postgresql.JSONB),
+        sa.Column("object_storage_key", sa.Text)
+    )
+    op.create_index("idx_user_source_type", "sources", ["user_id", "source_type"])
+    op.create_index("idx_ingestion_timestamp", "sources", ["ingestion_timestamp"])
+    op.create_index("idx_source_timestamp", "sources", ["source_timestamp"])
+    op.create_table(
+        "chunks",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("source_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("sources.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("chunk_index", sa.Integer, nullable=False),
+        sa.Column("text", sa.Text, nullable=False),
+        sa.Column("token_count", sa.Integer),
+        sa.Column("start_char_offset", sa.Integer),
+        sa.Column("end_char_offset", sa.Integer),
+        sa.Column("meta", sa.JSON),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now())
+    )
+    op.create_index("idx_source_chunk", "chunks", ["source_id", "chunk_index"])
+    op.create_index("idx_created_at", "chunks", ["created_at"])
+
+
+def downgrade():
+    op.drop_table("chunks")
+    op.drop_table("sources")
+    op.drop_table("users")
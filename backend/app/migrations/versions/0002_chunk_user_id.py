@@ -0,0 +1,39 @@
+"""Add chunks.user_id and the source indexes added since the baseline.
+
+user_id is nullable until it is backfilled (0003). New chunks get it at
+ingestion from here on.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Present already on databases that create_all built after they were added
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_effective_timestamp "
+        "ON sources (user_id, coalesce(source_timestamp, ingestion_timestamp))"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_ingestion_id "
+        "ON sources (user_id, ingestion_timestamp, id)"
+    )
+    
+    op.add_column("chunks", sa.Column("user_id", postgresql.UUID(as_uuid=True), nullable=True))
+    op.create_index("idx_chunk_user_source", "chunks", ["user_id", "source_id"])
+
+
+def downgrade():
+    op.drop_index("idx_chunk_user_source", table_name="chunks")
+    op.drop_column("chunks", "user_id")
+    op.drop_index("idx_user_ingestion_id", table_name="sources")
+    op.drop_index("idx_user_effective_timestamp", table_name="sources")
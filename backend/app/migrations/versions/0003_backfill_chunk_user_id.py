@@ -0,0 +1,29 @@
+"""Backfill chunks.user_id from sources and make it NOT NULL.
+
+The backfill runs in small autocommitted batches, so it holds no long
+locks. On large tables run `python -m app.tools.backfill_chunk_user_id`
+beforehand (at revision 0002, with the app serving); this revision then
+only has the remainder to fill.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+from app.tools.backfill_chunk_user_id import backfill_chunk_user_ids
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        backfill_chunk_user_ids(op.get_bind())
+    op.alter_column("chunks", "user_id", nullable=False)
+
+
+def downgrade():
+    op.alter_column("chunks", "user_id", nullable=True)
@@ -0,0 +1,68 @@
+"""Hash-partition chunks by user_id.
+
+Rebuilds chunks as a table partitioned into CHUNK_PARTITIONS hash
+partitions (chunks_p0, chunks_p1, ...) and copies the rows over. The
+partition key must be part of the primary key, which becomes
+(id, user_id). The copy rewrites the whole table: run it in a
+maintenance window on large databases.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.config import settings
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def _has_trigram_index() -> bool:
+    return op.get_bind().execute(sa.text(
+        "SELECT 1 FROM pg_indexes WHERE indexname = 'idx_chunks_text_trgm'"
+    )).first() is not None
+
+
+def _finish_table(primary_key: str, trigram: bool):
+    """Constraints and indexes of the new chunks table, added after the copy."""
+    op.execute(f"ALTER TABLE chunks ADD CONSTRAINT chunks_pkey PRIMARY KEY ({primary_key})")
+    op.execute(
+        "ALTER TABLE chunks ADD CONSTRAINT chunks_source_id_fkey "
+        "FOREIGN KEY (source_id) REFERENCES sources (id) ON DELETE CASCADE"
+    )
+    op.create_index("idx_source_chunk", "chunks", ["source_id", "chunk_index"])
+    op.create_index("idx_created_at", "chunks", ["created_at"])
+    op.create_index("idx_chunk_user_source", "chunks", ["user_id", "source_id"])
+    if trigram:
+        op.execute("CREATE INDEX idx_chunks_text_trgm ON chunks USING gin (text gin_trgm_ops)")
+
+
+def upgrade():
+    trigram = _has_trigram_index()
+    partitions = settings.CHUNK_PARTITIONS
+    
+    op.execute("CREATE TABLE chunks_partitioned (LIKE chunks INCLUDING DEFAULTS) PARTITION BY HASH (user_id)")
+    for remainder in range(partitions):
+        op.execute(
+            f"CREATE TABLE chunks_p{remainder} PARTITION OF chunks_partitioned "
+            f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+        )
+    op.execute("INSERT INTO chunks_partitioned SELECT * FROM chunks")
+    op.execute("DROP TABLE chunks")
+    op.execute("ALTER TABLE chunks_partitioned RENAME TO chunks")
+    _finish_table("id, user_id", trigram)
+
+
+def downgrade():
+    trigram = _has_trigram_index()
+    
+    op.execute("CREATE TABLE chunks_unpartitioned (LIKE chunks INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO chunks_unpartitioned SELECT * FROM chunks")
+    # Drops the partitions with it
+    op.execute("DROP TABLE chunks")
+    op.execute("ALTER TABLE chunks_unpartitioned RENAME TO chunks")
+    _finish_table("id", trigram)
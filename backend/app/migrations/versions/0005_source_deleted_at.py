@@ -0,0 +1,26 @@
+"""Add sources.deleted_at for two-phase deletion.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("sources", sa.Column("deleted_at", sa.DateTime(timezone=True), nullable=True))
+    op.create_index(
+        "idx_sources_deleted_at", "sources", ["deleted_at"],
+        postgresql_where=sa.text("deleted_at IS NOT NULL")
+    )
+
+
+def downgrade():
+    op.drop_index("idx_sources_deleted_at", table_name="sources")
+    op.drop_column("sources", "deleted_at")
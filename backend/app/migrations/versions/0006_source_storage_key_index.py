@@ -0,0 +1,20 @@
+"""Index sources.object_storage_key for blob reference counts.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("idx_source_object_storage_key", "sources", ["object_storage_key"])
+
+
+def downgrade():
+    op.drop_index("idx_source_object_storage_key", table_name="sources")
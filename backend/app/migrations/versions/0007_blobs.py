@@ -0,0 +1,28 @@
+"""Add the blobs table for content-addressed storage.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "blobs",
+        sa.Column("key", sa.Text(), primary_key=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("last_used_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False)
+    )
+    op.create_index("idx_blobs_last_used_at", "blobs", ["last_used_at"])
+
+
+def downgrade():
+    op.drop_index("idx_blobs_last_used_at", table_name="blobs")
+    op.drop_table("blobs")
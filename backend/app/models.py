@@ -34,23 +34,39 @@ class Source(Base):
     source_timestamp = Column(DateTime(timezone=True))  # Original creation time
     meta = Column(JSONB)  # Flexible schema for type-specific metadata (renamed from 'metadata' to avoid SQLAlchemy conflict)
     object_storage_key = Column(Text)  # Path in MinIO/S3
+    deleted_at = Column(DateTime(timezone=True))  # Set on deletion; hidden until purged
     
-    # Relationships
-    chunks = relationship("Chunk", back_populates="source", cascade="all, delete-orphan")
+    # Relationships (chunks are removed by set-based deletes and the FK cascade, never loaded for it)
+    chunks = relationship("Chunk", back_populates="source", cascade="all, delete-orphan", passive_deletes=True)
     
     # Indexes
     __table_args__ = (
         Index("idx_user_source_type", "user_id", "source_type"),
         Index("idx_ingestion_timestamp", "ingestion_timestamp"),
+        # Serves the keyset-paginated source listing
+        Index("idx_user_ingestion_id", "user_id", "ingestion_timestamp", "id"),
+        # Reference counts of content-addressed blobs
+        Index("idx_source_object_storage_key", "object_storage_key"),
+        # Finds sources awaiting purge
+        Index("idx_sources_deleted_at", "deleted_at", postgresql_where=deleted_at.isnot(None)),
         Index("idx_source_timestamp", "source_timestamp"),
+        # Serves time-scoped retrieval, which filters on this expression
+        Index("idx_user_effective_timestamp", "user_id", func.coalesce(source_timestamp, ingestion_timestamp)),
     )
 
 
 class Chunk(Base):
-    """Chunk model - text chunks with metadata."""
+    """Chunk model - text chunks with metadata.
+    
+    Hash-partitioned by user_id (CHUNK_PARTITIONS partitions, see the
+    migrations), so the partition key is part of the primary key. user_id
+    is denormalized from the source; filtering on it lets per-user
+    queries touch only that user's partition.
+    """
     __tablename__ = "chunks"
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), primary_key=True)
     source_id = Column(UUID(as_uuid=True), ForeignKey("sources.id", ondelete="CASCADE"), nullable=False)
     chunk_index = Column(Integer, nullable=False)  # Order within source
     text = Column(Text, nullable=False)
@@ -67,5 +83,25 @@ class Chunk(Base):
     __table_args__ = (
         Index("idx_source_chunk", "source_id", "chunk_index"),
         Index("idx_created_at", "created_at"),
+        Index("idx_chunk_user_source", "user_id", "source_id"),
+        {"postgresql_partition_by": "HASH (user_id)"},
     )
 
+
+
+class Blob(Base):
+    """Content-addressed upload (STORAGE_CONTENT_ADDRESSED).
+    
+    Its reference count is the number of sources whose
+    object_storage_key is its key; last_used_at is refreshed by every
+    upload of the same content and starts the GC grace period.
+    """
+    __tablename__ = "blobs"
+    
+    key = Column(Text, primary_key=True)  # blobs/sha256/<aa>/<digest>
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    
+    __table_args__ = (
+        Index("idx_blobs_last_used_at", "last_used_at"),
+    )
@@ -0,0 +1,136 @@
+"""
+Admission control for LLM generation.
+"""
+from typing import Dict, List
+from contextlib import asynccontextmanager
+from enum import IntEnum
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from app.config import settings
+from app.services.metrics import metrics
+
+
+class Priority(IntEnum):
+    """Queue priority; lower values are admitted first."""
+    INTERACTIVE = 0
+    BATCH = 1
+
+
+class AdmissionRejected(Exception):
+    """Raised when a generation can't be admitted.
+    
+    status_code is 429 when the wait queue is full and 503 when the wait
+    deadline passed; retry_after is a hint in seconds.
+    """
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class _ProviderGate:
+    """Slots and wait queue for one provider."""
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.queued = 0
+        self.waiters: List[list] = []  # heap of [priority, sequence, future]
+        self.hold_seconds = 5.0  # Moving average of how long a slot is held
+
+
+class AdmissionController:
+    """Per-provider concurrency limits with a bounded priority wait queue.
+    
+    Up to the provider's limit generations run at once. Further requests
+    wait, interactive before batch and FIFO within a priority, until a
+    slot frees up or their deadline passes. When the queue is full, new
+    requests are rejected at once instead of slowing everyone down.
+    """
+    
+    DEFAULT_LIMIT = 8
+    
+    def __init__(self):
+        self.gates: Dict[str, _ProviderGate] = {}
+        self._sequence = itertools.count()
+    
+    def _gate(self, provider: str) -> _ProviderGate:
+        gate = self.gates.get(provider)
+        if gate is None:
+            limit = settings.llm_concurrency_limits.get(provider, self.DEFAULT_LIMIT)
+            gate = self.gates[provider] = _ProviderGate(limit)
+        return gate
+    
+    def _retry_after(self, gate: _ProviderGate) -> int:
+        """Rough seconds until the queue ahead of a new request drains."""
+        return max(1, math.ceil(gate.hold_seconds * (gate.queued + 1) / gate.limit))
+    
+    def _update_gauges(self, provider: str, gate: _ProviderGate):
+        metrics.set_gauge(f"llm_admission.{provider}.active", gate.active)
+        metrics.set_gauge(f"llm_admission.{provider}.queue_depth", gate.queued)
+    
+    def check(self, provider: str):
+        """Reject up front if a new request could not even be queued."""
+        gate = self._gate(provider)
+        if gate.active >= gate.limit and gate.queued >= settings.LLM_QUEUE_MAX:
+            metrics.increment(f"llm_admission.{provider}.rejected")
+            raise AdmissionRejected(429, self._retry_after(gate), f"{provider} generation queue is full")
+    
+    @asynccontextmanager
+    async def slot(self, provider: str, priority: Priority = Priority.INTERACTIVE):
+        """Hold one of the provider's generation slots for the block."""
+        gate = self._gate(provider)
+        await self._acquire(provider, gate, priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            gate.hold_seconds = 0.9 * gate.hold_seconds + 0.1 * (time.monotonic() - started)
+            self._release(gate)
+            self._update_gauges(provider, gate)
+    
+    async def _acquire(self, provider: str, gate: _ProviderGate, priority: Priority):
+        if gate.active < gate.limit and not gate.queued:
+            gate.active += 1
+            metrics.observe(f"llm_admission.{provider}.wait_seconds", 0.0)
+            self._update_gauges(provider, gate)
+            return
+        
+        self.check(provider)
+        timeout = settings.LLM_QUEUE_TIMEOUT if priority == Priority.INTERACTIVE else settings.LLM_BATCH_QUEUE_TIMEOUT
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(gate.waiters, [int(priority), next(self._sequence), future])
+        gate.queued += 1
+        self._update_gauges(provider, gate)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # Handed a slot just as the deadline hit; pass it on
+                self._release(gate)
+            metrics.increment(f"llm_admission.{provider}.timed_out")
+            raise AdmissionRejected(503, self._retry_after(gate), f"Timed out waiting for a {provider} generation slot")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(gate)
+            raise
+        finally:
+            gate.queued -= 1
+            metrics.observe(f"llm_admission.{provider}.wait_seconds", time.monotonic() - started)
+            self._update_gauges(provider, gate)
+    
+    def _release(self, gate: _ProviderGate):
+        """Hand the slot to the best live waiter, or free it."""
+        while gate.waiters:
+            future = heapq.heappop(gate.waiters)[2]
+            if not future.done():
+                future.set_result(None)
+                return
+        gate.active -= 1
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,80 @@
+"""
+Content-addressed storage of uploads.
+"""
+from typing import BinaryIO, Optional
+from sqlalchemy import delete, func, literal_column
+from sqlalchemy.dialects.postgresql import insert
+import uuid
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import Blob
+from app.services.metrics import metrics
+from app.services.storage import storage_service
+
+# Content-addressed blobs live under this prefix
+BLOB_PREFIX = "blobs/sha256/"
+
+
+def blob_key(digest: str) -> str:
+    return f"{BLOB_PREFIX}{digest[:2]}/{digest}"
+
+
+def is_blob_key(key: Optional[str]) -> bool:
+    return bool(key) and key.startswith(BLOB_PREFIX)
+
+
+class BlobStore:
+    """Stores uploads once per content, keyed by SHA-256.
+    
+    Every blob has a row in the blobs table. An upload upserts the row,
+    refreshing last_used_at, in a short transaction of its own and then
+    writes the object outside it, only if the row is new. The fresh
+    last_used_at keeps app.tools.gc_blobs off the blob for the grace
+    period, and the upsert waits on the row lock GC deletes under, so a
+    blob being reused is never collected. A failed write drops the row
+    again so the next upload of the content retries it.
+    """
+    
+    async def save_upload(
+        self,
+        file_data: BinaryIO,
+        prefix: str,
+        filename: str,
+        content_type: Optional[str] = None
+    ) -> str:
+        """
+        Store an upload and return its key: its blob with
+        STORAGE_CONTENT_ADDRESSED, else a fresh key under prefix.
+        """
+        if not settings.STORAGE_CONTENT_ADDRESSED:
+            return await storage_service.save_file(file_data, f"{prefix}/{uuid.uuid4()}{filename}", content_type=content_type)
+        
+        key = blob_key(await storage_service.sha256(file_data))
+        async with AsyncSessionLocal() as session:
+            stmt = (
+                insert(Blob)
+                .values(key=key)
+                .on_conflict_do_update(index_elements=[Blob.key], set_={"last_used_at": func.now()})
+                # xmax is 0 only for a freshly inserted row
+                .returning(literal_column("xmax = 0"))
+            )
+            inserted = (await session.execute(stmt)).scalar()
+            await session.commit()
+        
+        if not inserted:
+            metrics.increment("storage.blob_dedup_hits")
+            return key
+        
+        # Written outside the transaction so no connection or row lock is held during the upload
+        try:
+            await storage_service.save_file(file_data, key, content_type=content_type)
+        except Exception:
+            async with AsyncSessionLocal() as session:
+                await session.execute(delete(Blob).where(Blob.key == key))
+                await session.commit()
+            raise
+        metrics.increment("storage.blob_writes")
+        return key
+
+
+blob_store = BlobStore()
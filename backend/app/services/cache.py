@@ -0,0 +1,339 @@
+"""
+Caching primitives and the retrieval result cache.
+"""
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import time
+import numpy as np
+from app.config import settings
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Bounded in-process LRU cache with an optional per-entry TTL."""
+    
+    def __init__(self, max_entries: int, ttl_seconds: float = 0, on_evict=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()
+    
+    def get(self, key: Any, default: Any = None) -> Any:
+        """Return a cached value and mark it recently used."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        value, expires_at = entry
+        if expires_at and expires_at < time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+    
+    def set(self, key: Any, value: Any, ttl_seconds: Optional[float] = None):
+        """Cache a value, evicting the least recently used entry when full."""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._entries[key] = (value, time.monotonic() + ttl if ttl else 0)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted_key, (evicted_value, _) = self._entries.popitem(last=False)
+            if self.on_evict:
+                self.on_evict(evicted_key, evicted_value)
+    
+    def delete(self, key: Any):
+        """Drop a cached value if present."""
+        self._entries.pop(key, None)
+    
+    def clear(self):
+        """Drop every cached value."""
+        self._entries.clear()
+    
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key) is not None
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_redis_client = None
+
+
+def get_redis():
+    """Return the shared async Redis client, created on first use."""
+    global _redis_client
+    if _redis_client is None:
+        import redis.asyncio as redis
+        _redis_client = redis.from_url(settings.REDIS_URL, socket_connect_timeout=1)
+    return _redis_client
+
+
+class CorpusVersions:
+    """Per-user corpus version counters.
+    
+    Every ingest or delete bumps the user's version, and cache keys include
+    it, so results cached before a change are never served after it. The
+    counters live in Redis, shared by all workers, so a change handled by
+    one worker invalidates every worker's entries. When Redis can't be
+    read the version is unknown (-1) and nothing is cached or served.
+    
+    The time of the change is kept with the version. With read replicas,
+    a result read within replica_write_window_seconds of a change may
+    come from a replica that hasn't replayed it, so the version is
+    reported unknown until then, and get_read_db sends the user's reads
+    to the primary (see written_at).
+    """
+    
+    KEY_PREFIX = "twinmind:corpus:"
+    
+    async def get(self, user_id: str) -> int:
+        """Return the user's current corpus version, or -1 if unknown."""
+        try:
+            version, written_at = await get_redis().hmget(self.KEY_PREFIX + user_id, "version", "written_at")
+        except Exception as e:
+            logger.warning(f"Could not read corpus version from Redis: {e}")
+            # Without a shared version nothing cached can be trusted
+            return -1
+        if (
+            written_at is not None
+            and settings.database_replica_urls_list
+            and time.time() - float(written_at) < settings.replica_write_window_seconds
+        ):
+            # Results read now may not include the change yet
+            return -1
+        return int(version or 0)
+    
+    async def written_at(self, user_id: str) -> Optional[float]:
+        """Wall-clock time of the user's last change, None if never recorded."""
+        try:
+            written_at = await get_redis().hget(self.KEY_PREFIX + user_id, "written_at")
+        except Exception as e:
+            logger.warning(f"Could not read corpus write time from Redis: {e}")
+            # Unknown: assume a change just happened
+            return time.time()
+        return float(written_at) if written_at is not None else None
+    
+    async def bump(self, user_id: str):
+        """Invalidate everything cached for the user's corpus and record when it changed."""
+        if not (settings.QUERY_CACHE_ENABLED or settings.ANSWER_CACHE_ENABLED or settings.database_replica_urls_list):
+            return
+        try:
+            pipe = get_redis().pipeline(transaction=True)
+            pipe.hincrby(self.KEY_PREFIX + user_id, "version", 1)
+            pipe.hset(self.KEY_PREFIX + user_id, "written_at", time.time())
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not bump corpus version in Redis: {e}")
+
+
+corpus_versions = CorpusVersions()
+
+
+class QueryResultCache:
+    """Retrieval result cache.
+    
+    Keyed on (user, normalized query, top_k, retrieval options, corpus
+    version). Entries live in an in-process LRU and, with
+    QUERY_CACHE_REDIS_ENABLED, in Redis so repeated queries hit across
+    workers.
+    """
+    
+    KEY_PREFIX = "twinmind:retrieval:"
+    
+    def __init__(self):
+        self.local = LRUCache(settings.QUERY_CACHE_MAX_ENTRIES, settings.QUERY_CACHE_TTL_SECONDS)
+    
+    async def make_key(
+        self,
+        user_id: str,
+        query: str,
+        top_k: int,
+        options: Dict[str, Any]
+    ) -> Optional[str]:
+        """Build the cache key, or None if the corpus version is unknown."""
+        version = await corpus_versions.get(user_id)
+        if version < 0:
+            return None
+        normalized_query = " ".join(query.split()).casefold()
+        raw_key = json.dumps(
+            [user_id, normalized_query, top_k, options, version],
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.sha256(raw_key.encode()).hexdigest()
+    
+    async def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """Return cached results for a key."""
+        results = self.local.get(key)
+        if results is not None:
+            metrics.increment("query_cache.hits")
+            return [dict(result) for result in results]
+        
+        if settings.QUERY_CACHE_REDIS_ENABLED:
+            try:
+                cached = await get_redis().get(self.KEY_PREFIX + key)
+            except Exception as e:
+                logger.warning(f"Query cache Redis read failed: {e}")
+                cached = None
+            if cached is not None:
+                results = json.loads(cached)
+                self.local.set(key, results)
+                metrics.increment("query_cache.hits")
+                metrics.increment("query_cache.redis_hits")
+                return [dict(result) for result in results]
+        
+        metrics.increment("query_cache.misses")
+        return None
+    
+    async def set(self, key: str, results: List[Dict[str, Any]]):
+        """Cache results for a key."""
+        self.local.set(key, [dict(result) for result in results])
+        if settings.QUERY_CACHE_REDIS_ENABLED:
+            try:
+                await get_redis().set(
+                    self.KEY_PREFIX + key,
+                    json.dumps(results, default=str),
+                    ex=settings.QUERY_CACHE_TTL_SECONDS or None
+                )
+            except Exception as e:
+                logger.warning(f"Query cache Redis write failed: {e}")
+
+
+query_cache = QueryResultCache()
+
+
+class ChunkHydrationCache:
+    """Bounded LRU of hydrated chunks (text plus source info) by chunk id.
+    
+    Chunk text and source info never change after ingestion, so entries
+    only need dropping when their source is deleted.
+    """
+    
+    def __init__(self):
+        self.local = LRUCache(settings.HYDRATION_CACHE_MAX_ENTRIES, on_evict=self._forget)
+        self._by_source: Dict[str, set] = {}
+    
+    def get_many(self, chunk_ids: List[str], user_id: str) -> Dict[str, Dict[str, Any]]:
+        """Return cached chunks owned by the user, keyed by chunk id."""
+        found = {}
+        for chunk_id in chunk_ids:
+            entry = self.local.get(chunk_id)
+            if entry is not None and entry[0] == user_id:
+                found[chunk_id] = entry[1]
+        metrics.increment("hydration_cache.hits", len(found))
+        metrics.increment("hydration_cache.misses", len(chunk_ids) - len(found))
+        return found
+    
+    def put(self, chunk: Dict[str, Any], user_id: str):
+        """Cache a hydrated chunk."""
+        self.local.set(chunk["id"], (user_id, chunk))
+        self._by_source.setdefault(chunk["source"]["id"], set()).add(chunk["id"])
+    
+    def invalidate_source(self, source_id: str):
+        """Drop every cached chunk of a deleted source."""
+        for chunk_id in self._by_source.pop(source_id, ()):
+            self.local.delete(chunk_id)
+    
+    def _forget(self, chunk_id: str, entry: tuple):
+        """Keep the source index in step with LRU evictions."""
+        chunk_ids = self._by_source.get(entry[1]["source"]["id"])
+        if chunk_ids is not None:
+            chunk_ids.discard(chunk_id)
+            if not chunk_ids:
+                del self._by_source[entry[1]["source"]["id"]]
+
+
+hydration_cache = ChunkHydrationCache()
+
+
+class SemanticAnswerCache:
+    """Generated answers keyed by query embedding.
+    
+    A question is served a stored answer when its embedding is within
+    ANSWER_CACHE_SIMILARITY (cosine) of a question the same user asked
+    under the same corpus version and answer options. Entries are kept
+    in-process, per user, newest last; the shared corpus version makes
+    a change handled by any worker invalidate them.
+    
+    options carry the "corpus_version" read before retrieval, so an
+    answer generated while the corpus changed is stored under the old
+    version and never served.
+    """
+    
+    def __init__(self):
+        self.users = LRUCache(settings.ANSWER_CACHE_MAX_USERS)
+    
+    def _options_key(self, options: Dict[str, Any]) -> str:
+        return json.dumps(options, sort_keys=True, default=str)
+    
+    def _normalize(self, embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+    
+    async def lookup(
+        self,
+        user_id: str,
+        embedding: List[float],
+        options: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """Return the closest stored answer ("answer", "sources", "similarity")."""
+        entries = self.users.get(user_id)
+        version = options["corpus_version"]
+        options_key = self._options_key(options)
+        now = time.monotonic()
+        candidates = [
+            entry for entry in entries or ()
+            if entry["version"] == version and entry["options_key"] == options_key and entry["expires_at"] > now
+        ]
+        if version < 0 or not candidates:
+            metrics.increment("answer_cache.misses")
+            return None
+        
+        similarities = np.stack([entry["embedding"] for entry in candidates]) @ self._normalize(embedding)
+        best = int(np.argmax(similarities))
+        if similarities[best] < settings.ANSWER_CACHE_SIMILARITY:
+            metrics.increment("answer_cache.misses")
+            return None
+        
+        metrics.increment("answer_cache.hits")
+        return {
+            "answer": candidates[best]["answer"],
+            "sources": candidates[best]["sources"],
+            "similarity": float(similarities[best])
+        }
+    
+    async def store(
+        self,
+        user_id: str,
+        embedding: List[float],
+        options: Dict[str, Any],
+        answer: str,
+        sources: List[Dict[str, Any]]
+    ):
+        """Remember an answer generated for a question."""
+        version = options["corpus_version"]
+        if version < 0:
+            return
+        now = time.monotonic()
+        # Versions only go up, so entries for an older corpus are dead
+        entries = [
+            entry for entry in self.users.get(user_id) or ()
+            if entry["version"] == version and entry["expires_at"] > now
+        ]
+        entries.append({
+            "version": version,
+            "options_key": self._options_key(options),
+            "embedding": self._normalize(embedding),
+            "answer": answer,
+            "sources": sources,
+            "expires_at": now + settings.ANSWER_CACHE_TTL_SECONDS
+        })
+        self.users.set(user_id, entries[-settings.ANSWER_CACHE_MAX_ENTRIES_PER_USER:])
+
+
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,170 @@
+"""
+Token-budgeted packing of retrieved chunks into LLM context.
+"""
+from typing import List, Dict, Any, Optional, Tuple
+from functools import lru_cache
+from app.config import settings
+import re
+import tiktoken
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+# Shortest suffix/prefix match treated as chunking overlap rather than chance
+_MIN_OVERLAP_CHARS = 32
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """The tokenizer, loaded once per process."""
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens in text."""
+    try:
+        return len(_encoding().encode(text))
+    except Exception:
+        # Fallback: approximate 1 token = 4 characters
+        return len(text) // 4
+
+
+def overlap_length(previous: str, text: str) -> int:
+    """Length of the longest end of previous that text starts with."""
+    if len(previous) < _MIN_OVERLAP_CHARS or len(text) < _MIN_OVERLAP_CHARS:
+        return 0
+    
+    probe = text[:_MIN_OVERLAP_CHARS]
+    position = previous.find(probe)
+    while position != -1:
+        # Earliest match is the longest overlap
+        if text.startswith(previous[position:]):
+            return len(previous) - position
+        position = previous.find(probe, position + 1)
+    return 0
+
+
+def strip_overlap(previous: str, text: str) -> str:
+    """
+    Remove the start of text that repeats the end of previous.
+    Adjacent chunks share their boundary sentences (see
+    BaseProcessor._get_overlap_text); this drops the repeat.
+    """
+    return text[overlap_length(previous, text):].lstrip()
+
+
+def join_chunks(texts: List[str]) -> str:
+    """Join consecutive chunks of one source without their overlaps."""
+    joined = []
+    for i, text in enumerate(texts):
+        if i > 0:
+            text = strip_overlap(texts[i - 1], text)
+        if text:
+            joined.append(text)
+    return "\n\n".join(joined)
+
+
+class ContextPacker:
+    """Fits retrieved chunks into a prompt token budget.
+    
+    Chunks are taken best score first. Text a chunk shares with an
+    adjacent chunk of the same source that is already packed is dropped,
+    and the chunk that crosses the budget is cut at a sentence boundary.
+    """
+    
+    def pack(
+        self,
+        chunks: List[Dict[str, Any]],
+        token_budget: Optional[int] = None
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Pack hydrated chunks into LLM context chunks ("text",
+        "source_name", "source_type", "source_id", "chunk_index").
+        Returns them with packing stats for query_metadata.
+        """
+        budget = token_budget or settings.CONTEXT_TOKEN_BUDGET
+        ordered = sorted(chunks, key=lambda c: c.get("relevance_score", 0.0), reverse=True)
+        
+        # Source id -> chunk index -> packed text, for overlap removal
+        packed_spans: Dict[str, Dict[int, str]] = {}
+        context_chunks = []
+        used = 0
+        stats = {"token_budget": budget, "truncated": 0, "dropped": 0, "overlap_tokens_removed": 0}
+        
+        for chunk in ordered:
+            source = chunk["source"]
+            text = self._dedupe(chunk, packed_spans.get(source["id"], {}))
+            if not text:
+                stats["overlap_tokens_removed"] += count_tokens(chunk["text"])
+                continue
+            if len(text) != len(chunk["text"]):
+                stats["overlap_tokens_removed"] += count_tokens(chunk["text"]) - count_tokens(text)
+            
+            # Header as LLMService formats it
+            header_tokens = count_tokens(f"[Source: {source.get('name') or 'Unknown'}]\n")
+            remaining = budget - used - header_tokens
+            tokens = count_tokens(text)
+            if tokens > remaining:
+                text = self._truncate(text, remaining)
+                if not text:
+                    stats["dropped"] += 1
+                    continue
+                tokens = count_tokens(text)
+                stats["truncated"] += 1
+            
+            used += header_tokens + tokens
+            start, end = self._index_range(chunk)
+            context_chunks.append({
+                "text": text,
+                "source_name": source.get("name"),
+                "source_type": source.get("type"),
+                "source_id": source["id"],
+                "chunk_index": start
+            })
+            if start is not None:
+                spans = packed_spans.setdefault(source["id"], {})
+                spans[start] = spans[end] = chunk["text"]
+        
+        stats["context_tokens"] = used
+        stats["chunks_packed"] = len(context_chunks)
+        return context_chunks, stats
+    
+    def _index_range(self, chunk: Dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+        """First and last chunk index a (possibly expanded) chunk covers."""
+        window = chunk.get("window")
+        if window:
+            return window["start_index"], window["end_index"]
+        index = chunk.get("chunk_index")
+        return index, index
+    
+    def _dedupe(self, chunk: Dict[str, Any], packed: Dict[int, str]) -> str:
+        """Drop text shared with already packed neighbors of the chunk."""
+        text = chunk["text"]
+        start, end = self._index_range(chunk)
+        if start is None:
+            return text
+        
+        before = packed.get(start - 1)
+        if before is not None:
+            text = strip_overlap(before, text)
+        after = packed.get(end + 1)
+        if after is not None and text:
+            # Here the neighbor's head repeats our tail
+            text = text[:len(text) - overlap_length(text, after)].rstrip()
+        return text
+    
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """Longest run of whole leading sentences within max_tokens."""
+        if max_tokens <= 0:
+            return ""
+        kept = []
+        used = 0
+        for sentence in _SENTENCE_END.split(text):
+            sentence_tokens = count_tokens(sentence) + (1 if kept else 0)
+            if used + sentence_tokens > max_tokens:
+                break
+            kept.append(sentence)
+            used += sentence_tokens
+        return " ".join(kept)
+
+
+context_packer = ContextPacker()
@@ -0,0 +1,177 @@
+"""
+Source deletion across PostgreSQL, Qdrant and object storage.
+"""
+from typing import Dict, Iterable, List, Optional, Set
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+import logging
+import uuid
+from app.config import settings
+from app.database import AsyncSessionLocal, mark_write
+from app.models import Source, Chunk
+from app.services.cache import LRUCache, corpus_versions, get_redis, hydration_cache
+from app.services.metrics import metrics
+from app.services.blobs import is_blob_key
+from app.services.storage import storage_service
+from app.services.users import to_user_uuid
+from app.services.vector_db import vector_db
+
+logger = logging.getLogger(__name__)
+
+class DeletionService:
+    """Deletes sources in two phases.
+    
+    mark_deleted sets sources.deleted_at, which hides a source from
+    listing and retrieval at once, tombstones it in Redis for every
+    worker, and asks Qdrant to drop its vectors without waiting. purge, run as a background job, then removes the
+    vectors (waiting this time), the stored files and the rows, with
+    set-based DELETEs per batch of sources. Sources still marked after a
+    crash are purged by purge_pending at startup.
+    """
+    
+    KEY_PREFIX = "twinmind:tombstone:"
+    
+    def __init__(self):
+        # Vector hits can hydrate without PostgreSQL (payloads, the
+        # hydration cache); tombstones drop deleted sources from them
+        # until Qdrant has applied the deletion. Shared through Redis,
+        # with this worker's own deletions also kept locally.
+        self.tombstones = LRUCache(100000, settings.DELETION_TOMBSTONE_SECONDS)
+    
+    async def deleted_among(self, db: AsyncSession, source_ids: Iterable[str]) -> Set[str]:
+        """The given sources that are marked deleted."""
+        deleted = {source_id for source_id in source_ids if source_id in self.tombstones}
+        unknown = [source_id for source_id in source_ids if source_id not in deleted]
+        if not unknown:
+            return deleted
+        try:
+            flags = await get_redis().mget([self.KEY_PREFIX + source_id for source_id in unknown])
+            return deleted | {source_id for source_id, flag in zip(unknown, flags) if flag is not None}
+        except Exception as e:
+            logger.warning(f"Could not read tombstones from Redis: {e}")
+        # Without the shared tombstones, ask PostgreSQL
+        result = await db.execute(
+            select(Source.id).where(
+                Source.id.in_([uuid.UUID(source_id) for source_id in unknown]),
+                Source.deleted_at.isnot(None)
+            )
+        )
+        return deleted | {str(source_id) for source_id in result.scalars().all()}
+    
+    async def mark_deleted(
+        self,
+        db: AsyncSession,
+        user_id: str,
+        source_ids: Optional[List[str]] = None
+    ) -> List[str]:
+        """
+        Mark the user's sources deleted, all of them if source_ids is
+        None. Returns the ids marked; already deleted or unknown sources
+        are skipped.
+        """
+        user_uuid = to_user_uuid(user_id)
+        stmt = (
+            update(Source)
+            .where(Source.user_id == user_uuid, Source.deleted_at.is_(None))
+            .values(deleted_at=func.now())
+            .returning(Source.id)
+            .execution_options(synchronize_session=False)
+        )
+        if source_ids is not None:
+            stmt = stmt.where(Source.id.in_([uuid.UUID(source_id) for source_id in source_ids]))
+        deleted = [str(source_id) for source_id in (await db.execute(stmt)).scalars().all()]
+        mark_write(db, user_id)
+        await db.commit()
+        
+        if deleted:
+            for source_id in deleted:
+                self.tombstones.set(source_id, True)
+                hydration_cache.invalidate_source(source_id)
+            await self._share_tombstones(deleted)
+            await corpus_versions.bump(str(user_uuid))
+            try:
+                await vector_db.delete_chunks_by_sources(deleted, wait=False)
+            except Exception as e:
+                # The purge deletes them again
+                logger.warning(f"Error queueing vector deletion: {e}")
+        metrics.increment("deletion.sources_marked", len(deleted))
+        return deleted
+    
+    async def _share_tombstones(self, source_ids: List[str]):
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for source_id in source_ids:
+                pipe.set(self.KEY_PREFIX + source_id, 1, ex=settings.DELETION_TOMBSTONE_SECONDS)
+            await pipe.execute()
+        except Exception as e:
+            # Other workers fall back to checking deleted_at
+            logger.warning(f"Could not share tombstones through Redis: {e}")
+    
+    async def purge(self, source_ids: List[str]) -> int:
+        """Remove marked sources from every store. Returns the number purged."""
+        purged = 0
+        batch_size = settings.DELETION_PURGE_BATCH
+        for start in range(0, len(source_ids), batch_size):
+            try:
+                purged += await self._purge_batch(source_ids[start:start + batch_size])
+            except Exception as e:
+                logger.exception("Error purging deleted sources")
+                metrics.increment("deletion.purge_failures")
+        return purged
+    
+    async def purge_pending(self):
+        """Purge sources left marked by an interrupted purge."""
+        while True:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(
+                    select(Source.id)
+                    .where(Source.deleted_at.isnot(None))
+                    .order_by(Source.deleted_at)
+                    .limit(settings.DELETION_PURGE_BATCH)
+                )
+                source_ids = [str(source_id) for source_id in result.scalars().all()]
+            # Stop rather than spin when a batch can't be purged
+            if not source_ids or not await self.purge(source_ids):
+                return
+    
+    async def _purge_batch(self, source_ids: List[str]) -> int:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Source.id, Source.user_id, Source.object_storage_key).where(
+                    Source.id.in_([uuid.UUID(source_id) for source_id in source_ids]),
+                    Source.deleted_at.isnot(None)
+                )
+            )
+            rows = result.all()
+        if not rows:
+            return 0
+        
+        await vector_db.delete_chunks_by_sources([str(row.id) for row in rows])
+        for row in rows:
+            # Shared blobs are left to the blob GC once nothing references them
+            if row.object_storage_key and not is_blob_key(row.object_storage_key):
+                await storage_service.delete_file(row.object_storage_key)
+        
+        by_user: Dict[uuid.UUID, List[uuid.UUID]] = {}
+        for row in rows:
+            by_user.setdefault(row.user_id, []).append(row.id)
+        async with AsyncSessionLocal() as session:
+            for user_uuid, ids in by_user.items():
+                # One statement per user, confined to the user's chunk partition
+                await session.execute(
+                    delete(Chunk)
+                    .where(Chunk.user_id == user_uuid, Chunk.source_id.in_(ids))
+                    .execution_options(synchronize_session=False)
+                )
+            await session.execute(
+                delete(Source)
+                .where(Source.id.in_([row.id for row in rows]))
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        
+        metrics.increment("deletion.sources_purged", len(rows))
+        return len(rows)
+
+
+deletion_service = DeletionService()
@@ -0,0 +1,184 @@
+"""
+Rank fusion for combining results from multiple retrievers.
+"""
+from typing import List, Dict, Any, Optional, Tuple
+import heapq
+import math
+import numpy as np
+from app.config import settings
+
+
+FUSION_STRATEGIES = ("rrf", "zscore", "maxnorm")
+
+
+class FusionEngine:
+    """Fuses ranked result lists from registered retrievers into one ranking.
+    
+    Strategies:
+    - rrf: weighted reciprocal rank fusion, sum of weight / (k + rank)
+    - zscore: weighted sum of per-retriever z-scores; a candidate missing
+      from a retriever gets one standard deviation below that retriever's
+      lowest z-score
+    - maxnorm: weighted sum of scores divided by each retriever's max score
+    
+    Each result list holds dicts with "chunk_id" and "score". Fused results
+    carry "chunk_id", "score" and a "<retriever>_score" per contributing
+    retriever.
+    """
+    
+    def __init__(self):
+        self.weights: Dict[str, float] = {}
+    
+    def register_retriever(self, name: str, weight: float):
+        """Register a retriever and its fusion weight."""
+        self.weights[name] = weight
+    
+    def fuse(
+        self,
+        results: Dict[str, List[Dict[str, Any]]],
+        top_k: int,
+        strategy: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Fuse per-retriever results and return the top_k candidates."""
+        strategy = strategy or settings.FUSION_STRATEGY
+        if strategy not in FUSION_STRATEGIES:
+            raise ValueError(f"Unsupported fusion strategy: {strategy}")
+        
+        for name in results:
+            if name not in self.weights:
+                raise ValueError(f"Unregistered retriever: {name}")
+        
+        results = {name: items for name, items in results.items() if items}
+        if not results or top_k <= 0:
+            return []
+        
+        candidate_count = sum(len(items) for items in results.values())
+        if candidate_count >= settings.FUSION_NUMPY_THRESHOLD:
+            return self._fuse_numpy(results, top_k, strategy)
+        return self._fuse_python(results, top_k, strategy)
+    
+    def _fuse_python(
+        self,
+        results: Dict[str, List[Dict[str, Any]]],
+        top_k: int,
+        strategy: str
+    ) -> List[Dict[str, Any]]:
+        """Dict-based fusion for small candidate sets."""
+        fused: Dict[str, Dict[str, Any]] = {}
+        floors: Dict[str, float] = {}
+        
+        for name, items in results.items():
+            weight = self.weights[name]
+            normalized, floor = self._normalize([item["score"] for item in items], strategy)
+            floors[name] = floor
+            key = f"{name}_score"
+            
+            for item, value in zip(items, normalized):
+                entry = fused.get(item["chunk_id"])
+                if entry is None:
+                    entry = fused[item["chunk_id"]] = {"chunk_id": item["chunk_id"], "score": 0.0}
+                elif key in entry:
+                    continue
+                entry["score"] += weight * value
+                entry[key] = value
+        
+        # Charge candidates missing from a retriever that retriever's floor
+        for name, floor in floors.items():
+            if floor:
+                key = f"{name}_score"
+                penalty = self.weights[name] * floor
+                for entry in fused.values():
+                    if key not in entry:
+                        entry["score"] += penalty
+        
+        return heapq.nlargest(top_k, fused.values(), key=lambda x: x["score"])
+    
+    def _normalize(self, scores: List[float], strategy: str) -> Tuple[List[float], float]:
+        """Per-item contributions for one retriever, plus the absent-item floor."""
+        if strategy == "rrf":
+            order = sorted(range(len(scores)), key=lambda i: -scores[i])
+            normalized = [0.0] * len(scores)
+            for rank, i in enumerate(order, start=1):
+                normalized[i] = 1.0 / (settings.FUSION_RRF_K + rank)
+            return normalized, 0.0
+        
+        if strategy == "zscore":
+            mean = sum(scores) / len(scores)
+            std = math.sqrt(sum((s - mean) ** 2 for s in scores) / len(scores))
+            normalized = [(s - mean) / std if std > 0 else 0.0 for s in scores]
+            return normalized, min(normalized) - 1.0
+        
+        max_score = max(scores)
+        return [s / max_score if max_score > 0 else 0.0 for s in scores], 0.0
+    
+    def _fuse_numpy(
+        self,
+        results: Dict[str, List[Dict[str, Any]]],
+        top_k: int,
+        strategy: str
+    ) -> List[Dict[str, Any]]:
+        """Vectorized fusion for large candidate sets.
+        
+        Scores are laid out as a (retrievers x candidates) matrix with NaN
+        for absent candidates, normalized row-wise and reduced with one
+        weight-vector product.
+        """
+        names = list(results)
+        index: Dict[str, int] = {}
+        columns = []
+        for items in results.values():
+            columns.append(np.fromiter(
+                (index.setdefault(item["chunk_id"], len(index)) for item in items),
+                dtype=np.intp,
+                count=len(items)
+            ))
+        chunk_ids = list(index)
+        
+        raw = np.full((len(names), len(chunk_ids)), np.nan)
+        ranks = np.zeros_like(raw)
+        for row, (items, cols) in enumerate(zip(results.values(), columns)):
+            scores = np.fromiter((item["score"] for item in items), dtype=float, count=len(items))
+            # Reversed so the first occurrence wins for duplicate ids within one retriever
+            raw[row, cols[::-1]] = scores[::-1]
+            if strategy == "rrf":
+                item_ranks = np.empty(len(items))
+                item_ranks[np.argsort(-scores, kind="stable")] = np.arange(1, len(items) + 1)
+                ranks[row, cols[::-1]] = item_ranks[::-1]
+        present = ~np.isnan(raw)
+        
+        if strategy == "rrf":
+            normalized = np.where(present, 1.0 / (settings.FUSION_RRF_K + ranks), np.nan)
+            floors = np.zeros((len(names), 1))
+        elif strategy == "zscore":
+            mean = np.nanmean(raw, axis=1, keepdims=True)
+            std = np.nanstd(raw, axis=1, keepdims=True)
+            safe_std = np.where(std > 0, std, 1.0)
+            normalized = np.where(std > 0, (raw - mean) / safe_std, np.where(present, 0.0, np.nan))
+            floors = np.nanmin(normalized, axis=1, keepdims=True) - 1.0
+        else:
+            maxes = np.nanmax(raw, axis=1, keepdims=True)
+            safe_maxes = np.where(maxes > 0, maxes, 1.0)
+            normalized = np.where(maxes > 0, raw / safe_maxes, np.where(present, 0.0, np.nan))
+            floors = np.zeros((len(names), 1))
+        
+        contributions = np.where(present, normalized, floors)
+        weights = np.array([self.weights[name] for name in names])
+        fused = weights @ contributions
+        
+        if len(chunk_ids) > top_k:
+            top = np.argpartition(-fused, top_k - 1)[:top_k]
+        else:
+            top = np.arange(len(chunk_ids))
+        top = top[np.argsort(-fused[top], kind="stable")]
+        
+        ranked = []
+        for i in top:
+            entry = {"chunk_id": chunk_ids[i], "score": float(fused[i])}
+            for row, name in enumerate(names):
+                if present[row, i]:
+                    entry[f"{name}_score"] = float(normalized[row, i])
+            ranked.append(entry)
+        return ranked
+
+
+fusion_engine = FusionEngine()
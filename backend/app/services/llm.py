@@ -1,105 +1,332 @@
 """
 LLM service for generating answers.
 """
-from typing import List, Dict, Any, AsyncIterator, Union
+from abc import ABC, abstractmethod
+from typing import List, Dict, Any, AsyncIterator, Optional
 from openai import AsyncOpenAI
 from anthropic import AsyncAnthropic
+import asyncio
+import logging
+import time
 from app.config import settings
+from app.services.admission import admission_controller, AdmissionRejected, Priority
+from app.services.llm_health import CircuitOpen, provider_health
+from app.services.metrics import metrics
+from app.services.prompts import Prompt, prompt_builder
 
+logger = logging.getLogger(__name__)
 
-class LLMService:
-    """Service for LLM interactions."""
+
+class LLMProvider(ABC):
+    """One LLM backend.
     
-    def __init__(self):
-        """Initialize LLM client."""
-        self.provider = settings.LLM_PROVIDER
-        
-        if self.provider == "openai":
-            self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-            self.model = settings.OPENAI_LLM_MODEL
-        elif self.provider == "anthropic":
-            self.client = AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY)
-            self.model = "claude-3-opus-20240229"
-        else:
-            raise ValueError(f"Unsupported LLM provider: {self.provider}")
+    complete and stream fill the usage dict they're given with token
+    counts ("input_tokens", "output_tokens", "cached_input_tokens",
+    "cache_creation_input_tokens") once the provider reports them.
+    """
     
-    async def generate_answer(
-        self,
-        query: str,
-        context_chunks: List[Dict[str, Any]],
-        stream: bool = False
-    ):
-        """Generate answer from query and context."""
-        # Build context from chunks
-        context_text = "\n\n".join([
-            f"[Source: {chunk.get('source_name', 'Unknown')}]\n{chunk.get('text', '')}"
-            for chunk in context_chunks
-        ])
-        
-        system_prompt = """You are a helpful AI assistant with access to a user's personal knowledge base.
-Your task is to answer questions based on the provided context. Be concise, accurate, and cite sources when relevant.
-If the context doesn't contain enough information to answer the question, say so clearly."""
-        
-        user_prompt = f"""Context from knowledge base:
-{context_text}
+    name = ""
+    model = ""
+    
+    @abstractmethod
+    async def complete(self, prompt: Prompt, usage: Dict[str, Any]) -> str:
+        """Generate a full answer."""
+        pass
+    
+    @abstractmethod
+    def stream(self, prompt: Prompt, usage: Dict[str, Any]) -> AsyncIterator[str]:
+        """Stream an answer token by token."""
+        pass
 
-Question: {query}
 
-Please provide a comprehensive answer based on the context above."""
-        
-        if self.provider == "openai":
-            if stream:
-                # For streaming, return the async generator directly (it's already a coroutine)
-                # We'll await it in the calling code
-                return self._stream_openai(system_prompt, user_prompt)
-            else:
-                response = await self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=0.7
-                )
-                return response.choices[0].message.content
-        else:  # anthropic
-            if stream:
-                return self._stream_anthropic(system_prompt, user_prompt)
-            else:
-                message = await self.client.messages.create(
-                    model=self.model,
-                    max_tokens=1024,
-                    system=system_prompt,
-                    messages=[{"role": "user", "content": user_prompt}]
-                )
-                return message.content[0].text
+class OpenAIProvider(LLMProvider):
+    """OpenAI chat completions.
+    
+    Prompt caching is automatic for long prefixes; cached tokens are
+    reported in usage.prompt_tokens_details.
+    """
+    
+    name = "openai"
+    
+    def __init__(self):
+        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+        self.model = settings.OPENAI_LLM_MODEL
+    
+    def _record_usage(self, reported, usage: Dict[str, Any]):
+        if reported is None:
+            return
+        details = getattr(reported, "prompt_tokens_details", None)
+        usage.update({
+            "provider": self.name,
+            "model": self.model,
+            "input_tokens": reported.prompt_tokens,
+            "output_tokens": reported.completion_tokens,
+            "cached_input_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+            "cache_creation_input_tokens": 0
+        })
+    
+    async def complete(self, prompt: Prompt, usage: Dict[str, Any]) -> str:
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=prompt.openai_messages(),
+            temperature=0.7
+        )
+        self._record_usage(response.usage, usage)
+        return response.choices[0].message.content
     
-    async def _stream_openai(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+    async def stream(self, prompt: Prompt, usage: Dict[str, Any]) -> AsyncIterator[str]:
         """Stream response from OpenAI."""
         stream = await self.client.chat.completions.create(
             model=self.model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+            messages=prompt.openai_messages(),
             temperature=0.7,
-            stream=True
+            stream=True,
+            stream_options={"include_usage": True}
         )
         async for chunk in stream:
-            if chunk.choices[0].delta.content:
+            # The closing chunk carries usage and no choices
+            if chunk.choices and chunk.choices[0].delta.content:
                 yield chunk.choices[0].delta.content
+            if chunk.usage:
+                self._record_usage(chunk.usage, usage)
+
+
+class AnthropicProvider(LLMProvider):
+    """Anthropic messages, with a cache breakpoint after long context.
+    
+    With the pinned SDK, cache_control is only honored (and cache token
+    counts only reported) by the prompt-caching beta client.
+    """
+    
+    name = "anthropic"
     
-    async def _stream_anthropic(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+    def __init__(self):
+        self.client = AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY)
+        self.messages = self.client.beta.prompt_caching.messages
+        self.model = settings.ANTHROPIC_LLM_MODEL
+    
+    def _record_usage(self, reported, usage: Dict[str, Any]):
+        usage.update({
+            "provider": self.name,
+            "model": self.model,
+            "input_tokens": reported.input_tokens,
+            "output_tokens": reported.output_tokens,
+            "cached_input_tokens": getattr(reported, "cache_read_input_tokens", None) or 0,
+            "cache_creation_input_tokens": getattr(reported, "cache_creation_input_tokens", None) or 0
+        })
+    
+    async def complete(self, prompt: Prompt, usage: Dict[str, Any]) -> str:
+        message = await self.messages.create(
+            model=self.model,
+            max_tokens=1024,
+            system=prompt.system,
+            messages=prompt.anthropic_messages()
+        )
+        self._record_usage(message.usage, usage)
+        return message.content[0].text
+    
+    async def stream(self, prompt: Prompt, usage: Dict[str, Any]) -> AsyncIterator[str]:
         """Stream response from Anthropic."""
-        async with self.client.messages.stream(
+        async with self.messages.stream(
             model=self.model,
             max_tokens=1024,
-            system=system_prompt,
-            messages=[{"role": "user", "content": user_prompt}]
+            system=prompt.system,
+            messages=prompt.anthropic_messages()
         ) as stream:
             async for text in stream.text_stream:
                 yield text
+            self._record_usage((await stream.get_final_message()).usage, usage)
 
 
-llm_service = LLMService()
+PROVIDERS = {
+    "openai": OpenAIProvider,
+    "anthropic": AnthropicProvider
+}
+
 
+class LLMService:
+    """Service for LLM interactions.
+    
+    Requests go to the configured providers (LLM_PROVIDER, then
+    LLM_FALLBACK_PROVIDERS) in the order chosen by LLM_ROUTING_POLICY,
+    skipping providers whose circuit is open. Errors fail over to the
+    next provider; slow streams are hedged (see _stream).
+    """
+    
+    def __init__(self):
+        """Initialize LLM clients."""
+        self.providers: Dict[str, LLMProvider] = {}
+        for name in settings.llm_providers_list:
+            if name not in PROVIDERS:
+                raise ValueError(f"Unsupported LLM provider: {name}")
+            self.providers[name] = PROVIDERS[name]()
+        
+        # The primary provider
+        self.provider = settings.LLM_PROVIDER
+        self.model = self.providers[self.provider].model
+    
+    def check_admission(self):
+        """Reject up front only if every provider's queue is full."""
+        rejection = None
+        for name in self.providers:
+            try:
+                admission_controller.check(name)
+                return
+            except AdmissionRejected as e:
+                rejection = e
+        raise rejection
+    
+    async def generate_answer(
+        self,
+        query: str,
+        context_chunks: List[Dict[str, Any]],
+        stream: bool = False,
+        priority: Priority = Priority.INTERACTIVE,
+        usage: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Generate answer from query and context.
+        Generation runs under the provider's admission control and raises
+        AdmissionRejected when no slot can be had; a stream takes its slot
+        when iteration starts and holds it until the stream ends.
+        
+        If a usage dict is passed it is filled with the provider, model
+        and token counts, including prompt-cached input tokens, once the
+        answer (or stream) is complete.
+        """
+        prompt = prompt_builder.build(query, context_chunks)
+        if usage is None:
+            usage = {}
+        
+        if stream:
+            # For streaming, return the async generator directly
+            # We'll iterate it in the calling code
+            return self._stream(prompt, priority, usage)
+        return await self._complete(prompt, priority, usage)
+    
+    async def _complete(self, prompt: Prompt, priority: Priority, usage: Dict[str, Any]) -> str:
+        """Generate with the first provider that succeeds."""
+        last_error: Optional[Exception] = None
+        for name in provider_health.rank(list(self.providers)):
+            try:
+                async with admission_controller.slot(name, priority):
+                    provider_health.begin(name)
+                    answer = await self.providers[name].complete(prompt, usage)
+            except (AdmissionRejected, CircuitOpen) as e:
+                last_error = e
+                continue
+            except Exception as e:
+                logger.warning(f"LLM provider {name} failed: {e}")
+                provider_health.record_failure(name)
+                metrics.increment("llm.failovers")
+                last_error = e
+                continue
+            provider_health.record_success(name)
+            return answer
+        raise last_error or RuntimeError("No LLM provider available")
+    
+    async def _provider_stream(
+        self,
+        name: str,
+        prompt: Prompt,
+        priority: Priority,
+        usage: Dict[str, Any]
+    ) -> AsyncIterator[str]:
+        """A provider's stream, holding its admission slot throughout."""
+        async with admission_controller.slot(name, priority):
+            provider_health.begin(name)
+            async for token in self.providers[name].stream(prompt, usage):
+                yield token
+    
+    async def _stream(self, prompt: Prompt, priority: Priority, usage: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        Stream from the best provider, hedging slow first tokens.
+        If no token arrives within the provider's hedge delay (a percentile
+        of its recent time-to-first-token), the next provider is started
+        too and whichever yields a token first wins; the other is
+        cancelled. A provider that fails before its first token fails
+        over to the next one. Once tokens flow the stream is committed.
+        """
+        names = provider_health.rank(list(self.providers))
+        pending: Dict[asyncio.Future, tuple] = {}
+        next_provider = 0
+        hedged = False
+        winner = None
+        last_error: Optional[Exception] = None
+        
+        def start_next():
+            nonlocal next_provider
+            name = names[next_provider]
+            next_provider += 1
+            # Only the winner runs to completion, so only it reports usage
+            iterator = self._provider_stream(name, prompt, priority, usage)
+            pending[asyncio.ensure_future(iterator.__anext__())] = (name, iterator, time.monotonic())
+        
+        try:
+            start_next()
+            while pending and winner is None:
+                can_hedge = settings.LLM_HEDGE_ENABLED and not hedged and next_provider < len(names)
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=provider_health.hedge_delay(names[0]) if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # First token is late; race the next provider
+                    hedged = True
+                    metrics.increment("llm.hedges")
+                    start_next()
+                    continue
+                
+                for task in done:
+                    name, iterator, started = pending.pop(task)
+                    try:
+                        first_token = task.result()
+                    except StopAsyncIteration:
+                        winner = (name, iterator, None)
+                    except (AdmissionRejected, CircuitOpen) as e:
+                        last_error = e
+                    except Exception as e:
+                        logger.warning(f"LLM provider {name} failed before first token: {e}")
+                        provider_health.record_failure(name)
+                        last_error = e
+                    else:
+                        provider_health.record_ttft(name, time.monotonic() - started)
+                        winner = (name, iterator, first_token)
+                    if winner is not None:
+                        if hedged:
+                            metrics.increment(f"llm.hedge_wins.{name}")
+                        break
+                
+                if winner is None and not pending and next_provider < len(names):
+                    metrics.increment("llm.failovers")
+                    start_next()
+        finally:
+            # Cancel the losing (or abandoned) attempts and free their slots
+            for task, (_, iterator, _) in pending.items():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+                await iterator.aclose()
+        
+        if winner is None:
+            raise last_error or RuntimeError("No LLM provider available")
+        
+        name, iterator, first_token = winner
+        try:
+            if first_token is not None:
+                yield first_token
+            async for token in iterator:
+                yield token
+        except Exception:
+            provider_health.record_failure(name)
+            raise
+        else:
+            provider_health.record_success(name)
+        finally:
+            await iterator.aclose()
+
+
+llm_service = LLMService()
@@ -0,0 +1,158 @@
+"""
+LLM provider health tracking and circuit breaking.
+"""
+from typing import Dict, List, Optional
+from collections import deque
+import time
+import numpy as np
+from app.config import settings
+from app.services.metrics import metrics
+
+
+class CircuitOpen(Exception):
+    """Raised when a request may not start on a provider whose circuit is open."""
+    
+    def __init__(self, name: str):
+        super().__init__(f"Circuit open for LLM provider {name}")
+        self.name = name
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+    
+    Closed: requests flow. After LLM_CIRCUIT_FAILURE_THRESHOLD failures in
+    a row it opens and requests skip the provider. After
+    LLM_CIRCUIT_RESET_SECONDS it lets one trial request through
+    (half-open); success closes it, failure opens it again.
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+    
+    def ready(self) -> bool:
+        """Whether allow would let a request through now; claims nothing."""
+        return self.state == self.CLOSED or time.monotonic() - self.opened_at >= settings.LLM_CIRCUIT_RESET_SECONDS
+    
+    def allow(self) -> bool:
+        """Whether a request may go to the provider now; claims the trial if half-open."""
+        if self.state == self.CLOSED:
+            return True
+        # At most one trial request per reset interval
+        now = time.monotonic()
+        if now - self.opened_at >= settings.LLM_CIRCUIT_RESET_SECONDS:
+            self.state = self.HALF_OPEN
+            self.opened_at = now
+            return True
+        return False
+    
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+    
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= settings.LLM_CIRCUIT_FAILURE_THRESHOLD:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class ProviderHealth:
+    """Recent time-to-first-token, error rate and circuit of one provider."""
+    
+    # TTFT samples needed before the percentile is trusted for hedging
+    MIN_SAMPLES = 20
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.ttfts = deque(maxlen=settings.LLM_HEALTH_WINDOW)
+        self.error_rate = 0.0  # Exponential moving average over outcomes
+        self.breaker = CircuitBreaker()
+    
+    def ttft_percentile(self, percentile: float) -> Optional[float]:
+        """A percentile of recent TTFTs, or None with too few samples."""
+        if len(self.ttfts) < self.MIN_SAMPLES:
+            return None
+        return float(np.percentile(np.fromiter(self.ttfts, dtype=float), percentile))
+    
+    def score(self) -> float:
+        """Higher is healthier: penalizes recent errors and slow first tokens."""
+        if self.breaker.state == CircuitBreaker.OPEN:
+            return 0.0
+        median_ttft = self.ttft_percentile(50) or settings.LLM_HEDGE_DEFAULT_DELAY
+        return (1.0 - self.error_rate) / (1.0 + median_ttft)
+
+
+class ProviderHealthRegistry:
+    """Health of every configured LLM provider."""
+    
+    def __init__(self):
+        self.providers: Dict[str, ProviderHealth] = {}
+    
+    def get(self, name: str) -> ProviderHealth:
+        health = self.providers.get(name)
+        if health is None:
+            health = self.providers[name] = ProviderHealth(name)
+        return health
+    
+    def rank(self, names: List[str]) -> List[str]:
+        """
+        Order providers for a request per LLM_ROUTING_POLICY, leaving out
+        those whose circuit is open. If every circuit is open the
+        configured order is returned so requests still get a try.
+        Read-only: a half-open provider's trial is taken by begin, when a
+        request actually starts on it.
+        """
+        available = [name for name in names if self.get(name).breaker.ready()]
+        if not available:
+            return list(names)
+        if settings.LLM_ROUTING_POLICY == "health":
+            available.sort(key=lambda name: self.get(name).score(), reverse=True)
+        return available
+    
+    def begin(self, name: str):
+        """
+        Admit a request that is starting on the provider, taking its trial
+        if half-open. Raises CircuitOpen if the circuit is open, unless
+        every circuit is (see rank).
+        """
+        if self.get(name).breaker.allow():
+            return
+        if any(health.breaker.ready() for health in self.providers.values()):
+            raise CircuitOpen(name)
+    
+    def hedge_delay(self, name: str) -> float:
+        """How long to wait for a first token before hedging."""
+        delay = self.get(name).ttft_percentile(settings.LLM_HEDGE_PERCENTILE)
+        if delay is None:
+            delay = settings.LLM_HEDGE_DEFAULT_DELAY
+        return max(delay, settings.LLM_HEDGE_MIN_DELAY)
+    
+    def record_ttft(self, name: str, seconds: float):
+        self.get(name).ttfts.append(seconds)
+        metrics.observe(f"llm.{name}.ttft_seconds", seconds)
+    
+    def record_success(self, name: str):
+        health = self.get(name)
+        health.error_rate *= 0.9
+        health.breaker.record_success()
+        self._export(health)
+    
+    def record_failure(self, name: str):
+        health = self.get(name)
+        health.error_rate = 0.9 * health.error_rate + 0.1
+        health.breaker.record_failure()
+        metrics.increment(f"llm.{name}.failures")
+        self._export(health)
+    
+    def _export(self, health: ProviderHealth):
+        metrics.set_gauge(f"llm.{health.name}.health_score", health.score())
+        metrics.set_gauge(f"llm.{health.name}.circuit_open", 1 if health.breaker.state == CircuitBreaker.OPEN else 0)
+
+
+provider_health = ProviderHealthRegistry()
@@ -0,0 +1,50 @@
+"""
+In-process metrics registry.
+"""
+from typing import Dict, Any
+import threading
+
+
+class Metrics:
+    """Counters, gauges and summaries exposed at /api/v1/metrics."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, float] = {}
+        self.summaries: Dict[str, Dict[str, float]] = {}
+    
+    def increment(self, name: str, value: float = 1):
+        """Increase a counter."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+    
+    def set_gauge(self, name: str, value: float):
+        """Set a gauge to its current value."""
+        with self._lock:
+            self.gauges[name] = value
+    
+    def observe(self, name: str, value: float):
+        """Record an observation (e.g. a latency) in a summary."""
+        with self._lock:
+            summary = self.summaries.get(name)
+            if summary is None:
+                summary = self.summaries[name] = {"count": 0, "sum": 0.0, "max": 0.0}
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["max"] = max(summary["max"], value)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a copy of all metrics."""
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "summaries": {
+                    name: {**summary, "avg": summary["sum"] / summary["count"] if summary["count"] else 0.0}
+                    for name, summary in self.summaries.items()
+                }
+            }
+
+
+metrics = Metrics()
@@ -0,0 +1,81 @@
+"""
+Prompt construction for answer generation.
+"""
+from typing import List, Dict, Any
+from app.config import settings
+from app.services.context_packer import count_tokens
+
+SYSTEM_PROMPT = """You are a helpful AI assistant with access to a user's personal knowledge base.
+Your task is to answer questions based on the provided context. Be concise, accurate, and cite sources when relevant.
+If the context doesn't contain enough information to answer the question, say so clearly."""
+
+
+class Prompt:
+    """An answer prompt split into a stable prefix and the question.
+    
+    system and context come first and don't depend on the question, so
+    follow-up questions over the same sources repeat them byte for byte
+    and providers can serve them from their prompt cache.
+    """
+    def __init__(self, system: str, context: str, question: str, cache_context: bool):
+        self.system = system
+        self.context = context
+        self.question = question
+        self.cache_context = cache_context
+    
+    def openai_messages(self) -> List[Dict[str, Any]]:
+        """Chat messages; OpenAI caches long shared prefixes automatically."""
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.context},
+            {"role": "user", "content": self.question}
+        ]
+    
+    def anthropic_messages(self) -> List[Dict[str, Any]]:
+        """
+        Messages with an explicit cache breakpoint after the context, so
+        system prompt plus context are cached as one prefix.
+        """
+        context_block = {"type": "text", "text": self.context}
+        if self.cache_context:
+            context_block["cache_control"] = {"type": "ephemeral"}
+        return [{
+            "role": "user",
+            "content": [context_block, {"type": "text", "text": self.question}]
+        }]
+
+
+class PromptBuilder:
+    """Builds answer prompts with a stable, cacheable prefix."""
+    
+    def build(self, query: str, context_chunks: List[Dict[str, Any]]) -> Prompt:
+        """
+        Lay out the prompt as system, context, then question.
+        Context is rendered in source order (source, then position in the
+        source) rather than score order, so the same retrieved chunks give
+        the same prefix whichever question retrieved them.
+        """
+        ordered = sorted(
+            context_chunks,
+            key=lambda c: (
+                c.get("source_name") or "",
+                c.get("source_id") or "",
+                c.get("chunk_index") if c.get("chunk_index") is not None else -1
+            )
+        )
+        context_text = "\n\n".join(
+            f"[Source: {chunk.get('source_name') or 'Unknown'}]\n{chunk.get('text', '')}"
+            for chunk in ordered
+        )
+        context = f"Context from knowledge base:\n{context_text}"
+        question = f"Question: {query}\n\nPlease provide a comprehensive answer based on the context above."
+        
+        # Providers won't cache prefixes below a minimum length
+        cache_context = (
+            settings.PROMPT_CACHE_ENABLED
+            and count_tokens(SYSTEM_PROMPT) + count_tokens(context) >= settings.PROMPT_CACHE_MIN_TOKENS
+        )
+        return Prompt(SYSTEM_PROMPT, context, question, cache_context)
+
+
+prompt_builder = PromptBuilder()
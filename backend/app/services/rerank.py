@@ -0,0 +1,90 @@
+"""
+Diversity re-ranking of fused retrieval results.
+"""
+from typing import List, Dict, Any, Optional
+import numpy as np
+
+
+class MMRReranker:
+    """Maximal marginal relevance re-ranking.
+    
+    Greedily picks the candidate maximizing
+    lambda * relevance - (1 - lambda) * max similarity to already picked
+    candidates, so near-duplicate chunks (e.g. the overlapping windows of
+    sentence chunking) don't crowd out the rest of the top-k.
+    """
+    
+    def rerank(
+        self,
+        candidates: List[Dict[str, Any]],
+        vectors: Dict[str, List[float]],
+        top_k: int,
+        lambda_mult: float,
+        source_ids: Optional[Dict[str, str]] = None,
+        per_source_cap: int = 0
+    ) -> List[Dict[str, Any]]:
+        """
+        Re-rank fused candidates ("chunk_id", "score") by MMR.
+        Candidates without a vector are treated as dissimilar to everything.
+        per_source_cap limits picks per source id (0 disables the cap), so
+        fewer than top_k candidates may be returned.
+        """
+        if not candidates or top_k <= 0:
+            return []
+        
+        n = len(candidates)
+        chunk_ids = [c["chunk_id"] for c in candidates]
+        
+        # Fused scores are on arbitrary scales; min-max them onto [0, 1] so
+        # they trade off against cosine similarity as lambda intends
+        relevance = np.fromiter((c["score"] for c in candidates), dtype=float, count=n)
+        spread = relevance.max() - relevance.min()
+        relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones(n)
+        
+        # All candidate-candidate cosine similarities in one matrix product
+        dims = next((len(v) for v in vectors.values() if v is not None), 0)
+        matrix = np.zeros((n, dims))
+        for i, chunk_id in enumerate(chunk_ids):
+            vector = vectors.get(chunk_id)
+            if vector is not None:
+                matrix[i] = vector
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+        similarity = matrix @ matrix.T
+        
+        # Integer source codes so a capped source is masked in one operation
+        source_ids = source_ids or {}
+        codes: Dict[str, int] = {}
+        sources = np.fromiter(
+            (
+                codes.setdefault(source_ids[chunk_id], len(codes)) if chunk_id in source_ids else -1
+                for chunk_id in chunk_ids
+            ),
+            dtype=np.intp,
+            count=n
+        )
+        source_counts = np.zeros(len(codes), dtype=np.intp)
+        
+        available = np.ones(n, dtype=bool)
+        max_similarity = np.zeros(n)
+        selected = []
+        
+        while len(selected) < top_k and available.any():
+            scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+            scores[~available] = -np.inf
+            pick = int(np.argmax(scores))
+            
+            selected.append(candidates[pick])
+            available[pick] = False
+            np.maximum(max_similarity, similarity[pick], out=max_similarity)
+            
+            source = sources[pick]
+            if per_source_cap and source >= 0:
+                source_counts[source] += 1
+                if source_counts[source] >= per_source_cap:
+                    available[sources == source] = False
+        
+        return selected
+
+
+mmr_reranker = MMRReranker()
@@ -2,21 +2,33 @@
 Hybrid retrieval service combining vector and keyword search.
 """
 from typing import List, Dict, Any, Optional
-from datetime import datetime, timedelta
-from dateutil import parser as date_parser
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_, or_
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy import select, func, and_, or_, literal, literal_column, text, union_all, Float, Integer
+from app.config import settings
+from app.database import AsyncSessionLocal
 from app.models import Chunk, Source
 from app.services.vector_db import vector_db
 from app.services.embeddings import embedding_service
+from app.services.fusion import fusion_engine
+from app.services.rerank import mmr_reranker
+from app.services.cache import query_cache, hydration_cache
+from app.services.context_packer import join_chunks
+from app.services.sessions import ConversationSession
+from app.services.temporal import TimeRange, temporal_parser, effective_timestamp, to_epoch
+from app.services.users import to_user_uuid
+from app.services.deletion import deletion_service
+import asyncio
+import logging
 import re
+import time
 
+logger = logging.getLogger(__name__)
 
-class TimeRange:
-    """Represents a time range for filtering."""
-    def __init__(self, start: Optional[datetime] = None, end: Optional[datetime] = None):
-        self.start = start
-        self.end = end
+
+KEYWORD_MODES = ("substring", "fuzzy", "auto")
+
+# Product codes, ids and file names ("SKU-1042", "acme_corp") or capitalized names
+_IDENTIFIER_TERM = re.compile(r"^(?=\S*[\d_\-./])[\w\-./]+$|^[A-Z][\w'\-]*$")
 
 
 class RetrievalService:
@@ -28,149 +40,651 @@ class RetrievalService:
         user_id: str,
         db: AsyncSession,
         top_k: int = 10,
-        filters: Optional[Dict[str, Any]] = None
+        filters: Optional[Dict[str, Any]] = None,
+        keyword_mode: Optional[str] = None,
+        fusion_strategy: Optional[str] = None,
+        diversify: Optional[bool] = None,
+        mmr_lambda: Optional[float] = None,
+        per_source_cap: Optional[int] = None,
+        timezone: Optional[str] = None,
+        context_neighbors: Optional[int] = None,
+        query_embedding: Optional[List[float]] = None,
+        stats: Optional[Dict[str, Any]] = None
     ) -> List[Dict[str, Any]]:
         """
         Retrieve relevant chunks using hybrid search.
         Returns list of chunks with relevance scores.
+        
+        keyword_mode selects the keyword retriever: "substring" (ILIKE),
+        "fuzzy" (pg_trgm similarity) or "auto" (fuzzy for short
+        identifier-like queries). Defaults to settings.KEYWORD_SEARCH_MODE.
+        fusion_strategy selects how the result lists are fused (see
+        FusionEngine). Defaults to settings.FUSION_STRATEGY.
+        diversify re-ranks the fused candidates by maximal marginal relevance
+        with mmr_lambda and at most per_source_cap chunks per source
+        (defaults from the MMR_* settings).
+        timezone (IANA name) anchors relative time expressions such as
+        "this week"; the parsed range filters both stores.
+        context_neighbors widens each hit with that many chunks either side
+        of it (default CONTEXT_EXPANSION_NEIGHBORS); see _expand_context.
+        query_embedding, if the caller already embedded the query, skips
+        the embedding call.
+        
+        If a stats dict is passed it is filled with per-stage timings and
+        any stages that were skipped after missing their deadline.
         """
-        from uuid import UUID, uuid5
-        # Validate user_id is a valid UUID or convert to deterministic UUID
-        try:
-            user_uuid = UUID(user_id)
-        except (ValueError, TypeError):
-            # If not a valid UUID, generate a deterministic UUID from the string
-            namespace = UUID('6ba7b810-9dad-11d1-80b4-00c04fd430c8')  # DNS namespace
-            user_uuid = uuid5(namespace, user_id)
+        user_uuid = to_user_uuid(user_id)
+        if stats is None:
+            stats = {}
+        options = self._resolve_options(
+            filters, fusion_strategy, diversify, mmr_lambda, per_source_cap, timezone, context_neighbors
+        )
         
         # Parse temporal query if present
-        time_range = await self._parse_temporal_query(query)
-        
-        # Generate query embedding
-        query_embedding = await embedding_service.embed_text(query)
-        
-        # Vector search
-        vector_results = await vector_db.search(
-            query_vector=query_embedding,
-            user_id=str(user_uuid),
-            top_k=top_k * 2,  # Get more for re-ranking
-            filters={"timestamp_range": {
-                "start": time_range.start.isoformat() if time_range.start else None,
-                "end": time_range.end.isoformat() if time_range.end else None
-            }} if time_range else None
-        )
+        time_range = temporal_parser.parse(query, options["timezone"])
+        keyword_mode = self._resolve_keyword_mode(query, keyword_mode)
         
-        # Keyword search (full-text search on PostgreSQL)
-        keyword_results = await self._keyword_search(
-            query=query,
-            user_id=str(user_uuid),
-            db=db,
-            time_range=time_range,
-            top_k=top_k * 2
+        # Repeated queries are served from the result cache until the
+        # user's corpus version changes
+        cache_key = await self._cache_key(str(user_uuid), query, top_k, keyword_mode, options)
+        if cache_key:
+            cached = await query_cache.get(cache_key)
+            stats["cache"] = "miss" if cached is None else "hit"
+            if cached is not None:
+                return cached
+        
+        search_k = max(top_k * 2, self._pool_size(top_k, options))
+        
+        # The vector leg (embed + search) and the keyword leg are independent,
+        # so run them concurrently; a leg that misses its deadline contributes
+        # no results instead of stalling the query.
+        vector_results, keyword_results = await asyncio.gather(
+            self._vector_leg(
+                query, str(user_uuid), time_range, search_k, stats,
+                with_vectors=options["diversify"], query_embedding=query_embedding
+            ),
+            self._run_stage(
+                "keyword",
+                self._keyword_leg(db.bind, query, str(user_uuid), time_range, search_k, keyword_mode),
+                settings.RETRIEVAL_KEYWORD_TIMEOUT,
+                [],
+                stats
+            )
         )
         
         # Combine and re-rank
-        combined_results = self._combine_results(
-            vector_results=vector_results,
-            keyword_results=keyword_results,
-            top_k=top_k
+        fused_results = await self._rank(
+            vector_results, keyword_results, keyword_mode, top_k, options, stats
         )
         
-        # Fetch full chunk data
-        chunk_ids = [r["chunk_id"] for r in combined_results]
-        chunks = await self._fetch_chunks(db, chunk_ids, str(user_uuid))
+        # Fetch full chunk data (returned in fused order)
+        chunk_ids = [r["chunk_id"] for r in fused_results]
+        chunks = await self._hydrate(
+            db, chunk_ids, str(user_uuid), vector_results, keyword_results, stats
+        )
+        chunks = self._with_scores(chunks, fused_results)
+        if options["context_neighbors"]:
+            chunks = (await self._expand_context(db, str(user_uuid), [chunks], options["context_neighbors"], stats))[0]
         
-        # Add source information
-        for chunk in chunks:
-            chunk["relevance_score"] = next(
-                (r["score"] for r in combined_results if str(r["chunk_id"]) == str(chunk["id"])),
-                0.0
-            )
+        # Partial results from a degraded stage aren't worth repeating
+        if cache_key and not stats.get("degraded_stages"):
+            await query_cache.set(cache_key, chunks)
         
         return chunks
     
-    async def _parse_temporal_query(self, query: str) -> Optional[TimeRange]:
-        """Parse temporal expressions from query."""
-        # Simple rule-based parsing (can be enhanced with LLM)
-        query_lower = query.lower()
-        
-        # Patterns
-        patterns = {
-            r"last\s+(monday|tuesday|wednesday|thursday|friday|saturday|sunday)": self._parse_last_weekday,
-            r"last\s+week": lambda: TimeRange(
-                start=datetime.now() - timedelta(days=7),
-                end=datetime.now()
-            ),
-            r"last\s+month": lambda: TimeRange(
-                start=datetime.now() - timedelta(days=30),
-                end=datetime.now()
-            ),
-            r"this\s+month": lambda: TimeRange(
-                start=datetime.now().replace(day=1),
-                end=datetime.now()
+    async def retrieve_batch(
+        self,
+        queries: List[str],
+        user_id: str,
+        db: AsyncSession,
+        top_k: int = 10,
+        filters: Optional[Dict[str, Any]] = None,
+        keyword_mode: Optional[str] = None,
+        fusion_strategy: Optional[str] = None,
+        diversify: Optional[bool] = None,
+        mmr_lambda: Optional[float] = None,
+        per_source_cap: Optional[int] = None,
+        timezone: Optional[str] = None,
+        context_neighbors: Optional[int] = None,
+        stats: Optional[Dict[str, Any]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Retrieve for many queries at once with the same options as retrieve.
+        Queries missing the result cache share one embedding call, one
+        batched vector search, one keyword SQL round trip and one hydration
+        fetch. Returns one chunk list per query, in order.
+        """
+        user_uuid = to_user_uuid(user_id)
+        if stats is None:
+            stats = {}
+        options = self._resolve_options(
+            filters, fusion_strategy, diversify, mmr_lambda, per_source_cap, timezone, context_neighbors
+        )
+        keyword_modes = [self._resolve_keyword_mode(query, keyword_mode) for query in queries]
+        
+        results: List[Optional[List[Dict[str, Any]]]] = [None] * len(queries)
+        cache_keys = [
+            await self._cache_key(str(user_uuid), query, top_k, mode, options)
+            for query, mode in zip(queries, keyword_modes)
+        ]
+        for i, cache_key in enumerate(cache_keys):
+            if cache_key:
+                results[i] = await query_cache.get(cache_key)
+        
+        pending = [i for i, result in enumerate(results) if result is None]
+        stats["cache_hits"] = len(queries) - len(pending)
+        if not pending:
+            return results
+        
+        pending_queries = [queries[i] for i in pending]
+        pending_modes = [keyword_modes[i] for i in pending]
+        time_ranges = [temporal_parser.parse(query, options["timezone"]) for query in pending_queries]
+        search_k = max(top_k * 2, self._pool_size(top_k, options))
+        
+        vector_lists, keyword_lists = await asyncio.gather(
+            self._batch_vector_leg(
+                pending_queries, str(user_uuid), time_ranges, search_k, stats,
+                with_vectors=options["diversify"]
             ),
-            r"this\s+week": lambda: TimeRange(
-                start=datetime.now() - timedelta(days=datetime.now().weekday()),
-                end=datetime.now()
+            self._run_stage(
+                "keyword",
+                self._batch_keyword_leg(db.bind, pending_queries, str(user_uuid), time_ranges, search_k, pending_modes),
+                settings.RETRIEVAL_KEYWORD_TIMEOUT,
+                [[] for _ in pending],
+                stats
+            )
+        )
+        
+        fused_lists = await asyncio.gather(*(
+            self._rank(vector_results, keyword_results, mode, top_k, options, stats)
+            for vector_results, keyword_results, mode in zip(vector_lists, keyword_lists, pending_modes)
+        ))
+        
+        # One hydration pass for the union of every query's hits
+        chunk_ids = list(dict.fromkeys(r["chunk_id"] for fused in fused_lists for r in fused))
+        hydrated = await self._hydrate(
+            db,
+            chunk_ids,
+            str(user_uuid),
+            [r for vector_results in vector_lists for r in vector_results],
+            [r for keyword_results in keyword_lists for r in keyword_results],
+            stats
+        )
+        chunks_by_id = {chunk["id"]: chunk for chunk in hydrated}
+        
+        chunk_lists = [
+            self._with_scores(
+                [chunks_by_id[r["chunk_id"]] for r in fused_results if r["chunk_id"] in chunks_by_id],
+                fused_results
+            )
+            for fused_results in fused_lists
+        ]
+        if options["context_neighbors"]:
+            chunk_lists = await self._expand_context(db, str(user_uuid), chunk_lists, options["context_neighbors"], stats)
+        
+        for i, chunks in zip(pending, chunk_lists):
+            results[i] = chunks
+            if cache_keys[i] and not stats.get("degraded_stages"):
+                await query_cache.set(cache_keys[i], results[i])
+        
+        return results
+    
+    async def retrieve_in_session(
+        self,
+        session: ConversationSession,
+        query: str,
+        user_id: str,
+        db: AsyncSession,
+        top_k: int = 10,
+        query_embedding: Optional[List[float]] = None,
+        stats: Optional[Dict[str, Any]] = None,
+        **options
+    ) -> List[Dict[str, Any]]:
+        """
+        Retrieve for one turn of a conversation session.
+        A follow-up on the session's topic re-ranks the chunks earlier turns
+        retrieved, extended by a small vector search on the question
+        blended with the topic; keyword search, fusion and hydration of
+        known chunks are skipped. The first turn, a topic shift (question
+        less similar than SESSION_TOPIC_SIMILARITY to the topic) and
+        time-scoped questions run full retrieval with the given options.
+        """
+        user_uuid = to_user_uuid(user_id)
+        if stats is None:
+            stats = {}
+        if query_embedding is None:
+            query_embedding = await self._run_stage(
+                "embed",
+                embedding_service.embed_text(query),
+                settings.RETRIEVAL_EMBED_TIMEOUT,
+                None,
+                stats
+            )
+        if query_embedding is None:
+            # Without an embedding the topic can't be judged
+            return await self.retrieve(query, user_id, db, top_k, stats=stats, **options)
+        
+        similarity = session.topic_similarity(query_embedding)
+        time_scoped = temporal_parser.parse(query, options.get("timezone")) is not None
+        if similarity is None or similarity < settings.SESSION_TOPIC_SIMILARITY or time_scoped:
+            chunks = await self.retrieve(
+                query, user_id, db, top_k, query_embedding=query_embedding, stats=stats, **options
+            )
+            session.reset()
+            session.add_candidates(await self._run_stage(
+                "session_vectors",
+                vector_db.get_vectors([chunk["id"] for chunk in chunks]),
+                settings.RETRIEVAL_VECTOR_TIMEOUT,
+                {},
+                stats
+            ))
+            session.record_turn(query_embedding)
+            stats["session"] = {"mode": "fresh", "topic_similarity": similarity, "turn": session.turns}
+            return chunks
+        
+        search_vector = session.search_vector(query_embedding)
+        extension = await self._run_stage(
+            "vector",
+            vector_db.search(
+                query_vector=search_vector.tolist(),
+                user_id=str(user_uuid),
+                top_k=settings.SESSION_EXTEND_K,
+                with_vectors=True
             ),
-            r"in\s+(\d{4})": self._parse_year,
-            r"before\s+(\w+\s+\d{1,2},?\s+\d{4})": self._parse_before_date,
-            r"after\s+(\w+\s+\d{1,2},?\s+\d{4})": self._parse_after_date,
-        }
+            settings.RETRIEVAL_VECTOR_TIMEOUT,
+            [],
+            stats
+        )
+        known = len(session.candidates)
+        session.add_candidates({r["chunk_id"]: r.get("vector") for r in extension})
         
-        for pattern, parser_func in patterns.items():
-            match = re.search(pattern, query_lower)
-            if match:
-                try:
-                    return parser_func(match)
-                except:
-                    continue
+        ranked = session.rank_candidates(search_vector, top_k)
+        chunks = await self._hydrate(
+            db, [r["chunk_id"] for r in ranked], str(user_uuid), extension, [], stats
+        )
+        chunks = self._with_scores(chunks, ranked)
         
-        return None
+        neighbors = options.get("context_neighbors")
+        if neighbors is None:
+            neighbors = settings.CONTEXT_EXPANSION_NEIGHBORS
+        if neighbors:
+            chunks = (await self._expand_context(db, str(user_uuid), [chunks], neighbors, stats))[0]
+        
+        session.record_turn(query_embedding)
+        stats["session"] = {
+            "mode": "followup",
+            "topic_similarity": similarity,
+            "turn": session.turns,
+            "candidates": len(session.candidates),
+            "new_candidates": max(0, len(session.candidates) - known)
+        }
+        return chunks
     
-    def _parse_last_weekday(self, match) -> TimeRange:
-        """Parse 'last Tuesday' etc."""
-        weekday_name = match.group(1)
-        weekdays = {
-            "monday": 0, "tuesday": 1, "wednesday": 2,
-            "thursday": 3, "friday": 4, "saturday": 5, "sunday": 6
+    def _resolve_options(
+        self,
+        filters: Optional[Dict[str, Any]],
+        fusion_strategy: Optional[str],
+        diversify: Optional[bool],
+        mmr_lambda: Optional[float],
+        per_source_cap: Optional[int],
+        timezone: Optional[str] = None,
+        context_neighbors: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Fill in retrieval option defaults from settings."""
+        return {
+            "timezone": timezone or settings.DEFAULT_TIMEZONE,
+            "filters": filters,
+            "fusion_strategy": fusion_strategy or settings.FUSION_STRATEGY,
+            "diversify": settings.MMR_ENABLED if diversify is None else diversify,
+            "mmr_lambda": settings.MMR_LAMBDA if mmr_lambda is None else mmr_lambda,
+            "per_source_cap": settings.MMR_PER_SOURCE_CAP if per_source_cap is None else per_source_cap,
+            "context_neighbors": (
+                settings.CONTEXT_EXPANSION_NEIGHBORS if context_neighbors is None else context_neighbors
+            )
         }
-        target_weekday = weekdays[weekday_name.lower()]
+    
+    def _pool_size(self, top_k: int, options: Dict[str, Any]) -> int:
+        """Diversity re-ranking picks top_k from a larger fused pool."""
+        return top_k * settings.MMR_CANDIDATE_MULTIPLIER if options["diversify"] else top_k
+    
+    async def _cache_key(
+        self,
+        user_id: str,
+        query: str,
+        top_k: int,
+        keyword_mode: str,
+        options: Dict[str, Any]
+    ) -> Optional[str]:
+        """Result cache key, or None when caching is off."""
+        if not settings.QUERY_CACHE_ENABLED:
+            return None
+        return await query_cache.make_key(
+            user_id=user_id,
+            query=query,
+            top_k=top_k,
+            options={**options, "keyword_mode": keyword_mode}
+        )
+    
+    async def _rank(
+        self,
+        vector_results: List[Dict[str, Any]],
+        keyword_results: List[Dict[str, Any]],
+        keyword_mode: str,
+        top_k: int,
+        options: Dict[str, Any],
+        stats: Dict[str, Any]
+    ) -> List[Dict[str, Any]]:
+        """Fuse the result lists and optionally diversify them."""
+        fused_results = fusion_engine.fuse(
+            {
+                "vector": vector_results,
+                "fuzzy" if keyword_mode == "fuzzy" else "keyword": keyword_results
+            },
+            top_k=self._pool_size(top_k, options),
+            strategy=options["fusion_strategy"]
+        )
         
-        today = datetime.now()
-        days_ahead = target_weekday - today.weekday()
-        if days_ahead >= 0:
-            days_ahead -= 7
+        if options["diversify"]:
+            fused_results = await self._diversify(
+                candidates=fused_results,
+                vector_results=vector_results,
+                keyword_results=keyword_results,
+                top_k=top_k,
+                lambda_mult=options["mmr_lambda"],
+                per_source_cap=options["per_source_cap"],
+                stats=stats
+            )
         
-        target_date = today + timedelta(days=days_ahead)
-        start = target_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        end = target_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-        return TimeRange(start=start, end=end)
+        return fused_results
     
-    def _parse_year(self, match) -> TimeRange:
-        """Parse year like 'in 2024'."""
-        year = int(match.group(1))
-        start = datetime(year, 1, 1)
-        end = datetime(year, 12, 31, 23, 59, 59)
-        return TimeRange(start=start, end=end)
+    def _with_scores(
+        self,
+        chunks: List[Dict[str, Any]],
+        fused_results: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """Carry fused scores through by id onto copies, since hydrated
+        chunks are shared with the hydration cache."""
+        scores = {r["chunk_id"]: r["score"] for r in fused_results}
+        return [{**chunk, "relevance_score": scores[chunk["id"]]} for chunk in chunks]
     
-    def _parse_before_date(self, match) -> TimeRange:
-        """Parse 'before March 15, 2024'."""
-        date_str = match.group(1)
+    async def _run_stage(
+        self,
+        name: str,
+        coro,
+        timeout: float,
+        default: Any,
+        stats: Optional[Dict[str, Any]]
+    ) -> Any:
+        """Run a retrieval stage under its deadline, degrading to a default."""
+        started = time.perf_counter()
+        degraded = None
         try:
-            end_date = date_parser.parse(date_str)
-            return TimeRange(end=end_date)
-        except:
+            return await asyncio.wait_for(coro, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Retrieval stage '{name}' missed its {timeout}s deadline")
+            degraded = "timeout"
+        except Exception:
+            logger.exception(f"Retrieval stage '{name}' failed")
+            degraded = "error"
+        finally:
+            if stats is not None:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                stats.setdefault("stage_ms", {})[name] = round(elapsed_ms, 1)
+                if degraded:
+                    stats.setdefault("degraded_stages", {})[name] = degraded
+        return default
+    
+    async def _vector_leg(
+        self,
+        query: str,
+        user_id: str,
+        time_range: Optional[TimeRange],
+        top_k: int,
+        stats: Optional[Dict[str, Any]],
+        with_vectors: bool = False,
+        query_embedding: Optional[List[float]] = None
+    ) -> List[Dict[str, Any]]:
+        """Embed the query (unless already embedded) and run the vector search."""
+        if query_embedding is None:
+            query_embedding = await self._run_stage(
+                "embed",
+                embedding_service.embed_text(query),
+                settings.RETRIEVAL_EMBED_TIMEOUT,
+                None,
+                stats
+            )
+        if query_embedding is None:
+            return []
+        
+        return await self._run_stage(
+            "vector",
+            vector_db.search(
+                query_vector=query_embedding,
+                user_id=user_id,
+                top_k=top_k,  # Get more for re-ranking
+                filters=self._vector_filters(time_range),
+                with_vectors=with_vectors
+            ),
+            settings.RETRIEVAL_VECTOR_TIMEOUT,
+            [],
+            stats
+        )
+    
+    async def _batch_vector_leg(
+        self,
+        queries: List[str],
+        user_id: str,
+        time_ranges: List[Optional[TimeRange]],
+        top_k: int,
+        stats: Dict[str, Any],
+        with_vectors: bool = False
+    ) -> List[List[Dict[str, Any]]]:
+        """Embed all queries in one call and run one batched vector search."""
+        embeddings = await self._run_stage(
+            "embed",
+            embedding_service.embed_batch(queries),
+            settings.RETRIEVAL_EMBED_TIMEOUT,
+            None,
+            stats
+        )
+        if embeddings is None:
+            return [[] for _ in queries]
+        
+        return await self._run_stage(
+            "vector",
+            vector_db.search_batch(
+                searches=[
+                    {"query_vector": embedding, "filters": self._vector_filters(time_range)}
+                    for embedding, time_range in zip(embeddings, time_ranges)
+                ],
+                user_id=user_id,
+                top_k=top_k,
+                with_vectors=with_vectors
+            ),
+            settings.RETRIEVAL_VECTOR_TIMEOUT,
+            [[] for _ in queries],
+            stats
+        )
+    
+    def _vector_filters(self, time_range: Optional[TimeRange]) -> Optional[Dict[str, Any]]:
+        """Vector search filters for a time range, as epoch seconds."""
+        if not time_range:
             return None
+        return {"timestamp_range": {
+            "start": to_epoch(time_range.start) if time_range.start else None,
+            "end": to_epoch(time_range.end) if time_range.end else None
+        }}
     
-    def _parse_after_date(self, match) -> TimeRange:
-        """Parse 'after March 15, 2024'."""
-        date_str = match.group(1)
-        try:
-            start_date = date_parser.parse(date_str)
-            return TimeRange(start=start_date)
-        except:
+    async def _keyword_leg(
+        self,
+        bind: AsyncEngine,
+        query: str,
+        user_id: str,
+        time_range: Optional[TimeRange],
+        top_k: int,
+        keyword_mode: str
+    ) -> List[Dict[str, Any]]:
+        """Run the selected keyword retriever on its own session.
+        
+        A dedicated session keeps the request session usable if this leg is
+        cancelled at its deadline. It uses the request session's engine, so
+        it reads from the replica (or primary) get_read_db routed to.
+        """
+        async with AsyncSessionLocal(bind=bind) as session:
+            return await self._keyword_search(
+                query=query,
+                user_id=user_id,
+                db=session,
+                time_range=time_range,
+                top_k=top_k,
+                keyword_mode=keyword_mode
+            )
+    
+    async def _batch_keyword_leg(
+        self,
+        bind: AsyncEngine,
+        queries: List[str],
+        user_id: str,
+        time_ranges: List[Optional[TimeRange]],
+        top_k: int,
+        keyword_modes: List[str]
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Run every query's keyword search in one UNION ALL round trip, on
+        the request session's engine.
+        """
+        from uuid import UUID
+        results = [[] for _ in queries]
+        
+        selects = []
+        for index, (query, time_range, mode) in enumerate(zip(queries, time_ranges, keyword_modes)):
+            criteria = self._keyword_criteria(query, mode)
+            if criteria is None:
+                continue
+            condition, score, ordered = criteria
+            query_stmt = (
+                select(Chunk.id, Chunk.source_id, score.label("score"), literal_column(str(index), Integer).label("query_index"))
+                .join(Source)
+                .where(Chunk.user_id == UUID(user_id), Source.user_id == UUID(user_id), Source.deleted_at.is_(None), condition)
+            )
+            query_stmt = self._apply_time_filter(query_stmt, time_range)
+            if ordered:
+                query_stmt = query_stmt.order_by(score.desc())
+            selects.append(query_stmt.limit(top_k))
+        
+        if not selects:
+            return results
+        
+        async with AsyncSessionLocal(bind=bind) as session:
+            if "fuzzy" in keyword_modes:
+                await self._set_fuzzy_threshold(session)
+            rows = await session.execute(union_all(*selects))
+        
+        for row in rows:
+            results[row.query_index].append({
+                "chunk_id": str(row.id),
+                "score": float(row.score),
+                "source_id": str(row.source_id)
+            })
+        return results
+    
+    async def _diversify(
+        self,
+        candidates: List[Dict[str, Any]],
+        vector_results: List[Dict[str, Any]],
+        keyword_results: List[Dict[str, Any]],
+        top_k: int,
+        lambda_mult: float,
+        per_source_cap: int,
+        stats: Optional[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """MMR re-rank fused candidates using their stored vectors."""
+        vectors = {r["chunk_id"]: r["vector"] for r in vector_results if r.get("vector") is not None}
+        source_ids = {
+            r["chunk_id"]: (r.get("payload") or {}).get("source_id")
+            for r in vector_results
+        }
+        source_ids.update({r["chunk_id"]: r["source_id"] for r in keyword_results})
+        source_ids = {chunk_id: source for chunk_id, source in source_ids.items() if source}
+        
+        # Keyword-only hits weren't returned by the vector search
+        missing = [c["chunk_id"] for c in candidates if c["chunk_id"] not in vectors]
+        if missing:
+            vectors.update(await self._run_stage(
+                "rerank_vectors",
+                vector_db.get_vectors(missing),
+                settings.RETRIEVAL_RERANK_TIMEOUT,
+                {},
+                stats
+            ))
+        
+        return mmr_reranker.rerank(
+            candidates=candidates,
+            vectors=vectors,
+            top_k=top_k,
+            lambda_mult=lambda_mult,
+            source_ids=source_ids,
+            per_source_cap=per_source_cap
+        )
+    
+    def _resolve_keyword_mode(self, query: str, keyword_mode: Optional[str]) -> str:
+        """Pick the keyword retriever for a query."""
+        mode = keyword_mode or settings.KEYWORD_SEARCH_MODE
+        if mode not in KEYWORD_MODES:
+            raise ValueError(f"Unsupported keyword mode: {mode}")
+        
+        # Trigram operators only exist once pg_trgm is installed
+        if not settings.TRIGRAM_INDEX_ENABLED:
+            return "substring"
+        
+        if mode == "auto":
+            terms = query.split()
+            is_identifier = (
+                0 < len(terms) <= settings.FUZZY_AUTO_MAX_TERMS
+                and all(_IDENTIFIER_TERM.match(term) for term in terms)
+            )
+            return "fuzzy" if is_identifier else "substring"
+        
+        return mode
+    
+    def _apply_time_filter(self, query_stmt, time_range: Optional[TimeRange]):
+        """Restrict a Chunk/Source select to sources whose effective timestamp is in range."""
+        if time_range:
+            if time_range.start:
+                query_stmt = query_stmt.where(effective_timestamp() >= time_range.start)
+            if time_range.end:
+                query_stmt = query_stmt.where(effective_timestamp() <= time_range.end)
+        return query_stmt
+    
+    def _keyword_criteria(self, query: str, keyword_mode: str):
+        """
+        Where clause, score expression and whether to order by score for a
+        keyword retriever, or None if the query has no terms.
+        """
+        if keyword_mode == "fuzzy":
+            # word_similarity compares the query with the best-matching extent
+            # of the chunk, so a short code or name isn't diluted by a long
+            # chunk. The <% operator applies the threshold and is served by
+            # the GIN index.
+            similarity = func.word_similarity(query, Chunk.text)
+            return literal(query).op("<%")(Chunk.text), similarity, True
+        
+        query_terms = query.split()
+        if not query_terms:
             return None
+        # ILIKE '%term%' is served by idx_chunks_text_trgm when TRIGRAM_INDEX_ENABLED
+        text_search_conditions = [
+            Chunk.text.ilike(f'%{term}%')
+            for term in query_terms
+        ]
+        return or_(*text_search_conditions), literal_column("0.5", Float), False  # Base score for keyword matches
+    
+    async def _set_fuzzy_threshold(self, db: AsyncSession):
+        """Apply FUZZY_SIMILARITY_THRESHOLD to the <% operator for this transaction."""
+        await db.execute(
+            text("SELECT set_config('pg_trgm.word_similarity_threshold', :threshold, true)"),
+            {"threshold": str(settings.FUZZY_SIMILARITY_THRESHOLD)}
+        )
     
     async def _keyword_search(
         self,
@@ -178,9 +692,10 @@ class RetrievalService:
         user_id: str,
         db: AsyncSession,
         time_range: Optional[TimeRange],
-        top_k: int
+        top_k: int,
+        keyword_mode: str = "substring"
     ) -> List[Dict[str, Any]]:
-        """Full-text keyword search on PostgreSQL."""
+        """Keyword search on PostgreSQL: ILIKE substring or pg_trgm fuzzy."""
         from uuid import UUID
         # Convert user_id to UUID if it's a string
         try:
@@ -189,94 +704,105 @@ class RetrievalService:
             # Invalid UUID format - return empty results
             return []
         
-        # Build query
-        query_stmt = select(Chunk).join(Source).where(Source.user_id == user_uuid)
-        
-        # Add temporal filter
-        if time_range:
-            conditions = []
-            if time_range.start:
-                conditions.append(Source.ingestion_timestamp >= time_range.start)
-                conditions.append(Source.source_timestamp >= time_range.start)
-            if time_range.end:
-                conditions.append(Source.ingestion_timestamp <= time_range.end)
-                conditions.append(Source.source_timestamp <= time_range.end)
-            if conditions:
-                query_stmt = query_stmt.where(or_(*conditions))
+        criteria = self._keyword_criteria(query, keyword_mode)
+        if criteria is None:
+            return []
+        condition, score, ordered = criteria
+        if keyword_mode == "fuzzy":
+            await self._set_fuzzy_threshold(db)
         
-        # Add full-text search using text column directly
-        # Use PostgreSQL's to_tsvector on the fly since search_vector might not be populated
-        query_terms = query.split()
-        if query_terms:
-            # Simple text search using ILIKE for now (can be improved with proper tsvector)
-            text_search_conditions = [
-                Chunk.text.ilike(f'%{term}%')
-                for term in query_terms
-            ]
-            if text_search_conditions:
-                query_stmt = query_stmt.where(or_(*text_search_conditions))
+        # Build query (selecting Source too so hits arrive hydrated)
+        query_stmt = (
+            select(Chunk, Source, score.label("score"))
+            .join(Source)
+            # Chunk.user_id confines the scan to the user's chunk partition
+            .where(Chunk.user_id == user_uuid, Source.user_id == user_uuid, Source.deleted_at.is_(None), condition)
+        )
         
+        # Add temporal filter
+        query_stmt = self._apply_time_filter(query_stmt, time_range)
+        if ordered:
+            query_stmt = query_stmt.order_by(score.desc())
         query_stmt = query_stmt.limit(top_k)
         
         result = await db.execute(query_stmt)
-        chunks = result.scalars().all()
         
         return [
             {
                 "chunk_id": str(chunk.id),
-                "score": 0.5,  # Base score for keyword matches
+                "score": float(chunk_score),
                 "text": chunk.text,
-                "source_id": str(chunk.source_id)
+                "source_id": str(chunk.source_id),
+                "chunk": self._chunk_dict(chunk, source)
             }
-            for chunk in chunks
+            for chunk, source, chunk_score in result.all()
         ]
     
-    def _combine_results(
+    async def _hydrate(
         self,
+        db: AsyncSession,
+        chunk_ids: List[str],
+        user_id: str,
         vector_results: List[Dict[str, Any]],
         keyword_results: List[Dict[str, Any]],
-        top_k: int
+        stats: Dict[str, Any]
     ) -> List[Dict[str, Any]]:
-        """Combine and re-rank results from vector and keyword search."""
-        # Normalize scores
-        vector_max = max((r["score"] for r in vector_results), default=1.0)
-        keyword_max = max((r["score"] for r in keyword_results), default=1.0)
-        
-        # Combine results by chunk_id
-        combined = {}
+        """
+        Resolve chunk ids to full chunks, cheapest source first: the
+        hydration cache, full vector payloads, rows already loaded by the
+        keyword search, and only then a PostgreSQL fetch.
+        """
+        hydrated = hydration_cache.get_many(chunk_ids, user_id)
+        counts = {"cache": len(hydrated), "payload": 0, "keyword": 0, "db": 0}
+        # Hydrated without a query that filters out deleted sources
+        unverified = set(hydrated)
         
-        # Add vector results (weight: 0.7)
+        fresh = {}
         for result in vector_results:
-            chunk_id = result["chunk_id"]
-            normalized_score = result["score"] / vector_max if vector_max > 0 else 0
-            combined[chunk_id] = {
-                "chunk_id": chunk_id,
-                "score": normalized_score * 0.7,
-                "vector_score": normalized_score
-            }
-        
-        # Add keyword results (weight: 0.2)
+            payload = result.get("payload") or {}
+            # Payloads written before source metadata was included go to the DB
+            if "text" in payload and "source_metadata" in payload and result["chunk_id"] not in hydrated:
+                fresh[result["chunk_id"]] = self._payload_chunk(result["chunk_id"], payload)
+                unverified.add(result["chunk_id"])
+                counts["payload"] += 1
         for result in keyword_results:
-            chunk_id = result["chunk_id"]
-            normalized_score = result["score"] / keyword_max if keyword_max > 0 else 0
-            if chunk_id in combined:
-                combined[chunk_id]["score"] += normalized_score * 0.2
-                combined[chunk_id]["keyword_score"] = normalized_score
-            else:
-                combined[chunk_id] = {
-                    "chunk_id": chunk_id,
-                    "score": normalized_score * 0.2,
-                    "keyword_score": normalized_score
-                }
+            if result["chunk_id"] not in hydrated and result["chunk_id"] not in fresh:
+                if "chunk" in result:
+                    fresh[result["chunk_id"]] = result["chunk"]
+                    counts["keyword"] += 1
         
-        # Sort by combined score
-        sorted_results = sorted(
-            combined.values(),
-            key=lambda x: x["score"],
-            reverse=True
-        )
+        missing = [
+            chunk_id for chunk_id in chunk_ids
+            if chunk_id not in hydrated and chunk_id not in fresh
+        ]
+        if missing:
+            fetched = await self._run_stage(
+                "fetch",
+                self._fetch_chunks(db, missing, user_id),
+                settings.RETRIEVAL_FETCH_TIMEOUT,
+                None,
+                stats
+            )
+            if fetched is None:
+                # The cancelled fetch may have left the session mid-statement
+                await db.rollback()
+                fetched = []
+            for chunk in fetched:
+                fresh[chunk["id"]] = chunk
+            counts["db"] = len(fetched)
+        
+        for chunk in fresh.values():
+            hydration_cache.put(chunk, user_id)
+        hydrated.update(fresh)
         
-        return sorted_results[:top_k]
+        stats["hydration"] = counts
+        deleted = await deletion_service.deleted_among(
+            db, {hydrated[chunk_id]["source"]["id"] for chunk_id in unverified if chunk_id in chunk_ids}
+        )
+        return [
+            hydrated[chunk_id] for chunk_id in chunk_ids
+            if chunk_id in hydrated and hydrated[chunk_id]["source"]["id"] not in deleted
+        ]
     
     async def _fetch_chunks(
         self,
@@ -295,30 +821,192 @@ class RetrievalService:
         uuids = [UUID(id) for id in chunk_ids]
         query = select(Chunk, Source).join(Source).where(
             Chunk.id.in_(uuids),
-            Source.user_id == user_uuid
+            Chunk.user_id == user_uuid,
+            Source.user_id == user_uuid,
+            Source.deleted_at.is_(None)
         )
         
         result = await db.execute(query)
         rows = result.all()
         
-        chunks = []
-        for chunk, source in rows:
-            chunks.append({
-                "id": str(chunk.id),
-                "text": chunk.text,
-                "chunk_index": chunk.chunk_index,
-                "metadata": chunk.metadata or {},
-                "source": {
-                    "id": str(source.id),
-                    "name": source.source_name,
-                    "type": source.source_type,
-                    "url": source.source_url,
-                    "metadata": source.metadata or {}
+        return [self._chunk_dict(chunk, source) for chunk, source in rows]
+    
+    async def _expand_context(
+        self,
+        db: AsyncSession,
+        user_id: str,
+        chunk_lists: List[List[Dict[str, Any]]],
+        neighbors: int,
+        stats: Dict[str, Any]
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Widen hits with their neighboring chunks, one fetch for all lists.
+        If the fetch misses its deadline the hits are returned unexpanded.
+        """
+        windows: Dict[str, List[tuple]] = {}
+        for chunks in chunk_lists:
+            for chunk in chunks:
+                if chunk.get("chunk_index") is not None:
+                    index = chunk["chunk_index"]
+                    windows.setdefault(chunk["source"]["id"], []).append((index - neighbors, index + neighbors))
+        if not windows:
+            return chunk_lists
+        
+        rows = await self._run_stage(
+            "expand",
+            self._fetch_windows(db, user_id, windows),
+            settings.RETRIEVAL_EXPAND_TIMEOUT,
+            None,
+            stats
+        )
+        if rows is None:
+            await db.rollback()
+            return chunk_lists
+        
+        return [self._merge_windows(chunks, rows, neighbors) for chunks in chunk_lists]
+    
+    async def _fetch_windows(
+        self,
+        db: AsyncSession,
+        user_id: str,
+        windows: Dict[str, List[tuple]]
+    ) -> Dict[str, Dict[int, Dict[str, Any]]]:
+        """Fetch chunk index ranges per source, served by idx_source_chunk in the user's partition."""
+        from uuid import UUID
+        
+        conditions = []
+        for source_id, ranges in windows.items():
+            # Collapse overlapping ranges so each row is read once
+            merged = []
+            for start, end in sorted(ranges):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            conditions.extend(
+                and_(Chunk.source_id == UUID(source_id), Chunk.chunk_index.between(start, end))
+                for start, end in merged
+            )
+        
+        query = select(
+            Chunk.id, Chunk.source_id, Chunk.chunk_index, Chunk.text, Chunk.token_count
+        ).where(Chunk.user_id == UUID(user_id), or_(*conditions))
+        result = await db.execute(query)
+        
+        rows: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        for chunk_id, source_id, chunk_index, chunk_text, token_count in result.all():
+            rows.setdefault(str(source_id), {})[chunk_index] = {
+                "id": str(chunk_id),
+                "text": chunk_text,
+                "tokens": token_count if token_count is not None else len(chunk_text) // 4
+            }
+        return rows
+    
+    def _merge_windows(
+        self,
+        chunks: List[Dict[str, Any]],
+        rows: Dict[str, Dict[int, Dict[str, Any]]],
+        neighbors: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Grow hits into contiguous windows and merge windows that touch.
+        Hits are always kept. Neighbors are added nearest first, best hit
+        first, while CONTEXT_EXPANSION_TOKEN_BUDGET allows, so a trimmed
+        window never has gaps. A merged window takes the place (and score)
+        of its best hit; hits it absorbs are dropped from the list.
+        """
+        budget = settings.CONTEXT_EXPANSION_TOKEN_BUDGET
+        selected: Dict[str, set] = {}
+        used = 0
+        
+        hits = [
+            (chunk["source"]["id"], chunk["chunk_index"]) for chunk in chunks
+            if chunk.get("chunk_index") is not None and chunk["chunk_index"] in rows.get(chunk["source"]["id"], {})
+        ]
+        for source_id, index in hits:
+            if index not in selected.setdefault(source_id, set()):
+                selected[source_id].add(index)
+                used += rows[source_id][index]["tokens"]
+        
+        for distance in range(1, neighbors + 1):
+            for source_id, index in hits:
+                for neighbor, inner in ((index - distance, index - distance + 1), (index + distance, index + distance - 1)):
+                    row = rows[source_id].get(neighbor)
+                    if (
+                        row is not None
+                        and neighbor not in selected[source_id]
+                        and inner in selected[source_id]
+                        and used + row["tokens"] <= budget
+                    ):
+                        selected[source_id].add(neighbor)
+                        used += row["tokens"]
+        
+        expanded = []
+        covered = set()
+        for chunk in chunks:
+            source_id, index = chunk["source"]["id"], chunk.get("chunk_index")
+            if (source_id, index) in covered:
+                continue
+            if index is None or index not in selected.get(source_id, ()):
+                expanded.append(chunk)
+                continue
+            
+            start = end = index
+            while start - 1 in selected[source_id]:
+                start -= 1
+            while end + 1 in selected[source_id]:
+                end += 1
+            covered.update((source_id, i) for i in range(start, end + 1))
+            
+            window = [rows[source_id][i] for i in range(start, end + 1)]
+            expanded.append({
+                **chunk,
+                "text": join_chunks([row["text"] for row in window]),
+                "window": {
+                    "start_index": start,
+                    "end_index": end,
+                    "chunk_ids": [row["id"] for row in window]
                 }
             })
         
-        return chunks
+        return expanded
+    
+    def _chunk_dict(self, chunk: Chunk, source: Source) -> Dict[str, Any]:
+        """Hydrated chunk from database rows."""
+        return {
+            "id": str(chunk.id),
+            "text": chunk.text,
+            "chunk_index": chunk.chunk_index,
+            "metadata": chunk.meta or {},
+            "source": {
+                "id": str(source.id),
+                "name": source.source_name,
+                "type": source.source_type,
+                "url": source.source_url,
+                "metadata": source.meta or {}
+            }
+        }
+    
+    def _payload_chunk(self, chunk_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Hydrated chunk from a full (QDRANT_FULL_PAYLOAD) vector payload."""
+        return {
+            "id": chunk_id,
+            "text": payload["text"],
+            "chunk_index": payload.get("chunk_index"),
+            "metadata": payload.get("chunk_metadata") or {},
+            "source": {
+                "id": payload["source_id"],
+                "name": payload.get("source_name"),
+                "type": payload.get("source_type"),
+                "url": payload.get("source_url"),
+                "metadata": payload["source_metadata"] or {}
+            }
+        }
+
 
+fusion_engine.register_retriever("vector", settings.FUSION_VECTOR_WEIGHT)
+fusion_engine.register_retriever("keyword", settings.FUSION_KEYWORD_WEIGHT)
+fusion_engine.register_retriever("fuzzy", settings.FUSION_FUZZY_WEIGHT)
 
 retrieval_service = RetrievalService()
 
@@ -0,0 +1,182 @@
+"""
+Conversation sessions for follow-up questions.
+"""
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict, deque
+import logging
+import uuid
+import numpy as np
+import orjson
+from app.config import settings
+from app.services.cache import LRUCache, get_redis
+from app.services.vector_db import vector_db
+
+logger = logging.getLogger(__name__)
+
+
+def _unit(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class ConversationSession:
+    """Retrieval state carried between the turns of one conversation.
+    
+    Holds the embeddings of the last few questions, whose mean is the
+    conversation's topic, and the chunks earlier turns retrieved with
+    their vectors, which follow-up questions re-rank instead of running
+    full retrieval.
+    """
+    
+    def __init__(self, session_id: str, user_id: str):
+        self.id = session_id
+        self.user_id = user_id
+        self.turns = 0
+        self.turn_embeddings = deque(maxlen=settings.SESSION_TOPIC_TURNS)
+        self.candidates: "OrderedDict[str, np.ndarray]" = OrderedDict()  # chunk id -> unit vector
+        self.is_new = True  # False once loaded for a later turn
+    
+    def topic(self) -> Optional[np.ndarray]:
+        """Unit mean of recent question embeddings."""
+        if not self.turn_embeddings:
+            return None
+        return _unit(np.mean(np.stack(self.turn_embeddings), axis=0))
+    
+    def topic_similarity(self, embedding: List[float]) -> Optional[float]:
+        """Cosine similarity of a question to the topic, None before any turn."""
+        topic = self.topic()
+        if topic is None or not self.candidates:
+            return None
+        return float(topic @ _unit(embedding))
+    
+    def search_vector(self, embedding: List[float]) -> np.ndarray:
+        """
+        The question blended with the topic, so terse follow-ups ("and
+        what about pricing?") search within the conversation's subject.
+        """
+        weight = settings.SESSION_QUERY_WEIGHT
+        topic = self.topic()
+        if topic is None:
+            return _unit(embedding)
+        return _unit(weight * _unit(embedding) + (1 - weight) * topic)
+    
+    def reset(self):
+        """Forget the previous topic and its candidates."""
+        self.turn_embeddings.clear()
+        self.candidates.clear()
+    
+    def add_candidates(self, vectors: Dict[str, List[float]]):
+        """Add retrieved chunks, dropping the least recently used beyond the cap."""
+        for chunk_id, vector in vectors.items():
+            if vector is None:
+                continue
+            self.candidates[chunk_id] = _unit(vector)
+            self.candidates.move_to_end(chunk_id)
+        while len(self.candidates) > settings.SESSION_MAX_CANDIDATES:
+            self.candidates.popitem(last=False)
+    
+    def rank_candidates(self, vector: np.ndarray, top_k: int) -> List[Dict[str, float]]:
+        """Top candidates by cosine similarity, as fused results."""
+        if not self.candidates:
+            return []
+        chunk_ids = list(self.candidates)
+        scores = np.stack(list(self.candidates.values())) @ vector
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        ranked = [{"chunk_id": chunk_ids[i], "score": float(scores[i])} for i in order]
+        # Chunks used again stay in the session longest
+        for result in ranked:
+            self.candidates.move_to_end(result["chunk_id"])
+        return ranked
+    
+    def record_turn(self, embedding: List[float]):
+        self.turn_embeddings.append(_unit(embedding))
+        self.turns += 1
+    
+    def dump(self) -> bytes:
+        """
+        Shared state: candidate vectors are left out, since they can be
+        fetched again from the vector store by id.
+        """
+        return orjson.dumps({
+            "user_id": self.user_id,
+            "turns": self.turns,
+            "turn_embeddings": [embedding.tolist() for embedding in self.turn_embeddings],
+            "candidates": list(self.candidates)
+        })
+    
+    @classmethod
+    async def load(cls, session_id: str, state: Dict[str, Any]) -> "ConversationSession":
+        """Rebuild a dumped session, fetching its candidate vectors."""
+        session = cls(session_id, state["user_id"])
+        session.turns = state["turns"]
+        session.turn_embeddings.extend(np.asarray(e, dtype=np.float32) for e in state["turn_embeddings"])
+        vectors = await vector_db.get_vectors(state["candidates"])
+        # In stored (least to most recently used) order
+        session.add_candidates({chunk_id: vectors.get(chunk_id) for chunk_id in state["candidates"]})
+        return session
+
+
+class SessionStore:
+    """Bounded in-process store of conversation sessions with a TTL.
+    
+    With SESSION_REDIS_ENABLED sessions are also kept in Redis, so a
+    follow-up routed to another worker continues the conversation; the
+    local copy is used while it is as recent as the shared one. Without
+    it, follow-ups need sticky routing to the worker that served the
+    conversation, and otherwise start a new session (reported in the
+    query metadata).
+    """
+    
+    KEY_PREFIX = "twinmind:session:"
+    
+    def __init__(self):
+        self.sessions = LRUCache(settings.SESSION_MAX_SESSIONS, settings.SESSION_TTL_SECONDS)
+    
+    async def get_or_create(self, session_id: Optional[str], user_id: str) -> ConversationSession:
+        """
+        The user's session with this id, or a new one. Clients may pick
+        their own ids; an id held by another user gets a fresh one.
+        """
+        session = await self._get(session_id) if session_id else None
+        if session is not None and session.user_id != user_id:
+            session, session_id = None, None
+        if session is None:
+            session = ConversationSession(session_id or str(uuid.uuid4()), user_id)
+        else:
+            session.is_new = False
+        # Re-setting refreshes the TTL
+        self.sessions.set(session.id, session)
+        return session
+    
+    async def save(self, session: ConversationSession):
+        """Share a session's state after a turn."""
+        if not settings.SESSION_REDIS_ENABLED:
+            return
+        try:
+            await get_redis().set(self.KEY_PREFIX + session.id, session.dump(), ex=settings.SESSION_TTL_SECONDS)
+        except Exception as e:
+            logger.warning(f"Could not save session to Redis: {e}")
+    
+    async def _get(self, session_id: str) -> Optional[ConversationSession]:
+        local = self.sessions.get(session_id)
+        if not settings.SESSION_REDIS_ENABLED:
+            return local
+        try:
+            stored = await get_redis().get(self.KEY_PREFIX + session_id)
+        except Exception as e:
+            logger.warning(f"Could not read session from Redis: {e}")
+            return local
+        if stored is None:
+            return local
+        state = orjson.loads(stored)
+        if local is not None and local.turns >= state["turns"]:
+            return local
+        try:
+            return await ConversationSession.load(session_id, state)
+        except Exception as e:
+            logger.warning(f"Could not load session {session_id}: {e}")
+            return local
+
+
+session_store = SessionStore()
@@ -2,20 +2,41 @@
 Object storage service for files.
 """
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.client import Config
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import BinaryIO, Optional
 from app.config import settings
+import asyncio
+import hashlib
 import os
+import shutil
+import uuid
 from pathlib import Path
 
 
 class StorageService:
-    """Service for object storage (S3/MinIO)."""
+    """Service for object storage (S3/MinIO).
+    
+    boto3 and file I/O block, so every call runs on a bounded thread pool
+    (STORAGE_MAX_WORKERS) and the event loop keeps serving requests.
+    """
     
     def __init__(self):
         """Initialize storage client."""
         self.storage_type = settings.STORAGE_TYPE
         self.bucket_name = settings.S3_BUCKET_NAME
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.STORAGE_MAX_WORKERS,
+            thread_name_prefix="storage"
+        )
+        # Large uploads are streamed from the file object part by part
+        self.transfer_config = TransferConfig(
+            multipart_threshold=settings.STORAGE_MULTIPART_THRESHOLD,
+            multipart_chunksize=settings.STORAGE_PART_SIZE,
+            max_concurrency=settings.STORAGE_UPLOAD_CONCURRENCY
+        )
         
         if self.storage_type == "s3":
             self.s3_client = boto3.client(
@@ -45,32 +66,64 @@ class StorageService:
             logger.warning(f"Could not access bucket {self.bucket_name}: {e}. Will attempt on first use.")
             # Don't fail - will handle errors when actually using storage
     
+    async def _run(self, func, *args, **kwargs):
+        """Run a blocking call on the storage thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+    
     async def save_file(
         self,
         file_data: BinaryIO,
         key: str,
         content_type: Optional[str] = None
     ) -> str:
-        """Save file to storage and return the key."""
+        """
+        Save file to storage and return the key. The file object is read
+        in parts, so uploads don't need to be held in memory as one buffer.
+        """
         if self.storage_type == "s3":
-            self.s3_client.upload_fileobj(
+            await self._run(
+                self.s3_client.upload_fileobj,
                 file_data,
                 self.bucket_name,
                 key,
-                ExtraArgs={"ContentType": content_type} if content_type else {}
+                ExtraArgs={"ContentType": content_type} if content_type else {},
+                Config=self.transfer_config
             )
             return key
         else:  # local
-            file_path = self.local_storage_path / key
-            file_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(file_path, "wb") as f:
-                f.write(file_data.read())
+            await self._run(self._write_local, file_data, self.local_storage_path / key)
             return key
     
+    def _write_local(self, file_data: BinaryIO, file_path: Path):
+        """Copy in chunks to a temporary file, then move it into place."""
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = file_path.with_name(f".{file_path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(temp_path, "wb") as f:
+                shutil.copyfileobj(file_data, f, settings.STORAGE_LOCAL_CHUNK_SIZE)
+            os.replace(temp_path, file_path)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+    
+    async def sha256(self, file_data: BinaryIO) -> str:
+        """Hex SHA-256 of a file object's contents, read in chunks; rewinds it."""
+        return await self._run(self._sha256, file_data)
+    
+    def _sha256(self, file_data: BinaryIO) -> str:
+        digest = hashlib.sha256()
+        for chunk in iter(partial(file_data.read, settings.STORAGE_LOCAL_CHUNK_SIZE), b""):
+            digest.update(chunk)
+        file_data.seek(0)
+        return digest.hexdigest()
+    
     async def get_file_url(self, key: str, expires_in: int = 3600) -> str:
         """Get a signed URL for accessing a file."""
         if self.storage_type == "s3":
-            return self.s3_client.generate_presigned_url(
+            # Signing may first have to fetch credentials
+            return await self._run(
+                self.s3_client.generate_presigned_url,
                 'get_object',
                 Params={'Bucket': self.bucket_name, 'Key': key},
                 ExpiresIn=expires_in
@@ -81,11 +134,10 @@ class StorageService:
     async def delete_file(self, key: str):
         """Delete a file from storage."""
         if self.storage_type == "s3":
-            self.s3_client.delete_object(Bucket=self.bucket_name, Key=key)
+            await self._run(self.s3_client.delete_object, Bucket=self.bucket_name, Key=key)
         else:
             file_path = self.local_storage_path / key
-            if file_path.exists():
-                file_path.unlink()
+            await self._run(file_path.unlink, missing_ok=True)
 
 
 storage_service = StorageService()
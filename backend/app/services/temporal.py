@@ -0,0 +1,141 @@
+"""
+Temporal expression parsing for time-scoped queries.
+"""
+from typing import Optional, Callable, List, Tuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo
+from dateutil import parser as date_parser
+from sqlalchemy import func
+from app.config import settings
+from app.models import Source
+import re
+
+
+class TimeRange:
+    """Represents a time range for filtering.
+    
+    Bounds are timezone-aware and inclusive; either may be None.
+    """
+    def __init__(self, start: Optional[datetime] = None, end: Optional[datetime] = None):
+        self.start = start
+        self.end = end
+
+
+def effective_timestamp():
+    """A source's own timestamp if known, else when it was ingested.
+    
+    Matches idx_user_effective_timestamp, so range filters on it are served
+    by that index.
+    """
+    return func.coalesce(Source.source_timestamp, Source.ingestion_timestamp)
+
+
+def to_epoch(value: datetime) -> float:
+    """Epoch seconds for a datetime, treating naive values as UTC."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt_timezone.utc)
+    return value.timestamp()
+
+
+_WEEKDAYS = {
+    "monday": 0, "tuesday": 1, "wednesday": 2,
+    "thursday": 3, "friday": 4, "saturday": 5, "sunday": 6
+}
+
+
+def _start_of_day(value: datetime) -> datetime:
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _end_of_day(value: datetime) -> datetime:
+    return value.replace(hour=23, minute=59, second=59, microsecond=999999)
+
+
+def _last_weekday(match: re.Match, now: datetime) -> TimeRange:
+    """'last Tuesday' is the most recent Tuesday before today."""
+    days_ahead = _WEEKDAYS[match.group(1)] - now.weekday()
+    if days_ahead >= 0:
+        days_ahead -= 7
+    target_date = now + timedelta(days=days_ahead)
+    return TimeRange(start=_start_of_day(target_date), end=_end_of_day(target_date))
+
+
+def _last_week(match: re.Match, now: datetime) -> TimeRange:
+    return TimeRange(start=now - timedelta(days=7), end=now)
+
+
+def _last_month(match: re.Match, now: datetime) -> TimeRange:
+    return TimeRange(start=now - timedelta(days=30), end=now)
+
+
+def _this_month(match: re.Match, now: datetime) -> TimeRange:
+    return TimeRange(start=_start_of_day(now.replace(day=1)), end=now)
+
+
+def _this_week(match: re.Match, now: datetime) -> TimeRange:
+    return TimeRange(start=_start_of_day(now - timedelta(days=now.weekday())), end=now)
+
+
+def _year(match: re.Match, now: datetime) -> TimeRange:
+    """'in 2024' covers the whole calendar year in the user's timezone."""
+    year = int(match.group(1))
+    start = datetime(year, 1, 1, tzinfo=now.tzinfo)
+    return TimeRange(start=start, end=_end_of_day(start.replace(month=12, day=31)))
+
+
+def _before_date(match: re.Match, now: datetime) -> TimeRange:
+    """'before March 15, 2024' ends just before that day starts."""
+    day = date_parser.parse(match.group(1)).replace(tzinfo=now.tzinfo)
+    return TimeRange(end=_start_of_day(day) - timedelta(microseconds=1))
+
+
+def _after_date(match: re.Match, now: datetime) -> TimeRange:
+    """'after March 15, 2024' starts once that day is over."""
+    day = date_parser.parse(match.group(1)).replace(tzinfo=now.tzinfo)
+    return TimeRange(start=_start_of_day(day) + timedelta(days=1))
+
+
+# Compiled once at import; tried in order, first successful parse wins
+_PATTERNS: List[Tuple[re.Pattern, Callable[[re.Match, datetime], TimeRange]]] = [
+    (re.compile(r"last\s+(monday|tuesday|wednesday|thursday|friday|saturday|sunday)"), _last_weekday),
+    (re.compile(r"last\s+week"), _last_week),
+    (re.compile(r"last\s+month"), _last_month),
+    (re.compile(r"this\s+month"), _this_month),
+    (re.compile(r"this\s+week"), _this_week),
+    (re.compile(r"in\s+(\d{4})"), _year),
+    (re.compile(r"before\s+(\w+\s+\d{1,2},?\s+\d{4})"), _before_date),
+    (re.compile(r"after\s+(\w+\s+\d{1,2},?\s+\d{4})"), _after_date),
+]
+
+
+class TemporalParser:
+    """Rule-based parser for time expressions in queries."""
+    
+    def parse(
+        self,
+        query: str,
+        timezone: Optional[str] = None,
+        now: Optional[datetime] = None
+    ) -> Optional[TimeRange]:
+        """
+        Parse the first temporal expression in a query.
+        Calendar boundaries ("this week", "in 2024") are taken in the given
+        IANA timezone (default settings.DEFAULT_TIMEZONE); the returned
+        bounds are timezone-aware.
+        """
+        tz = ZoneInfo(timezone or settings.DEFAULT_TIMEZONE)
+        now = now.astimezone(tz) if now else datetime.now(tz)
+        query_lower = query.lower()
+        
+        for pattern, handler in _PATTERNS:
+            match = pattern.search(query_lower)
+            if match:
+                try:
+                    return handler(match, now)
+                except (ValueError, OverflowError):
+                    continue
+        
+        return None
+
+
+temporal_parser = TemporalParser()
@@ -0,0 +1,61 @@
+"""
+User identity and registration.
+"""
+from functools import lru_cache
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+import uuid
+from app.config import settings
+from app.models import User
+from app.services.cache import LRUCache
+
+# Namespace for user ids that aren't UUIDs
+USER_NAMESPACE = uuid.UUID('6ba7b810-9dad-11d1-80b4-00c04fd430c8')  # DNS namespace
+
+
+@lru_cache(maxsize=settings.USER_CACHE_MAX_ENTRIES)
+def to_user_uuid(user_id: str) -> uuid.UUID:
+    """The user's UUID: user_id itself if it is one, else a deterministic uuid5 of it."""
+    try:
+        return uuid.UUID(user_id)
+    except (ValueError, TypeError):
+        return uuid.uuid5(USER_NAMESPACE, user_id)
+
+
+class UserService:
+    """Registers users on first ingestion.
+    
+    Users known to exist are remembered in a bounded in-process cache,
+    so repeat ingestion skips the database. Unknown users are inserted
+    with ON CONFLICT DO NOTHING, so concurrent first requests for one
+    user don't race on the primary key.
+    """
+    
+    def __init__(self):
+        self.known_users = LRUCache(settings.USER_CACHE_MAX_ENTRIES)
+    
+    async def ensure_user(self, db: AsyncSession, user_id: str) -> uuid.UUID:
+        """Make sure the user exists and return their UUID."""
+        user_uuid = to_user_uuid(user_id)
+        if user_uuid in self.known_users:
+            return user_uuid
+        
+        await db.execute(
+            insert(User)
+            .values(id=user_uuid, email=f"{user_id}@twinmind.local")
+            .on_conflict_do_nothing()
+        )
+        # Only remembered once committed; a rolled back insert leaves no user
+        db.info.setdefault("registered_users", set()).add(user_uuid)
+        return user_uuid
+
+
+user_service = UserService()
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_registered_users(session: Session):
+    for registered in session.info.pop("registered_users", ()):
+        user_service.known_users.set(registered, True)
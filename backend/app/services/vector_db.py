@@ -3,10 +3,17 @@ Vector database service using Qdrant.
 """
 from typing import List, Optional, Dict, Any
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, Range, MatchValue
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, Filter, FieldCondition, Range, MatchValue, MatchAny, FilterSelector,
+    SearchRequest, PayloadSchemaType, IsEmptyCondition, PayloadField
+)
 from app.config import settings
+import asyncio
+import logging
 import uuid
 
+logger = logging.getLogger(__name__)
+
 
 class VectorDB:
     """Vector database client for Qdrant."""
@@ -47,6 +54,28 @@ class VectorDB:
             except Exception:
                 # Collection already exists, that's fine
                 pass
+        
+        self._ensure_payload_indexes()
+    
+    def _ensure_payload_indexes(self):
+        """Index the payload fields every search filters on.
+        
+        Without these Qdrant checks user_id and effective_ts point by point;
+        creating an index that already exists is a no-op.
+        """
+        for field_name, schema in (
+            ("user_id", PayloadSchemaType.KEYWORD),
+            ("source_id", PayloadSchemaType.KEYWORD),
+            ("effective_ts", PayloadSchemaType.FLOAT),
+        ):
+            try:
+                self.client.create_payload_index(
+                    collection_name=self.collection_name,
+                    field_name=field_name,
+                    field_schema=schema
+                )
+            except Exception as e:
+                logger.warning(f"Could not create payload index on {field_name}: {e}")
     
     async def upsert_chunk(
         self,
@@ -70,10 +99,54 @@ class VectorDB:
         query_vector: List[float],
         user_id: str,
         top_k: int = 20,
-        filters: Optional[Dict[str, Any]] = None
+        filters: Optional[Dict[str, Any]] = None,
+        with_vectors: bool = False
     ) -> List[Dict[str, Any]]:
-        """Search for similar chunks."""
-        # Build filter
+        """Search for similar chunks, optionally returning their vectors."""
+        query_filter = self._build_filter(user_id, filters)
+        
+        # Perform search off the event loop (QdrantClient is synchronous)
+        results = await asyncio.to_thread(
+            self.client.search,
+            collection_name=self.collection_name,
+            query_vector=query_vector,
+            limit=top_k,
+            query_filter=query_filter,
+            with_vectors=with_vectors
+        )
+        
+        return [self._to_result(result, with_vectors) for result in results]
+    
+    async def search_batch(
+        self,
+        searches: List[Dict[str, Any]],
+        user_id: str,
+        top_k: int = 20,
+        with_vectors: bool = False
+    ) -> List[List[Dict[str, Any]]]:
+        """Run several searches ({"query_vector", "filters"}) in one request."""
+        requests = [
+            SearchRequest(
+                vector=search["query_vector"],
+                filter=self._build_filter(user_id, search.get("filters")),
+                limit=top_k,
+                with_payload=True,
+                with_vector=with_vectors
+            )
+            for search in searches
+        ]
+        batches = await asyncio.to_thread(
+            self.client.search_batch,
+            collection_name=self.collection_name,
+            requests=requests
+        )
+        return [
+            [self._to_result(result, with_vectors) for result in results]
+            for results in batches
+        ]
+    
+    def _build_filter(self, user_id: str, filters: Optional[Dict[str, Any]]) -> Filter:
+        """Build the Qdrant filter for a user's search."""
         must_conditions = [
             FieldCondition(key="user_id", match=MatchValue(value=str(user_id)))
         ]
@@ -81,41 +154,73 @@ class VectorDB:
         # Add temporal filter if provided
         if filters and "timestamp_range" in filters:
             time_range = filters["timestamp_range"]
+            # Epoch seconds of the source's effective timestamp, set at ingestion
             timestamp_filter = FieldCondition(
-                key="timestamp",
+                key="effective_ts",
                 range=Range(
                     gte=time_range.get("start"),
                     lte=time_range.get("end")
                 )
             )
+            if settings.TIME_FILTER_MATCH_MISSING_TS:
+                # Points ingested before effective_ts existed, until
+                # app.tools.backfill_effective_ts has run
+                timestamp_filter = Filter(should=[
+                    timestamp_filter,
+                    IsEmptyCondition(is_empty=PayloadField(key="effective_ts"))
+                ])
             must_conditions.append(timestamp_filter)
         
-        query_filter = Filter(must=must_conditions) if must_conditions else None
+        return Filter(must=must_conditions)
+    
+    def _to_result(self, result, with_vectors: bool) -> Dict[str, Any]:
+        """Convert a scored point to a search result dict."""
+        return {
+            "chunk_id": str(result.id),
+            "score": result.score,
+            "payload": result.payload,
+            **({"vector": result.vector} if with_vectors else {})
+        }
+    
+    async def get_vectors(self, chunk_ids: List[str]) -> Dict[str, List[float]]:
+        """Fetch stored vectors for chunks by id."""
+        if not chunk_ids:
+            return {}
         
-        # Perform search
-        results = self.client.search(
+        points = await asyncio.to_thread(
+            self.client.retrieve,
             collection_name=self.collection_name,
-            query_vector=query_vector,
-            limit=top_k,
-            query_filter=query_filter
+            ids=chunk_ids,
+            with_payload=False,
+            with_vectors=True
         )
-        
-        return [
-            {
-                "chunk_id": str(result.id),
-                "score": result.score,
-                "payload": result.payload
-            }
-            for result in results
-        ]
+        return {str(point.id): point.vector for point in points}
     
-    async def delete_chunks_by_source(self, source_id: str):
-        """Delete all chunks associated with a source."""
-        # Qdrant doesn't support direct deletion by payload, so we need to
-        # find and delete points. For now, we'll mark for deletion or handle at application level.
-        # In production, we'd use scroll + delete or maintain an index.
-        pass
-
+    async def set_source_payload(self, source_id: str, payload: Dict[str, Any], wait: bool = True):
+        """Set payload fields on every chunk of a source."""
+        await asyncio.to_thread(
+            self.client.set_payload,
+            collection_name=self.collection_name,
+            payload=payload,
+            points=Filter(must=[FieldCondition(key="source_id", match=MatchValue(value=str(source_id)))]),
+            wait=wait
+        )
+    
+    async def delete_chunks_by_sources(self, source_ids: List[str], wait: bool = True):
+        """
+        Delete all chunks of the given sources with one filtered delete.
+        With wait=False Qdrant applies it in the background.
+        """
+        await asyncio.to_thread(
+            self.client.delete,
+            collection_name=self.collection_name,
+            points_selector=FilterSelector(
+                filter=Filter(must=[
+                    FieldCondition(key="source_id", match=MatchAny(any=[str(source_id) for source_id in source_ids]))
+                ])
+            ),
+            wait=wait
+        )
 
 vector_db = VectorDB()
 
@@ -0,0 +1 @@
+# Operational tools, run with python -m app.tools.<name>
@@ -0,0 +1,62 @@
+"""
+Backfill chunks.user_id from the owning sources.
+    
+    python -m app.tools.backfill_chunk_user_id [--batch-size 5000]
+
+Walks chunks in primary key order, one batch per autocommitted UPDATE,
+so it can run against a live database after migration 0002 and be
+stopped and resumed at any point. Migration 0003 runs the same backfill
+for whatever is left.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+import argparse
+import asyncio
+import time
+import uuid
+
+DEFAULT_BATCH_SIZE = 5000
+
+_NEXT_BATCH = text(
+    "SELECT id FROM chunks WHERE id > :after ORDER BY id LIMIT :batch_size"
+)
+_FILL_BATCH = text(
+    "UPDATE chunks SET user_id = sources.user_id FROM sources "
+    "WHERE chunks.source_id = sources.id AND chunks.id = ANY(:ids) AND chunks.user_id IS NULL"
+)
+
+
+def backfill_chunk_user_ids(connection: Connection, batch_size: int = DEFAULT_BATCH_SIZE, log=print) -> int:
+    """
+    Fill chunks.user_id batch by batch on an autocommit connection.
+    Returns the number of rows updated.
+    """
+    after = uuid.UUID(int=0)
+    updated = 0
+    started = time.monotonic()
+    while True:
+        ids = connection.execute(_NEXT_BATCH, {"after": after, "batch_size": batch_size}).scalars().all()
+        if not ids:
+            break
+        updated += connection.execute(_FILL_BATCH, {"ids": ids}).rowcount
+        after = ids[-1]
+        log(f"chunks.user_id backfill: {updated} rows updated, at {after} ({time.monotonic() - started:.0f}s)")
+    return updated
+
+
+async def main():
+    from app.database import engine
+    
+    parser = argparse.ArgumentParser(description="Backfill chunks.user_id from sources.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+    
+    async with engine.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        updated = await connection.run_sync(backfill_chunk_user_ids, args.batch_size)
+    await engine.dispose()
+    print(f"Done: {updated} rows updated")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
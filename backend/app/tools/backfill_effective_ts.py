@@ -0,0 +1,59 @@
+"""
+Backfill the effective_ts payload of vectors ingested before it existed.
+    
+    python -m app.tools.backfill_effective_ts [--batch-size 500]
+
+Walks sources in id order and sets effective_ts, the epoch seconds of
+coalesce(source_timestamp, ingestion_timestamp), on every chunk of each
+source with one filtered set_payload. Safe to stop and re-run. Once it
+has finished, set TIME_FILTER_MATCH_MISSING_TS=false so time-scoped
+vector searches stop matching points without the field.
+"""
+from sqlalchemy import select
+import argparse
+import asyncio
+import time
+import uuid
+
+from app.database import AsyncSessionLocal
+from app.models import Source
+from app.services.temporal import effective_timestamp, to_epoch
+from app.services.vector_db import vector_db
+
+DEFAULT_BATCH_SIZE = 500
+
+
+async def backfill_effective_ts(batch_size: int = DEFAULT_BATCH_SIZE, log=print) -> int:
+    """Set effective_ts on the chunks of every source. Returns the number of sources."""
+    after = uuid.UUID(int=0)
+    updated = 0
+    started = time.monotonic()
+    while True:
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(
+                select(Source.id, effective_timestamp().label("effective_ts"))
+                .where(Source.id > after)
+                .order_by(Source.id)
+                .limit(batch_size)
+            )).all()
+        if not rows:
+            break
+        for row in rows:
+            # Queued without waiting; Qdrant applies updates in order
+            await vector_db.set_source_payload(str(row.id), {"effective_ts": to_epoch(row.effective_ts)}, wait=False)
+        updated += len(rows)
+        after = rows[-1].id
+        log(f"effective_ts backfill: {updated} sources updated, at {after} ({time.monotonic() - started:.0f}s)")
+    return updated
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Backfill effective_ts in vector payloads.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+    updated = await backfill_effective_ts(args.batch_size)
+    print(f"Done: {updated} sources updated")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
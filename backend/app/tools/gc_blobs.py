@@ -0,0 +1,70 @@
+"""
+Remove content-addressed blobs that no source references.
+    
+    python -m app.tools.gc_blobs [--dry-run]
+
+A blob's reference count is the number of sources whose
+object_storage_key is its key (sources awaiting purge still count).
+Blobs uploaded within STORAGE_GC_GRACE_SECONDS are kept, so an upload
+whose source isn't committed yet, or whose object is still being
+written, never loses its blob. Each blob is re-checked under its row
+lock before deletion, which an upload reusing it waits on.
+"""
+from datetime import timedelta
+from sqlalchemy import and_, delete, exists, func, select
+import argparse
+import asyncio
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import Blob, Source
+from app.services.storage import storage_service
+
+
+def _collectable():
+    """Blobs no source references, unused for the grace period."""
+    return and_(
+        Blob.last_used_at < func.now() - timedelta(seconds=settings.STORAGE_GC_GRACE_SECONDS),
+        ~exists().where(Source.object_storage_key == Blob.key)
+    )
+
+
+async def collect_garbage(dry_run: bool = False, log=print) -> int:
+    """Delete collectable blobs. Returns how many were (or would be) deleted."""
+    async with AsyncSessionLocal() as session:
+        keys = (await session.execute(select(Blob.key).where(_collectable()))).scalars().all()
+    if dry_run:
+        for key in keys:
+            log(f"Would delete {key}")
+        log(f"{len(keys)} unreferenced blobs past the grace period")
+        return len(keys)
+    
+    deleted = 0
+    for key in keys:
+        async with AsyncSessionLocal() as session:
+            # Skipped if an upload reused it since, or holds it now
+            locked = (await session.execute(
+                select(Blob.key)
+                .where(Blob.key == key, _collectable())
+                .with_for_update(of=Blob, skip_locked=True)
+            )).scalar()
+            if locked is None:
+                continue
+            # The row goes only once the object is gone; a failed delete is retried next run
+            await storage_service.delete_file(key)
+            await session.execute(delete(Blob).where(Blob.key == key))
+            await session.commit()
+            deleted += 1
+    log(f"Deleted {deleted} of {len(keys)} unreferenced blobs past the grace period")
+    return deleted
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Remove unreferenced content-addressed blobs.")
+    parser.add_argument("--dry-run", action="store_true", help="List blobs instead of deleting them")
+    args = parser.parse_args()
+    await collect_garbage(args.dry_run)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
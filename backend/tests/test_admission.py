@@ -0,0 +1,45 @@
+import asyncio
+
+from app.services.admission import AdmissionController, Priority, _ProviderGate
+
+
+def test_waiters_are_admitted_by_priority_then_arrival():
+    async def run():
+        controller = AdmissionController()
+        controller.gates["test"] = _ProviderGate(1)
+        admitted = []
+        release = asyncio.Event()
+        
+        async def generate(name, priority):
+            async with controller.slot("test", priority):
+                admitted.append(name)
+                if name == "first":
+                    await release.wait()
+        
+        first = asyncio.create_task(generate("first", Priority.INTERACTIVE))
+        await asyncio.sleep(0)
+        waiters = []
+        for name, priority in [
+            ("batch-1", Priority.BATCH),
+            ("interactive-1", Priority.INTERACTIVE),
+            ("batch-2", Priority.BATCH),
+            ("interactive-2", Priority.INTERACTIVE),
+        ]:
+            waiters.append(asyncio.create_task(generate(name, priority)))
+            await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(first, *waiters)
+        return admitted
+    
+    assert asyncio.run(run()) == ["first", "interactive-1", "interactive-2", "batch-1", "batch-2"]
+
+
+def test_free_slots_admit_at_once():
+    async def run():
+        controller = AdmissionController()
+        controller.gates["test"] = _ProviderGate(2)
+        async with controller.slot("test"):
+            async with controller.slot("test", Priority.BATCH):
+                return controller.gates["test"].active
+    
+    assert asyncio.run(run()) == 2
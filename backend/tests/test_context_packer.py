@@ -0,0 +1,37 @@
+from app.services.context_packer import join_chunks, strip_overlap
+
+OVERLAP = "This sentence is shared by both adjacent chunks. "
+
+
+def test_strip_overlap_removes_the_repeated_boundary():
+    previous = "The first chunk starts here. " + OVERLAP
+    text = OVERLAP + "The second chunk continues."
+    assert strip_overlap(previous, text) == "The second chunk continues."
+
+
+def test_short_matches_are_not_overlap():
+    assert strip_overlap("ends with a word", "word starts the next") == "word starts the next"
+
+
+def test_no_overlap_keeps_text():
+    previous = "A completely different chunk of text that is long enough."
+    text = "Another chunk with nothing in common at its start at all."
+    assert strip_overlap(previous, text) == text
+
+
+def test_join_chunks_drops_overlaps():
+    texts = [
+        "The first chunk starts here. " + OVERLAP,
+        OVERLAP + "The second chunk continues."
+    ]
+    assert join_chunks(texts) == "The first chunk starts here. " + OVERLAP + "\n\nThe second chunk continues."
+
+
+def test_join_chunks_skips_chunks_that_are_all_overlap():
+    texts = ["The first chunk starts here. " + OVERLAP, OVERLAP]
+    assert join_chunks(texts) == texts[0]
+
+
+def test_join_chunks_edge_cases():
+    assert join_chunks([]) == ""
+    assert join_chunks(["only one"]) == "only one"
@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from app.services.fusion import FUSION_STRATEGIES, FusionEngine
+
+
+def _engine():
+    engine = FusionEngine()
+    engine.register_retriever("vector", 0.7)
+    engine.register_retriever("keyword", 0.3)
+    return engine
+
+
+def _results(seed):
+    rng = random.Random(seed)
+    ids = [f"chunk-{i}" for i in range(60)]
+    return {
+        "vector": [{"chunk_id": chunk_id, "score": rng.random()} for chunk_id in rng.sample(ids, 40)],
+        "keyword": [{"chunk_id": chunk_id, "score": rng.uniform(0, 5)} for chunk_id in rng.sample(ids, 25)]
+    }
+
+
+@pytest.mark.parametrize("strategy", FUSION_STRATEGIES)
+@pytest.mark.parametrize("seed", range(5))
+def test_numpy_matches_python(strategy, seed):
+    engine = _engine()
+    results = _results(seed)
+    expected = engine._fuse_python(results, 1000, strategy)
+    actual = engine._fuse_numpy(results, 1000, strategy)
+    
+    assert len(actual) == len(expected)
+    expected_by_id = {entry["chunk_id"]: entry for entry in expected}
+    for entry in actual:
+        reference = expected_by_id[entry["chunk_id"]]
+        assert set(entry) == set(reference)
+        for key, value in entry.items():
+            if key != "chunk_id":
+                assert value == pytest.approx(reference[key])
+
+
+@pytest.mark.parametrize("strategy", FUSION_STRATEGIES)
+def test_numpy_matches_python_top_k(strategy):
+    engine = _engine()
+    results = _results(42)
+    expected = engine._fuse_python(results, 10, strategy)
+    actual = engine._fuse_numpy(results, 10, strategy)
+    
+    assert [entry["score"] for entry in actual] == pytest.approx([entry["score"] for entry in expected])
+    assert [entry["chunk_id"] for entry in actual] == [entry["chunk_id"] for entry in expected]
+
+
+def test_zscore_charges_missing_candidates_the_floor():
+    engine = _engine()
+    fused = engine.fuse(
+        {
+            "vector": [{"chunk_id": "a", "score": 1.0}, {"chunk_id": "b", "score": 0.0}],
+            "keyword": [{"chunk_id": "b", "score": 2.0}, {"chunk_id": "c", "score": 1.0}]
+        },
+        top_k=3,
+        strategy="zscore"
+    )
+    scores = {entry["chunk_id"]: entry["score"] for entry in fused}
+    # Per retriever z-scores are +-1, so the floor is -2
+    assert scores["a"] == pytest.approx(0.7 * 1 + 0.3 * -2)
+    assert scores["b"] == pytest.approx(0.7 * -1 + 0.3 * 1)
+    assert scores["c"] == pytest.approx(0.7 * -2 + 0.3 * -1)
+
+
+def test_unregistered_retriever_is_rejected():
+    with pytest.raises(ValueError):
+        _engine().fuse({"unknown": [{"chunk_id": "a", "score": 1.0}]}, top_k=1)
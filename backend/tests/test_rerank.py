@@ -0,0 +1,46 @@
+import numpy as np
+
+from app.services.rerank import MMRReranker
+
+
+def _candidates(n):
+    return [{"chunk_id": f"chunk-{i}", "score": float(n - i)} for i in range(n)]
+
+
+def test_lambda_one_keeps_relevance_order():
+    rng = np.random.default_rng(0)
+    candidates = _candidates(20)
+    vectors = {c["chunk_id"]: rng.normal(size=8).tolist() for c in candidates}
+    
+    reranked = MMRReranker().rerank(candidates, vectors, top_k=10, lambda_mult=1.0)
+    
+    assert [c["chunk_id"] for c in reranked] == [c["chunk_id"] for c in candidates[:10]]
+
+
+def test_near_duplicates_are_demoted():
+    candidates = _candidates(3)
+    vectors = {
+        "chunk-0": [1.0, 0.0],
+        "chunk-1": [1.0, 0.01],  # Almost the same as chunk-0
+        "chunk-2": [0.0, 1.0]
+    }
+    
+    reranked = MMRReranker().rerank(candidates, vectors, top_k=2, lambda_mult=0.5)
+    
+    assert [c["chunk_id"] for c in reranked] == ["chunk-0", "chunk-2"]
+
+
+def test_per_source_cap():
+    candidates = _candidates(4)
+    vectors = {c["chunk_id"]: None for c in candidates}
+    source_ids = {"chunk-0": "a", "chunk-1": "a", "chunk-2": "a", "chunk-3": "b"}
+    
+    reranked = MMRReranker().rerank(
+        candidates, vectors, top_k=4, lambda_mult=1.0, source_ids=source_ids, per_source_cap=2
+    )
+    
+    assert [c["chunk_id"] for c in reranked] == ["chunk-0", "chunk-1", "chunk-3"]
+
+
+def test_empty():
+    assert MMRReranker().rerank([], {}, top_k=5, lambda_mult=0.5) == []
@@ -0,0 +1,58 @@
+import asyncio
+
+import orjson
+
+from app.api.streaming import event_stream
+
+
+class _Request:
+    async def is_disconnected(self):
+        return False
+
+
+async def _events(items):
+    for item in items:
+        yield item
+
+
+def _frames(items):
+    async def run():
+        return [frame async for frame in event_stream(_Request(), _events(items))]
+    return asyncio.run(run())
+
+
+def _payloads(frames):
+    return [orjson.loads(frame[len(b"data: "):]) for frame in frames]
+
+
+def test_content_deltas_are_coalesced():
+    frames = _frames([{"content": "Hel"}, {"content": "lo"}, {"content": " world"}])
+    assert _payloads(frames) == [{"content": "Hello world"}]
+
+
+def test_other_events_flush_pending_content_in_order():
+    frames = _frames([
+        {"sources": []},
+        {"content": "a"},
+        {"content": "b"},
+        {"done": True},
+    ])
+    assert _payloads(frames) == [{"sources": []}, {"content": "ab"}, {"done": True}]
+
+
+def test_producer_errors_are_raised_after_flushing():
+    async def failing():
+        yield {"content": "partial"}
+        raise RuntimeError("boom")
+    
+    async def run():
+        frames = []
+        try:
+            async for frame in event_stream(_Request(), failing()):
+                frames.append(frame)
+        except RuntimeError as e:
+            return frames, str(e)
+    
+    frames, error = asyncio.run(run())
+    assert _payloads(frames) == [{"content": "partial"}]
+    assert error == "boom"
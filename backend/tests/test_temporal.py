@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from app.services.temporal import TemporalParser
+
+NEW_YORK = ZoneInfo("America/New_York")
+# Thursday 2024-03-14, 22:00 in New York but already Friday in UTC
+NOW = datetime(2024, 3, 15, 2, 0, tzinfo=timezone.utc)
+
+
+def _parse(query):
+    return TemporalParser().parse(query, timezone="America/New_York", now=NOW)
+
+
+def test_last_weekday_is_a_whole_local_day():
+    time_range = _parse("what did I do last Tuesday?")
+    assert time_range.start == datetime(2024, 3, 12, tzinfo=NEW_YORK)
+    assert time_range.end == datetime(2024, 3, 12, 23, 59, 59, 999999, tzinfo=NEW_YORK)
+
+
+def test_last_weekday_never_today():
+    # Today is Thursday in New York
+    time_range = _parse("notes from last thursday")
+    assert time_range.start == datetime(2024, 3, 7, tzinfo=NEW_YORK)
+
+
+def test_last_week():
+    time_range = _parse("meetings last week")
+    assert time_range.end == NOW
+    assert time_range.end - time_range.start == timedelta(days=7)
+
+
+def test_this_week_starts_on_local_monday():
+    time_range = _parse("todo this week")
+    assert time_range.start == datetime(2024, 3, 11, tzinfo=NEW_YORK)
+    assert time_range.end == NOW
+
+
+def test_this_month():
+    assert _parse("spending this month").start == datetime(2024, 3, 1, tzinfo=NEW_YORK)
+
+
+def test_year():
+    time_range = _parse("trips in 2023")
+    assert time_range.start == datetime(2023, 1, 1, tzinfo=NEW_YORK)
+    assert time_range.end == datetime(2023, 12, 31, 23, 59, 59, 999999, tzinfo=NEW_YORK)
+
+
+@pytest.mark.parametrize("query, start, end", [
+    ("emails before March 15, 2024", None, datetime(2024, 3, 14, 23, 59, 59, 999999, tzinfo=NEW_YORK)),
+    ("emails after March 15, 2024", datetime(2024, 3, 16, tzinfo=NEW_YORK), None),
+])
+def test_before_and_after(query, start, end):
+    time_range = _parse(query)
+    assert time_range.start == start
+    assert time_range.end == end
+
+
+def test_no_expression():
+    assert _parse("what is my wifi password") is None